@@ -1,27 +1,34 @@
 from django.urls import re_path as url
-from custom.ucasal2.utils import default_permissions, traceback_ret, encodeJSON, getJsonBody, decodeUTF8
-from custom.ucasal2.utils import METHOD_NOT_ALLOWED
-from custom.ucasal2.utils import ActaStates 
+from ucasal2.utils import default_permissions, traceback_ret, encodeJSON, getJsonBody, decodeUTF8
+from ucasal2.utils import METHOD_NOT_ALLOWED
+from ucasal2.utils import ActaStates 
 from custom.sp_libs.python.logging import SpLogger
 from custom.sp_libs.sp_django.sp_totp_generator import TOTPGenerator
 from custom.sp_libs.sp_athento.sp_form_totp_notifier import SpFormTotpNotifier
 from custom.sp_libs.sp_athento.sp_athento_config import SpAthentoConfig as AC
-from custom.ucasal2.utils import UcasalConfig
-from custom.ucasal2.utils import get_totp_key
+from ucasal2.utils import UcasalConfig
+from ucasal2.utils import get_totp_key
+from ucasal2.utils import get_pdf_hash, save_signed_pdf, qr_image_path
 from django.http import HttpResponse
 from file.models import File
 from core.exceptions import AthentoseError
-from django.core.files import File as FileObject
 from custom.sp_libs.python.sp_pdf_otp_simple_signer.sp_pdf_otp_simple_signer import SpPdfSimpleSigner, QRInfo, OTPInfo
-from custom.ucasal2.external_services.ucasal.ucasal_services import UcasalServices
-from custom.ucasal2.utils import uuid_previo_metadata_name
-from custom.ucasal2.model.exceptions.invalid_otp_error import InvalidOtpError
+from ucasal2.external_services.ucasal.ucasal_services import UcasalServices
+from ucasal2.external_services.ucasal.qr_cache import UcasalQrCache
+from ucasal2.external_services.ucasal.local_qr_renderer import LocalQrRenderer
+from ucasal2.external_services.ucasal.bfa_anchoring import BfaAnchoring
+from ucasal2.external_services.ucasal.outbox import UcasalOutbox
+from ucasal2.external_services.ucasal.document_hashes import DocumentHashIndex
+from ucasal2.external_services.ucasal.signing_journal import SigningJournal
+from ucasal2.utils import uuid_previo_metadata_name
+from ucasal2.model.exceptions.invalid_otp_error import InvalidOtpError
+from ucasal2.model.exceptions.stage_timeout_error import StageTimeoutError
+from ucasal2.model.stage_pipeline import StagePipeline
+from ucasal2.model.signature_overlay import SignatureOverlay
 
 from datetime import datetime
 import pytz
-from tempfile import NamedTemporaryFile
-from django.conf import settings
-import hashlib
+from django.db import transaction
 from posixpath import join as urljoin
 import os
 
@@ -92,7 +99,14 @@ def qr(request):
     if request.method != 'GET':
         return  logger.exit(METHOD_NOT_ALLOWED)      
 
-    bytes = UcasalServices.get_qr_image(url=body['url'])
+    # 'engine' permite forzar el generador ('local' o 'remote') para comparar ambos
+    engine = body.get('engine')
+    if engine == 'remote':
+        bytes = UcasalServices.get_remote_qr_image(url=body['url'])
+    elif engine == 'local':
+        bytes = LocalQrRenderer.render(url=body['url'])
+    else:
+        bytes = UcasalServices.get_qr_image(url=body['url'])
 
     return HttpResponse(
         bytes,
@@ -141,55 +155,12 @@ def bfaresponse(request, uuid):
         
         body = getJsonBody(request)
 
-        ## Validaciones
-
-        # Validar 'status' del body
-        result = body.get('status')
-        if result not in ['success', 'failure']:
-            raise AthentoseError(f"'status' debe ser 'success' o 'failure' en lugar de {result}")
-    
-        
-        # Validar existencia y doctype del UUID recibido
+        # Validar existencia del UUID recibido
         fil = _get_acta(uuid)
         if not fil:
             raise FileNotFoundError(f"El acta '{uuid}' no existe")
-        
-        if not fil.doctype.name == 'acta':
-            raise AthentoseError(f"El documento con uuid '{uuid}' es de tipo '{fil.doctype.label}' en lugar de 'Acta'")
 
-        # Verificar estados válidos del acta
-        lifecycle_state = fil.life_cycle_state.name
-        valid_states = [ActaStates.pendiente_blockchain, ActaStates.fallo_blockchain]
-        if not lifecycle_state in valid_states:
-            raise AthentoseError(f"Sólo se puede registrar el resultado de blockchain si el acta encuentra en los estados {' o '.join(valid_states)}, pero el estado actual es '{lifecycle_state}'.")
-
-
-        # Guardar fecha de firma
-        tz = pytz.timezone('America/Argentina/Buenos_Aires')
-        date_str = datetime.now(tz=tz).strftime('%Y-%m-%d')    
-            
-        fil.set_metadata('metadata.acta_fecha_firma', date_str, overwrite=True)
-
-        ## Registrar el sello como feature (tanto por éxito como error en BFA)
-        # Setear el feature
-        fil.set_feature('bfa.result', encodeJSON(body))
-        
-        # Cambiar ciclo de vida 
-        if result == 'success':
-            # Notificar a UCASAL el registro exitoso en blockchain
-            auth_token = UcasalServices.get_auth_token(user=UcasalConfig.token_svc_user(), password = UcasalConfig.token_svc_password())
-            UcasalServices.notify_blockchain_success(auth_token=auth_token, uuid=fil.uuid)
-            
-            #TODO: ¿validar que el sello corresponda al hash?
-            #TODO: ¿validar que el sello no haya sido previamente registrado el sello?
-            #fil.set_metadata('metadata.acta_resultado_bfa', 'exitoso', overwrite=True)
-            fil.change_life_cycle_state(ActaStates.firmada) #, force_transition=True)
-        else:
-            #TODO: ¿qué hacemos en caso de falla?
-            #fil.set_metadata('metadata.acta_resultado_bfa', 'fallido', overwrite=True)
-            fil.change_life_cycle_state(ActaStates.fallo_blockchain) #, force_transition=True)
-
-        fil.set_feature('registro.en.blockchain', result)
+        apply_bfa_result(fil, body)
 
         return logger.exit(HttpResponse(
             'Resultado BFA guardado exitosamente'
@@ -214,6 +185,56 @@ def bfaresponse(request, uuid):
             status='500'
         ), exc_info=True)
 
+## Registra en el acta el resultado de BFA. Lo usan bfaresponse y el anclaje por árbol de Merkle
+def apply_bfa_result(fil:File, body:dict)->str:
+    ## Validaciones
+
+    # Validar 'status' del body
+    result = body.get('status')
+    if result not in ['success', 'failure']:
+        raise AthentoseError(f"'status' debe ser 'success' o 'failure' en lugar de {result}")
+
+    # Validar doctype
+    if not fil.doctype.name == 'acta':
+        raise AthentoseError(f"El documento con uuid '{fil.uuid}' es de tipo '{fil.doctype.label}' en lugar de 'Acta'")
+
+    # Verificar estados válidos del acta
+    lifecycle_state = fil.life_cycle_state.name
+    valid_states = [ActaStates.pendiente_blockchain, ActaStates.fallo_blockchain]
+    if not lifecycle_state in valid_states:
+        raise AthentoseError(f"Sólo se puede registrar el resultado de blockchain si el acta encuentra en los estados {' o '.join(valid_states)}, pero el estado actual es '{lifecycle_state}'.")
+
+
+    # Guardar fecha de firma
+    tz = pytz.timezone('America/Argentina/Buenos_Aires')
+    date_str = datetime.now(tz=tz).strftime('%Y-%m-%d')    
+        
+    fil.set_metadata('metadata.acta_fecha_firma', date_str, overwrite=True)
+
+    ## Registrar el sello como feature (tanto por éxito como error en BFA)
+    # Setear el feature
+    fil.set_feature('bfa.result', encodeJSON(body))
+    
+    # Cambiar ciclo de vida 
+    if result == 'success':
+        #TODO: ¿validar que el sello corresponda al hash?
+        #TODO: ¿validar que el sello no haya sido previamente registrado el sello?
+        #fil.set_metadata('metadata.acta_resultado_bfa', 'exitoso', overwrite=True)
+        with transaction.atomic():
+            fil.change_life_cycle_state(ActaStates.firmada) #, force_transition=True)
+            # Notificar a UCASAL el registro exitoso en blockchain (por medio del outbox)
+            UcasalOutbox.notify(UcasalOutbox.ACTA_BLOCKCHAIN_SUCCESS, fil.uuid)
+    else:
+        #TODO: ¿qué hacemos en caso de falla?
+        #fil.set_metadata('metadata.acta_resultado_bfa', 'fallido', overwrite=True)
+        fil.change_life_cycle_state(ActaStates.fallo_blockchain) #, force_transition=True)
+        # El reintento de registerotp tiene que volver a registrar el hash
+        SigningJournal.discard_stages(fil.uuid, SigningJournal.FLOW_ACTA, SigningJournal.STAGE_REGISTER)
+
+    fil.set_feature('registro.en.blockchain', result)
+    DocumentHashIndex.set_bfa_status(fil.uuid, result)
+    return result
+
 @default_permissions
 @traceback_ret
 ## Valida el OTP ingresado por el docente, firma el PDF y envía el hash a BFA 
@@ -261,110 +282,58 @@ def registerotp(request, uuid):
         if(not _is_non_empty_string(mail_docente)):
             raise AthentoseError(f"El mail del docente debe ser un string no vacío en lugar de '{mail_docente}'")
         
-        UcasalServices.validate_otp(user=mail_docente, otp=otp)
-
-        # Obtener token de autenticación de UCASAL
-        auth_token = UcasalServices.get_auth_token(user=UcasalConfig.token_svc_user(), password = UcasalConfig.token_svc_password())
-
         # Verificar si el documento ya fue firmado con OTP
         firmada_con_opt = fil.gfv('firmada.con.OTP')
-        # Validar IP
-        if not firmada_con_opt == "1":
+        firmar = not firmada_con_opt == "1"
+        # Un intento anterior pudo guardar el PDF firmado y cortarse antes de marcarlo: no se vuelve a firmar
+        journal = SigningJournal(fil.uuid, SigningJournal.FLOW_ACTA)
+        if firmar and journal.signed_hash(fil):
+            logger.debug('El diario indica que el acta ya se firmó en un intento anterior')
+            fil.set_feature('firmada.con.OTP', "1")
+            firmar = False
+        if firmar:
+            otp_info = _get_otp_info(body, mail_docente)
+
+        callback_url = urljoin(request.build_absolute_uri('/'), 'ucasal2/api/actas/', str(fil.uuid), 'bfaresponse')
+
+        ## Etapas de la firma. Sólo el token se obtiene en paralelo a la validación del OTP: URL corta, QR y firma
+        ## esperan a que el OTP sea válido, así un OTP inválido no genera llamadas a UCASAL ni firma el PDF.
+        def budget(stage:str, default:float)->float:
+            return UcasalConfig.pipeline_stage_budget_seconds('actas.registerotp', stage, default)
+
+        pipeline = StagePipeline('actas.registerotp')
+        pipeline.stage('validate_otp', lambda deps: UcasalServices.validate_otp(user=mail_docente, otp=otp), budget_seconds=budget('validate_otp', 15))
+        # Obtener token de autenticación de UCASAL
+        pipeline.stage('auth_token', lambda deps: UcasalServices.get_auth_token(user=UcasalConfig.token_svc_user(), password = UcasalConfig.token_svc_password()), budget_seconds=budget('auth_token', 15))
+        if firmar:
             logger.debug('Firmando acta con OTP...')
-            ip = body.get('ip')
-            if(not isinstance(ip, str) or len(ip.strip())==0):
-                raise AthentoseError("'ip' debe ser un string no vacío")
-
-            # Validar latitude
-            latitude = body.get('latitude')
-            if not isinstance(latitude, (int, float)):
-                raise AthentoseError("'latitude' debe ser un entero o un float")
-
-            # Validar longitude
-            longitude = body.get('longitude')
-            if not isinstance(longitude, (int, float)):
-                raise AthentoseError("'longitude' debe ser un entero o un float")
-            
-            # Validar accuracy
-            accuracy = body.get('accuracy')
-            if(not isinstance(accuracy, str) or len(accuracy.strip())==0):
-                raise AthentoseError("'accuracy' debe ser un string no vacío")     
-
-            # Validar user_agent
-            user_agent = body.get('user_agent')
-            if not isinstance(user_agent, str) or len(user_agent.strip())==0:
-                raise AthentoseError("'user_agent' debe ser un string no vacío")
-
-            ## Agregar QR e info de OTP al PDF
-            # Obtener QR image
             url_to_shorten = UcasalConfig.acta_validation_url_template().replace('{{uuid}}', str(fil.uuid))
-            short_url = UcasalServices.get_short_url(auth_token=auth_token, url=url_to_shorten)
-            qr_stream = UcasalServices.get_qr_image(url=short_url)
-            #TODO: confirmar extensión del qr
-            qr_image_tmp_path = f'/var/www/athentose/media/tmp/ucasal2_qr_{fil.uuid}.png'
-            with open(qr_image_tmp_path, 'wb') as qr_file:
-                qr_file.write(qr_stream)
-
-            # Generar QR info
-            nombre_docente = fil.gmv('metadata.acta_nombre_docente_asignado')
-            mail_docente_ofuscado = _get_mail_for_otp(mail_docente)
-            fecha_firma = _get_arg_time()
-            qr_text = f"Firmado con OTP por:\r\n{nombre_docente}\r\n{mail_docente_ofuscado}\r\n{fecha_firma}"
-            qr_info = QRInfo(
-                image_path=qr_image_tmp_path,
-                image_text=qr_text,
-                x=10, y=10, width=40, height=40
-            )
-            logger.debug(f'QR info: {qr_info}')
-
-            # Generar OTP info
-            otp_info = OTPInfo(mail=mail_docente_ofuscado, ip=ip, latitude=latitude, longitude=longitude, accuracy=accuracy, user_agent=user_agent)
-            logger.debug(f'OTP info: {otp_info}')
-
-            # Incrustar QR y OTP en el pdf
-            signer = SpPdfSimpleSigner()
-            pdf_out_stream = signer.sign(input_pdf_path=fil.file.path, qr_info=qr_info, otp_info=otp_info)
-
-            # Borrar la imagen temporal del QR
-            _delete_file(qr_image_tmp_path)        
-
-            # actualizar binario del acta
-            with NamedTemporaryFile(dir=settings.MEDIA_TMP, suffix='.ucasal.tmp') as pdf_temp:
-                pdf_temp.write(pdf_out_stream.getbuffer())
-                fil.update_binary(FileObject(pdf_temp), fil.filename + ".pdf")
-                fil.set_feature('firmada.con.OTP', "1")
-
-            logger.debug('Acta firmada con OTP exitosamente')    
+            pipeline.stage('short_url', lambda deps: journal.short_url(lambda: UcasalQrCache.get_short_url(auth_token=deps['auth_token'], url=url_to_shorten)), depends_on=('auth_token', 'validate_otp'), budget_seconds=budget('short_url', 15))
+            pipeline.stage('qr_image', lambda deps: journal.record_qr(deps['short_url'], UcasalQrCache.get_qr_image(url=deps['short_url'])), depends_on=('short_url',), budget_seconds=budget('qr_image', 15))
+            pipeline.stage('sign', lambda deps: _sign_acta_pdf(fil, deps['qr_image'], mail_docente, otp_info), depends_on=('qr_image',), budget_seconds=budget('sign', 30), main_thread=True)
+            pipeline.stage('save', lambda deps: _save_signed_acta(fil, deps['sign'], journal), depends_on=('sign',), budget_seconds=budget('save', 30), main_thread=True)
         else:
             logger.debug('El acta ya estaba firmada con OTP. Salteamos este paso y vamos a registrar en Blockchain')
-
-        ## #TODO: Enviar PDF a sellar con BFA (por medio de un servicio de UCASAL no disponible aún)
-        # Verficar si no fue enviada previamente
-        registrada_en_blockchain = fil.gfv('registro.en.blockchain')
-
-        if(registrada_en_blockchain == 'pending'):
-            raise AthentoseError('El acta ya había sido enviada a blockchain y su resultado aún está pendiente')
-
-        if(registrada_en_blockchain == 'success'):
-            raise AthentoseError('El acta está registrada en blockchain')
-
-        # Calcular el hash del PDF
-        pdf_hash = _get_pdf_hash(fil)
-        callback_url = urljoin(request.build_absolute_uri('/'), 'ucasal2/api/actas/', str(fil.uuid), 'bfaresponse')
-        ok_response_text = UcasalServices.register_in_blockchain(auth_token=auth_token, hash=pdf_hash, file_uuid=str(fil.uuid), callback_url=callback_url)
-        fil.set_feature('ucasal.svc.ok_response', ok_response_text)
-        # Cambiar estado a Pendiente Blockchain
-        #TODO: forzar transición?
-        fil.change_life_cycle_state(ActaStates.pendiente_blockchain) #, force_transition=True)
-        fil.set_feature('registro.en.blockchain', 'pending')
-
-        return logger.exit(HttpResponse(
+        # Si se acaba de firmar, el hash sale de los bytes guardados y no se vuelve a leer el PDF del disco
+        pipeline.stage(
+            'hash', lambda deps: deps['save'] if firmar else get_pdf_hash(fil),
+            depends_on=('save',) if firmar else ('validate_otp',), budget_seconds=budget('hash', 10), main_thread=True
+        )
+        pipeline.stage(
+            'register_bfa', lambda deps: _register_acta_in_bfa(fil, deps['auth_token'], deps['hash'], callback_url, journal),
+            depends_on=('auth_token', 'hash'), budget_seconds=budget('register_bfa', 30), main_thread=True
+        )
+        pipeline.run()
+
+        response = HttpResponse(
             encodeJSON({
                 'otp_is_valid': True,
                 'callback_url': callback_url
             }), 
             content_type="application/json"
-        ))            
+        )
+        response['Server-Timing'] = pipeline.server_timing()
+        return logger.exit(response)
     except FileNotFoundError as e:
         return logger.exit(HttpResponse(
             str(e), 
@@ -380,6 +349,11 @@ def registerotp(request, uuid):
             str(e), 
             status='400'
         ), exc_info=True)
+    except StageTimeoutError as e:
+        return logger.exit(HttpResponse(
+            str(e), 
+            status='504'
+        ), exc_info=True)
     except Exception as e:
         return logger.exit(HttpResponse(
             str(e), 
@@ -442,18 +416,20 @@ def reject(request, uuid):
         # Guardar el motivo de rechazo
         #fil.set_metadata('metadata.acta_motivo_rechazo', motivo, overwrite=True)
 
-        # Notificar a UCASAL para que puedan editar el acta
-        auth_token = UcasalServices.get_auth_token(user=UcasalConfig.token_svc_user(), password = UcasalConfig.token_svc_password())
         uuid_acta_previa = str(fil.gmv(uuid_previo_metadata_name)).replace('None', '')
-        UcasalServices.notify_rejection(auth_token=auth_token, uuid=fil.uuid, previous_uuid = uuid_acta_previa, reason=motivo)
 
-        # Cambiar estado a Rechazada (aunque la borremos luego, si hay error invocando a UCASAL, al menos que rechazada en Athento)
-        #TODO: forzar transición?
-        fil.change_life_cycle_state(ActaStates.rechazada) #, force_transition=True)
-        
-        # Borrar el acta
-        fil.removed = True
-        fil.save()
+        # El cambio de estado, el borrado y la notificación a UCASAL (para que puedan editar el acta) se guardan juntos
+        with transaction.atomic():
+            # Cambiar estado a Rechazada (aunque la borremos luego, si hay error invocando a UCASAL, al menos que rechazada en Athento)
+            #TODO: forzar transición?
+            fil.change_life_cycle_state(ActaStates.rechazada) #, force_transition=True)
+
+            # Notificar a UCASAL (por medio del outbox)
+            UcasalOutbox.notify(UcasalOutbox.ACTA_REJECTION, fil.uuid, previous_uuid=uuid_acta_previa, reason=motivo)
+
+            # Borrar el acta
+            fil.removed = True
+            fil.save()
 
         # Mover el acta al espacio Papelera
         #fil.move_to_serie(name='papelera')
@@ -469,12 +445,90 @@ def reject(request, uuid):
         raise logger.exit(e, exc_info=True)
 
 
-def _get_pdf_hash(fil):
-    path = fil.file.path
-    byte_content = None
-    with open(path, mode='rb') as f:
-        byte_content = f.read()
-    return hashlib.sha256(byte_content).hexdigest()
+def _get_otp_info(body:dict, mail_docente:str)->OTPInfo:
+    ''' Valida los datos del dispositivo del docente que se incrustan en el PDF junto al QR '''
+    ip = body.get('ip')
+    if(not isinstance(ip, str) or len(ip.strip())==0):
+        raise AthentoseError("'ip' debe ser un string no vacío")
+
+    # Validar latitude
+    latitude = body.get('latitude')
+    if not isinstance(latitude, (int, float)):
+        raise AthentoseError("'latitude' debe ser un entero o un float")
+
+    # Validar longitude
+    longitude = body.get('longitude')
+    if not isinstance(longitude, (int, float)):
+        raise AthentoseError("'longitude' debe ser un entero o un float")
+
+    # Validar accuracy
+    accuracy = body.get('accuracy')
+    if(not isinstance(accuracy, str) or len(accuracy.strip())==0):
+        raise AthentoseError("'accuracy' debe ser un string no vacío")     
+
+    # Validar user_agent
+    user_agent = body.get('user_agent')
+    if not isinstance(user_agent, str) or len(user_agent.strip())==0:
+        raise AthentoseError("'user_agent' debe ser un string no vacío")
+
+    return OTPInfo(mail=_get_mail_for_otp(mail_docente), ip=ip, latitude=latitude, longitude=longitude, accuracy=accuracy, user_agent=user_agent)
+
+def _sign_acta_pdf(fil:File, qr_stream:bytes, mail_docente:str, otp_info:OTPInfo):
+    ''' Incrusta QR e info de OTP en el PDF del acta. Devuelve el PDF firmado, sin guardarlo '''
+    logger = SpLogger("athentose", "actas._sign_acta_pdf")
+    nombre_docente = fil.gmv('metadata.acta_nombre_docente_asignado')
+    mail_docente_ofuscado = _get_mail_for_otp(mail_docente)
+    fecha_firma = _get_arg_time()
+    qr_text = f"Firmado con OTP por:\r\n{nombre_docente}\r\n{mail_docente_ofuscado}\r\n{fecha_firma}"
+    qr_position = {'x': 10, 'y': 10, 'width': 40, 'height': 40}
+    if SignatureOverlay.enabled():
+        return SignatureOverlay(image_text=qr_text, otp_info=otp_info, qr_image=qr_stream, **qr_position).sign(fil.file.path)
+
+    with qr_image_path(qr_stream) as qr_image_tmp_path:
+        # Generar QR info
+        qr_info = QRInfo(
+            image_path=qr_image_tmp_path,
+            image_text=qr_text,
+            **qr_position
+        )
+        logger.debug(f'QR info: {qr_info}')
+        logger.debug(f'OTP info: {otp_info}')
+
+        # Incrustar QR y OTP en el pdf
+        signer = SpPdfSimpleSigner()
+        return signer.sign(input_pdf_path=fil.file.path, qr_info=qr_info, otp_info=otp_info)
+
+def _save_signed_acta(fil:File, pdf_out_stream, journal:SigningJournal)->str:
+    ''' Actualiza el binario del acta y devuelve el SHA-256 de los bytes guardados '''
+    with transaction.atomic():
+        pdf_hash = save_signed_pdf(fil, pdf_out_stream, fil.filename + ".pdf")
+        fil.set_feature('firmada.con.OTP', "1")
+        journal.record_sign({fil.uuid: pdf_hash})
+    SpLogger("athentose", "actas._save_signed_acta").debug('Acta firmada con OTP exitosamente')
+    return pdf_hash
+
+def _register_acta_in_bfa(fil:File, auth_token:str, pdf_hash:str, callback_url:str, journal:SigningJournal)->str:
+    ## #TODO: Enviar PDF a sellar con BFA (por medio de un servicio de UCASAL no disponible aún)
+    # Verficar si no fue enviada previamente
+    registrada_en_blockchain = fil.gfv('registro.en.blockchain')
+
+    if(registrada_en_blockchain == 'pending'):
+        raise AthentoseError('El acta ya había sido enviada a blockchain y su resultado aún está pendiente')
+
+    if(registrada_en_blockchain == 'success'):
+        raise AthentoseError('El acta está registrada en blockchain')
+
+    # Un intento anterior pudo registrar el hash y cortarse antes de cambiar el estado: sólo se completa
+    ok_response_text = journal.registered(pdf_hash)
+    if ok_response_text is None:
+        ok_response_text = BfaAnchoring.register(auth_token=auth_token, hash=pdf_hash, file_uuid=str(fil.uuid), doctype='acta', callback_url=callback_url)
+        journal.record_register(pdf_hash, ok_response_text)
+    fil.set_feature('ucasal.svc.ok_response', ok_response_text)
+    # Cambiar estado a Pendiente Blockchain
+    #TODO: forzar transición?
+    fil.change_life_cycle_state(ActaStates.pendiente_blockchain) #, force_transition=True)
+    fil.set_feature('registro.en.blockchain', 'pending')
+    return ok_response_text
 
 def _get_acta(uuid:str):
     try:
@@ -496,18 +550,6 @@ def _get_mail_for_otp(mail):
 
     return obfuscated_mail
 
-def _delete_file(file_path:str):
-    logger = SpLogger("athentose", "actas._delete_file")
-    logger.entry()    
-    try:
-      if os.path.isfile(file_path):
-          os.remove(file_path)    
-          logger.exit(f"File '{file_path}' removed.")    
-      else:
-          logger.exit(f"File '{file_path}' was not removed because it does not exist.")    
-    except Exception as e:
-        logger.exit(e, exc_info=True)
-
 def _is_non_empty_string(value:str):
     return isinstance(value, str) and value.strip() != ""
 
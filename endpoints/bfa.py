@@ -0,0 +1,71 @@
+from django.urls import re_path as url
+from django.http import HttpResponse
+from file.models import File
+from core.exceptions import AthentoseError
+from ucasal2.utils import (
+    default_permissions,
+    traceback_ret,
+    encodeJSON,
+    getJsonBody,
+    METHOD_NOT_ALLOWED,
+)
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.external_services.ucasal.bfa_anchoring import BfaAnchoring
+
+
+@default_permissions
+@traceback_ret
+def anchor_bfaresponse(request, batch_id):
+    """ Recibe la respuesta de Blockchain (BFA) para la raíz de un lote de anclaje y la aplica a todos sus documentos """
+    logger = SpLogger("athentose", "bfa.anchor_bfaresponse")
+    try:
+        logger.entry()
+
+        if request.method != 'POST':
+            return logger.exit(METHOD_NOT_ALLOWED)
+
+        body = getJsonBody(request)
+        outcomes = BfaAnchoring.apply_result(batch_id=int(batch_id), body=body)
+
+        return logger.exit(HttpResponse(
+            encodeJSON({'batch_id': int(batch_id), 'documents': outcomes}),
+            content_type="application/json"
+        ))
+    except FileNotFoundError as e:
+        return logger.exit(HttpResponse(str(e), status=404), exc_info=True)
+    except AthentoseError as e:
+        return logger.exit(HttpResponse(str(e), status=400), exc_info=True)
+    except Exception as e:
+        return logger.exit(HttpResponse(str(e), status=500), exc_info=True)
+
+
+@default_permissions
+@traceback_ret
+def anchor_verify(request, uuid):
+    """ Verifica localmente el hash del documento contra su prueba de inclusión en la raíz anclada """
+    logger = SpLogger("athentose", "bfa.anchor_verify")
+    try:
+        logger.entry()
+
+        if request.method != 'GET':
+            return logger.exit(METHOD_NOT_ALLOWED)
+
+        fil = File.objects.get(uuid=uuid)
+        return logger.exit(HttpResponse(
+            encodeJSON(BfaAnchoring.verify_document(fil)),
+            content_type="application/json"
+        ))
+    except File.DoesNotExist:
+        return logger.exit(HttpResponse("Documento no encontrado", status=404), exc_info=True)
+
+
+# ================================
+# Rutas
+# ================================
+routes = [
+    url(r'^bfa/anchors/(?P<batch_id>[0-9]+)/bfaresponse/?$', anchor_bfaresponse),
+    url(
+        r'^bfa/anchors/verify/(?P<uuid>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})/?$',
+        anchor_verify
+    ),
+]
@@ -7,6 +7,7 @@ from ucasal2.utils import (
     traceback_ret,
     encodeJSON,
     getJsonBody,
+    request_user,
     METHOD_NOT_ALLOWED,
     DesignacionesStates,
     UcasalConfig
@@ -16,6 +17,12 @@ from ucasal2.model.ucasal.exceptions import UcasalServiceError
 from file.foperations import op_send_by_email
 from ucasal2.external_services.ucasal.designaciones_services import DesignacionesServices
 from ucasal2.external_services.ucasal.ucasal_services import UcasalServices
+from ucasal2.external_services.ucasal.outbox import UcasalOutbox
+from ucasal2.external_services.ucasal.document_hashes import DocumentHashIndex
+from ucasal2.external_services.ucasal.designaciones_signer import DesignacionesSigner
+from ucasal2.external_services.ucasal.signing_journal import SigningJournal
+from ucasal2.model.exceptions.invalid_otp_error import InvalidOtpError
+from django.db import transaction
 from datetime import datetime
 
 @default_permissions
@@ -42,55 +49,10 @@ def bfaresponse(request, uuid):
             raise FileNotFoundError(f"La designación '{uuid}' no existe")
 
         flogger = SpFeatureLogger.getLogger(fil)
-        fil.set_feature('bfa.response', body)
-
-        # Validar tipo de documento
-        if fil.doctype.name != 'designaciones':
-            raise AthentoseError(
-                f"El documento con uuid '{uuid}' es de tipo '{fil.doctype.label}' en lugar de 'designaciones'"
-            )
-
-        # Validar estado de ciclo de vida
-        valid_states = [DesignacionesStates.pendiente_blockchain, DesignacionesStates.fallo_blockchain]
-        if fil.life_cycle_state.name not in valid_states:
-            raise AthentoseError(
-                f"Sólo se puede registrar resultado de blockchain si está en {valid_states}, "
-                f"pero está en '{fil.life_cycle_state.name}'"
-            )
-
-        # Guardar resultado
-        fil.set_feature('bfa.result', encodeJSON(body))
-        if result == 'success':
-            fil.change_life_cycle_state(DesignacionesStates.firmado)
-            fil.set_feature('registro_blockchain', result)
-           
-            auth_token = UcasalServices.get_auth_token(
-                user=UcasalConfig.token_svc_user(),
-                password=UcasalConfig.token_svc_password()
-            )
-
-            # Notificar a UCASAL que pasó a estado 5 (Firmado)
-            response = DesignacionesServices.notify_blockchain_success(uuid, 5, auth_token)
-            fil.set_feature('Response estado 5', response.text)
-            fil.set_feature('Status Code 5', response.status_code)
-
-            
-            fecha_actual = datetime.now().strftime("%d/%m/%Y")
-
-            op_send_by_email.run(
-                uuid,
-                notifications_template='designaciones_notificacion_firmada',
-                send_to_groups='Legajo Docente',            
-                fecha_firma=fecha_actual
-            )  
+
+        if apply_bfa_result(fil, body) == 'success':
             return logger.exit(HttpResponse("Resultado BFA registrado exitosamente"))
         else:
-            fil.change_life_cycle_state(DesignacionesStates.fallo_blockchain)
-            op_send_by_email.run(
-                uuid,
-                notifications_template='designaciones_notificacion_fallo_blockchain',
-                send_to_groups='SISTEMAS'
-            )  
             return logger.exit({"msg": "Resultado BFA marcado como fallo en blockchain", "msg_type": "error"})
     
     except File.DoesNotExist:
@@ -115,6 +77,113 @@ def bfaresponse(request, uuid):
         return logger.exit(HttpResponse(str(e), status=500), exc_info=True)
 
 
+@default_permissions
+@traceback_ret
+def firma_lote(request):
+    """ Firma en lote del Vicerrector Administrativo.
+        POST {"otp": 123456, "uuids": [...]}: el usuario logueado tiene que ser del grupo 'Vicerrector Administrativo';
+        valida su OTP una sola vez y firma, registra en BFA y pasa a 'Pendiente de Blockchain' las designaciones en
+        segundo plano. Responde 202 con el 'job_id' del lote """
+    logger = SpLogger("athentose", "designaciones.firma_lote")
+    try:
+        logger.entry()
+
+        if request.method != 'POST':
+            return logger.exit(METHOD_NOT_ALLOWED)
+
+        body = getJsonBody(request)
+        otp = str(body.get('otp') or '').strip()
+        if not otp.isdigit():
+            raise AthentoseError(f"'otp' debe ser un número entero positivo en lugar de '{otp}'")
+        uuids = body.get('uuids')
+        if not isinstance(uuids, list):
+            raise AthentoseError("'uuids' debe ser una lista de uuids de designaciones")
+
+        progress = DesignacionesSigner.start_batch(uuids=uuids, usuario=request_user(request), otp=int(otp))
+        return logger.exit(HttpResponse(
+            encodeJSON(progress),
+            content_type="application/json",
+            status=202
+        ))
+    except InvalidOtpError as e:
+        return logger.exit(HttpResponse(str(e), status=400), exc_info=True)
+    except AthentoseError as e:
+        return logger.exit(HttpResponse(str(e), status=400), exc_info=True)
+    except Exception as e:
+        return logger.exit(HttpResponse(str(e), status=500), exc_info=True)
+
+
+@default_permissions
+@traceback_ret
+def firma_lote_progreso(request, job_id):
+    """ GET: avance de un lote de firma y resultado por designación ('pendiente_blockchain', 'skipped' o 'error').
+        El avance está en el cache de Django: requiere un backend compartido entre los workers """
+    logger = SpLogger("athentose", "designaciones.firma_lote_progreso")
+    logger.entry()
+
+    if request.method != 'GET':
+        return logger.exit(METHOD_NOT_ALLOWED)
+
+    progress = DesignacionesSigner.batch_progress(job_id)
+    if progress is None:
+        return logger.exit(HttpResponse(f"El lote '{job_id}' no existe o ya venció", status=404))
+    return logger.exit(HttpResponse(encodeJSON(progress), content_type="application/json"))
+
+
+def apply_bfa_result(fil: File, body: dict) -> str:
+    """ Registra en la Designación el resultado de BFA. Lo usan bfaresponse y el anclaje por árbol de Merkle """
+    uuid = str(fil.uuid)
+    result = body.get('status')
+    if result not in ['success', 'failure']:
+        raise AthentoseError(f"'status' debe ser 'success' o 'failure', en lugar de {result}")
+
+    fil.set_feature('bfa.response', body)
+
+    # Validar tipo de documento
+    if fil.doctype.name != 'designaciones':
+        raise AthentoseError(
+            f"El documento con uuid '{uuid}' es de tipo '{fil.doctype.label}' en lugar de 'designaciones'"
+        )
+
+    # Validar estado de ciclo de vida
+    valid_states = [DesignacionesStates.pendiente_blockchain, DesignacionesStates.fallo_blockchain]
+    if fil.life_cycle_state.name not in valid_states:
+        raise AthentoseError(
+            f"Sólo se puede registrar resultado de blockchain si está en {valid_states}, "
+            f"pero está en '{fil.life_cycle_state.name}'"
+        )
+
+    # Guardar resultado
+    fil.set_feature('bfa.result', encodeJSON(body))
+    DocumentHashIndex.set_bfa_status(uuid, result)
+    if result == 'success':
+        with transaction.atomic():
+            fil.change_life_cycle_state(DesignacionesStates.firmado)
+            fil.set_feature('registro_blockchain', result)
+
+            # Notificar a UCASAL que pasó a estado 5 (Firmado), por medio del outbox
+            UcasalOutbox.notify(UcasalOutbox.DESIGNACIONES_STATE, uuid, state=5)
+
+        fecha_actual = datetime.now().strftime("%d/%m/%Y")
+
+        op_send_by_email.run(
+            uuid,
+            notifications_template='designaciones_notificacion_firmada',
+            send_to_groups='Legajo Docente',            
+            fecha_firma=fecha_actual
+        )  
+    else:
+        fil.change_life_cycle_state(DesignacionesStates.fallo_blockchain)
+        # Un reintento de la firma tiene que volver a registrar el hash
+        SigningJournal.discard_stages(uuid, SigningJournal.FLOW_DESIGNACIONES, SigningJournal.STAGE_REGISTER)
+        op_send_by_email.run(
+            uuid,
+            notifications_template='designaciones_notificacion_fallo_blockchain',
+            send_to_groups='SISTEMAS'
+        )  
+    return result
+
+
 # ================================
 # Rutas
 # ================================
@@ -123,4 +192,6 @@ routes = [
         r'^designaciones/(?P<uuid>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})/bfaresponse/?$',
         bfaresponse
     ),
+    url(r'^designaciones/firma_lote/?$', firma_lote),
+    url(r'^designaciones/firma_lote/(?P<job_id>[0-9a-f]{32})/?$', firma_lote_progreso),
 ]
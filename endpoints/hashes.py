@@ -0,0 +1,85 @@
+from django.urls import re_path as url
+from django.http import HttpResponse
+from ucasal2.utils import (
+    default_permissions,
+    traceback_ret,
+    encodeJSON,
+    METHOD_NOT_ALLOWED,
+    FORBIDDEN,
+    is_staff_request,
+)
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.external_services.ucasal.document_hashes import DocumentHashIndex
+import hashlib
+import re
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+@default_permissions
+@traceback_ret
+def lookup(request, sha256):
+    """ GET: documentos (acta, designación, analítico o título) cuyo binario firmado tiene el SHA-256 indicado.
+        Devuelve el uuid interno de cada documento: sólo staff o superusuarios (la verificación pública es 'verify') """
+    logger = SpLogger("athentose", "hashes.lookup")
+    logger.entry()
+
+    if request.method != 'GET':
+        return logger.exit(METHOD_NOT_ALLOWED)
+    if not is_staff_request(request):
+        return logger.exit(FORBIDDEN)
+
+    documents = DocumentHashIndex.lookup(sha256)
+    return logger.exit(HttpResponse(
+        encodeJSON({'hash': sha256.lower(), 'documents': documents}),
+        content_type="application/json",
+        status=200 if documents else 404
+    ))
+
+
+@default_permissions
+@traceback_ret
+def verify(request):
+    """ Verificación pública de un PDF firmado.
+        GET ?hash=<sha256> o POST multipart con el PDF en 'file' (el hash se calcula en el servidor).
+        'verified' es true si el hash corresponde a un documento registrado con éxito en BFA """
+    logger = SpLogger("athentose", "hashes.verify")
+    logger.entry()
+
+    if request.method == 'POST':
+        upload = request.FILES.get('file')
+        if upload is None:
+            return logger.exit(HttpResponse("Falta el PDF en el campo 'file'", status=400))
+        digest = hashlib.sha256()
+        for chunk in upload.chunks():
+            digest.update(chunk)
+        sha256 = digest.hexdigest()
+    elif request.method == 'GET':
+        sha256 = (request.GET.get('hash') or '').strip().lower()
+        if not SHA256_RE.match(sha256):
+            return logger.exit(HttpResponse("'hash' debe ser un SHA-256 en hexadecimal", status=400))
+    else:
+        return logger.exit(METHOD_NOT_ALLOWED)
+
+    # Sólo se publica lo necesario para verificar, sin datos internos del documento
+    documents = [
+        {k: d[k] for k in ('doctype', 'version', 'registered_at', 'bfa_status', 'bfa_resolved_at')}
+        for d in DocumentHashIndex.lookup(sha256)
+    ]
+    return logger.exit(HttpResponse(
+        encodeJSON({
+            'hash': sha256,
+            'verified': any(d['bfa_status'] == 'success' for d in documents),
+            'documents': documents,
+        }),
+        content_type="application/json"
+    ))
+
+
+# ================================
+# Rutas
+# ================================
+routes = [
+    url(r'^hashes/(?P<sha256>[0-9a-fA-F]{64})/?$', lookup),
+    url(r'^hashes/verify/?$', verify),
+]
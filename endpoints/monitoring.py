@@ -0,0 +1,106 @@
+from django.urls import re_path as url
+from django.http import HttpResponse
+from ucasal2.utils import (
+    UcasalConfig,
+    ConfigSnapshot,
+    default_permissions,
+    traceback_ret,
+    encodeJSON,
+    getJsonBody,
+    METHOD_NOT_ALLOWED,
+    FORBIDDEN,
+    is_staff_request,
+)
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.external_services.ucasal.circuit_breaker import UcasalCircuitBreakers
+from ucasal2.external_services.ucasal.singleflight import UcasalSingleflight
+from ucasal2.external_services.ucasal.metrics import UcasalMetrics
+
+
+@default_permissions
+@traceback_ret
+def circuit_breakers(request):
+    """ GET: estado de los circuit breakers de los endpoints de UCASAL (de este proceso).
+        POST {"endpoint": "stamps"}: cierra el breaker indicado (o todos si no se indica). Sólo staff o superusuarios """
+    logger = SpLogger("athentose", "monitoring.circuit_breakers")
+    logger.entry()
+
+    if request.method == 'POST':
+        if not is_staff_request(request):
+            return logger.exit(FORBIDDEN)
+        body = getJsonBody(request) or {}
+        UcasalCircuitBreakers.reset(body.get('endpoint'))
+    elif request.method != 'GET':
+        return logger.exit(METHOD_NOT_ALLOWED)
+
+    return logger.exit(HttpResponse(
+        encodeJSON({'circuit_breakers': UcasalCircuitBreakers.states()}),
+        content_type="application/json"
+    ))
+
+
+@default_permissions
+@traceback_ret
+def singleflight(request):
+    """ GET: llamadas agrupadas por UcasalSingleflight (de este proceso) """
+    logger = SpLogger("athentose", "monitoring.singleflight")
+    logger.entry()
+
+    if request.method != 'GET':
+        return logger.exit(METHOD_NOT_ALLOWED)
+
+    return logger.exit(HttpResponse(
+        encodeJSON({'singleflight': UcasalSingleflight.stats()}),
+        content_type="application/json"
+    ))
+
+
+@default_permissions
+@traceback_ret
+def metrics(request):
+    """ GET: métricas de las llamadas a UCASAL en formato de texto de Prometheus.
+        Por defecto suma las de todos los workers (?scope=process para sólo las de este proceso) """
+    logger = SpLogger("athentose", "monitoring.metrics")
+    logger.entry()
+
+    if request.method != 'GET':
+        return logger.exit(METHOD_NOT_ALLOWED)
+
+    aggregate = request.GET.get('scope', 'all') != 'process'
+    return logger.exit(HttpResponse(
+        UcasalMetrics.export(aggregate=aggregate),
+        content_type="text/plain; version=0.0.4; charset=utf-8"
+    ))
+
+
+@default_permissions
+@traceback_ret
+def config(request):
+    """ GET: estado del snapshot de UcasalConfig (de este proceso).
+        POST: descarta el snapshot en todos los workers, para tomar en el acto un cambio de configuración.
+        Sólo staff o superusuarios (también está el comando ucasal_config_invalidate) """
+    logger = SpLogger("athentose", "monitoring.config")
+    logger.entry()
+
+    if request.method == 'POST':
+        if not is_staff_request(request):
+            return logger.exit(FORBIDDEN)
+        UcasalConfig.invalidate()
+    elif request.method != 'GET':
+        return logger.exit(METHOD_NOT_ALLOWED)
+
+    return logger.exit(HttpResponse(
+        encodeJSON({'config_snapshot': ConfigSnapshot.stats()}),
+        content_type="application/json"
+    ))
+
+
+# ================================
+# Rutas
+# ================================
+routes = [
+    url(r'^monitoring/circuit_breakers/?$', circuit_breakers),
+    url(r'^monitoring/singleflight/?$', singleflight),
+    url(r'^monitoring/metrics/?$', metrics),
+    url(r'^monitoring/config/?$', config),
+]
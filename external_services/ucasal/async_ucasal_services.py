@@ -0,0 +1,154 @@
+import time
+import asyncio
+import weakref
+import httpx
+from asgiref.sync import sync_to_async
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.utils import UcasalConfig, db_connection_closing
+from ucasal2.external_services.ucasal.ucasal_services import UcasalServices
+from ucasal2.external_services.ucasal.token_cache import UcasalTokenCache
+from ucasal2.external_services.ucasal.qr_cache import UcasalQrCache
+from ucasal2.external_services.ucasal.http_transport import UcasalHttpTransport
+from ucasal2.external_services.ucasal.circuit_breaker import UcasalCircuitBreakers
+from ucasal2.external_services.ucasal.metrics import UcasalMetrics
+
+
+class AsyncUcasalServices:
+    '''
+    Cliente asincrónico (httpx.AsyncClient) de los servicios de UCASAL, con los mismos métodos que UcasalServices.
+    Arma los requests e interpreta las respuestas con los mismos métodos que el cliente sincrónico, y
+    comparte con él los timeouts, la política de reintentos, los circuit breakers, las métricas y el cache del token.
+    La URL corta y el QR pasan por UcasalQrCache (cache, singleflight y render local) en un thread aparte.
+
+    Permite ejecutar llamadas independientes en forma concurrente, por ejemplo:
+        auth_token, _ = await asyncio.gather(
+            AsyncUcasalServices.get_auth_token(user, password),
+            AsyncUcasalServices.validate_otp(user=mail, otp=otp),
+        )
+    UcasalServices.register_in_blockchain_batch lo usa para registrar los hashes de un lote en forma concurrente
+    cuando el servicio no admite lotes.
+    Los clientes httpx son por event loop: quien crea el loop llama a aclose() antes de cerrarlo.
+    '''
+    logger = SpLogger("athentose", "AsyncUcasalServices")
+
+    # {event loop: {verify: cliente}}; httpx fija 'verify' al crear el cliente. Si un loop se descarta sin
+    # aclose() sus clientes se liberan con él
+    _clients = weakref.WeakKeyDictionary()
+
+    @classmethod
+    @UcasalMetrics.timed('get_auth_token')
+    async def get_auth_token(cls, user:str, password:str)->str:
+        # Se usa el mismo cache que el cliente sincrónico, que garantiza una sola obtención entre workers
+        return await sync_to_async(UcasalTokenCache.get)(user=user, password=password, fetch=UcasalServices._fetch_auth_token)
+
+    @classmethod
+    @UcasalMetrics.timed('get_qr_image')
+    async def get_qr_image(cls, url:str)->bytes:
+        return await asyncio.to_thread(db_connection_closing(UcasalQrCache.get_qr_image), url=url)
+
+    @classmethod
+    @UcasalMetrics.timed('get_short_url')
+    async def get_short_url(cls, auth_token:str, url:str)->str:
+        return await asyncio.to_thread(db_connection_closing(UcasalQrCache.get_short_url), auth_token=auth_token, url=url)
+
+    @classmethod
+    @UcasalMetrics.timed('register_in_blockchain')
+    async def register_in_blockchain(cls, auth_token:str, hash:str, file_uuid:str, callback_url:str)->str:
+        request = await sync_to_async(UcasalServices._register_in_blockchain_request)(auth_token, hash, file_uuid, callback_url)
+        return UcasalServices._register_in_blockchain_result(await cls._send(request))
+
+    @classmethod
+    async def register_in_blockchain_many(cls, auth_token:str, entries:list, concurrency:int)->list:
+        ''' Registra cada entrada por separado, con hasta 'concurrency' llamadas en curso. Mismo formato que register_in_blockchain_batch '''
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def register(entry):
+            async with semaphore:
+                try:
+                    response = await cls.register_in_blockchain(auth_token=auth_token, hash=entry['hash'], file_uuid=entry['file_uuid'], callback_url=entry['callback_url'])
+                    return UcasalServices._batch_result(entry, ok=True, response=response)
+                except Exception as e:
+                    return UcasalServices._batch_result(entry, ok=False, error=str(e))
+
+        return list(await asyncio.gather(*(register(entry) for entry in entries)))
+
+    @classmethod
+    @UcasalMetrics.timed('notify_rejection')
+    async def notify_rejection(cls, auth_token:str, uuid:str, previous_uuid:str, reason:str)->str:
+        request = await sync_to_async(UcasalServices._notify_rejection_request)(auth_token, uuid, previous_uuid, reason)
+        return UcasalServices._notify_rejection_result(await cls._send(request))
+
+    @classmethod
+    @UcasalMetrics.timed('notify_blockchain_success')
+    async def notify_blockchain_success(cls, auth_token:str, uuid:str)->str:
+        request = await sync_to_async(UcasalServices._notify_blockchain_success_request)(auth_token, uuid)
+        return UcasalServices._notify_blockchain_success_result(await cls._send(request))
+
+    @classmethod
+    @UcasalMetrics.timed('validate_otp')
+    async def validate_otp(cls, user:str, otp:int):
+        request = await sync_to_async(UcasalServices._validate_otp_request)(user, otp)
+        return UcasalServices._validate_otp_result(await cls._send(request))
+
+    @classmethod
+    async def aclose(cls):
+        ''' Cierra los clientes del event loop actual '''
+        clients = cls._clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.aclose()
+
+    @classmethod
+    async def _send(cls, request:dict)->httpx.Response:
+        request = dict(request)
+        method = request.pop('method')
+        endpoint_name = request.pop('endpoint_name')
+        verify = request.pop('verify', True)
+        connect_timeout, read_timeout = await sync_to_async(UcasalConfig.http_timeout)(endpoint_name)
+        max_retries = await sync_to_async(UcasalConfig.http_max_retries)()
+        client = await cls._client(verify)
+        breaker = await sync_to_async(UcasalCircuitBreakers.get)(endpoint_name) if await sync_to_async(UcasalCircuitBreakers.is_enabled)() else None
+
+        cls.logger.debug(f"Llamando a httpx.AsyncClient.{method.lower()} ({endpoint_name}) con estos parámetros: {request}")
+        attempt = 0
+        while True:
+            if breaker:
+                breaker.before_call()
+            start = time.monotonic()
+            recorded = False
+            try:
+                with UcasalMetrics.track(endpoint_name, method) as call:
+                    response = await client.request(method, timeout=httpx.Timeout(read_timeout, connect=connect_timeout), **request)
+                    call.status(response.status_code)
+                status_code = response.status_code
+                if breaker:
+                    breaker.record(ok=not UcasalCircuitBreakers.is_failure(status_code), duration=time.monotonic() - start)
+                    recorded = True
+            except httpx.TransportError:
+                response, status_code = None, None
+                if attempt >= max_retries or not UcasalHttpTransport.is_retryable(method, endpoint_name=endpoint_name):
+                    raise
+            finally:
+                # También ante CancelledError u otros errores: si no, la llamada de prueba de half_open queda tomada
+                if breaker and not recorded:
+                    breaker.record(ok=False, duration=time.monotonic() - start)
+
+            if response is not None and (attempt >= max_retries or not UcasalHttpTransport.is_retryable(method, status_code, endpoint_name=endpoint_name)):
+                return response
+
+            attempt += 1
+            backoff = await sync_to_async(UcasalHttpTransport.backoff_seconds)(attempt)
+            cls.logger.debug(f"Reintento {attempt}/{max_retries} de {method} ({endpoint_name}) en {backoff:.2f}s (status: {status_code})")
+            await asyncio.sleep(backoff)
+
+    @classmethod
+    async def _client(cls, verify:bool)->httpx.AsyncClient:
+        clients = cls._clients.setdefault(asyncio.get_running_loop(), {})
+        client = clients.get(bool(verify))
+        if client is None or client.is_closed:
+            pool_connections = await sync_to_async(UcasalConfig.http_pool_connections)()
+            pool_maxsize = await sync_to_async(UcasalConfig.http_pool_maxsize)()
+            client = clients[bool(verify)] = httpx.AsyncClient(
+                verify=verify,
+                limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_connections),
+            )
+        return client
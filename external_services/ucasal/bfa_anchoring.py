@@ -0,0 +1,247 @@
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+from file.models import File, DocumentRelation
+from core.exceptions import AthentoseError
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.utils import UcasalConfig, encodeJSON, decodeJSON, get_pdf_hash
+from ucasal2.model.merkle_tree import MerkleTree
+from ucasal2.external_services.ucasal.ucasal_services import UcasalServices
+from ucasal2.external_services.ucasal.document_hashes import DocumentHashIndex
+from ucasal2.external_services.ucasal.signing_journal import SigningJournal
+from ucasal2.models import BfaAnchorBatch, BfaAnchorEntry
+
+
+class BfaAnchoring:
+    """Registro de hashes de documentos en BFA.
+
+    - Modo 'direct': cada hash se registra con UcasalServices.register_in_blockchain (comportamiento original)
+    - Modo 'merkle': los hashes se encolan; el comando 'ucasal_bfa_anchor' arma un árbol de Merkle con los
+      pendientes de la ventana configurada y registra sólo su raíz. Cada documento guarda su prueba de
+      inclusión en el feature 'bfa.merkle.proof' y el callback de la raíz actualiza todos los documentos.
+    - Un lote que quedó sin respuesta de registro (el proceso se cortó entre armarlo y registrarlo) se descarta
+      pasados 'ucasal.bfa.anchor_stuck_seconds' y sus hashes vuelven a quedar pendientes
+    - El resultado de la raíz se aplica y se marca documento por documento; el lote queda resuelto recién cuando
+      se aplicó a todos, y un nuevo callback (o reintento) sólo completa los que faltan
+    """
+    logger = SpLogger("athentose", "BfaAnchoring")
+
+    MODE_DIRECT = 'direct'
+    MODE_MERKLE = 'merkle'
+
+    @classmethod
+    def is_merkle_mode(cls)->bool:
+        return UcasalConfig.bfa_anchor_mode() == cls.MODE_MERKLE
+
+    @classmethod
+    def register(cls, auth_token:str, hash:str, file_uuid:str, doctype:str, callback_url:str)->str:
+        if not cls.is_merkle_mode():
+            response = UcasalServices.register_in_blockchain(auth_token=auth_token, hash=hash, file_uuid=file_uuid, callback_url=callback_url)
+        else:
+            entry = cls.enqueue(file_uuid=file_uuid, doctype=doctype, hash=hash)
+            response = encodeJSON({'mode': cls.MODE_MERKLE, 'entry_id': entry.id, 'status': 'queued'})
+        DocumentHashIndex.record(file_uuid=file_uuid, doctype=doctype, hash=hash)
+        return response
+
+    @classmethod
+    def register_batch(cls, auth_token:str, entries:list)->list:
+        ''' Igual que UcasalServices.register_in_blockchain_batch; cada entrada incluye además 'doctype' '''
+        if not cls.is_merkle_mode():
+            results = UcasalServices.register_in_blockchain_batch(auth_token=auth_token, entries=entries)
+        else:
+            results = []
+            for e in entries:
+                entry = cls.enqueue(file_uuid=e['file_uuid'], doctype=e['doctype'], hash=e['hash'])
+                results.append(UcasalServices._batch_result(
+                    e, ok=True, response=encodeJSON({'mode': cls.MODE_MERKLE, 'entry_id': entry.id, 'status': 'queued'})
+                ))
+        for e, result in zip(entries, results):
+            if result['ok']:
+                DocumentHashIndex.record(file_uuid=e['file_uuid'], doctype=e['doctype'], hash=e['hash'])
+        return results
+
+    @classmethod
+    def enqueue(cls, file_uuid:str, doctype:str, hash:str)->BfaAnchorEntry:
+        cls.logger.debug(f'Encolando hash {hash} del documento {file_uuid} ({doctype}) para anclaje por Merkle')
+        return BfaAnchorEntry.objects.create(file_uuid=str(file_uuid), doctype=doctype, file_hash=hash)
+
+    @classmethod
+    def anchor_pending(cls, force:bool=False)->BfaAnchorBatch:
+        '''
+        Arma un árbol con los hashes pendientes y registra su raíz en BFA.
+        Sólo actúa si el pendiente más antiguo superó la ventana 'ucasal.bfa.anchor_window_seconds' (o si force=True).
+        Devuelve el lote registrado, o None si no había nada para anclar.
+        '''
+        logger = cls.logger
+        window = timedelta(seconds=UcasalConfig.bfa_anchor_window_seconds())
+        cls.release_stuck_batches()
+
+        with transaction.atomic():
+            entries = list(
+                BfaAnchorEntry.objects.select_for_update(skip_locked=True)
+                .filter(batch__isnull=True)
+                .order_by('created_at', 'id')[:UcasalConfig.bfa_anchor_max_leaves()]
+            )
+            if not entries:
+                return None
+            if not force and entries[0].created_at > timezone.now() - window:
+                return None
+
+            tree = MerkleTree([e.file_hash for e in entries])
+            batch = BfaAnchorBatch.objects.create(root=tree.root, leaf_count=len(entries))
+            for index, entry in enumerate(entries):
+                entry.batch = batch
+                entry.leaf_index = index
+                entry.proof = encodeJSON(tree.proof(index))
+                entry.error = ''
+                entry.save(update_fields=['batch', 'leaf_index', 'proof', 'error'])
+
+        logger.debug(f'Registrando raíz {batch.root} con {batch.leaf_count} hojas (lote {batch.id})')
+        try:
+            auth_token = UcasalServices.get_auth_token(user=UcasalConfig.token_svc_user(), password=UcasalConfig.token_svc_password())
+            batch.register_response = UcasalServices.register_in_blockchain(
+                auth_token=auth_token,
+                hash=batch.root,
+                file_uuid=f'merkle-{batch.id}',
+                callback_url=f'{UcasalConfig.bfa_anchor_bfaresponse_endpoint()}{batch.id}/bfaresponse'
+            )
+            batch.save(update_fields=['register_response'])
+        except Exception as e:
+            # Se liberan las entradas para que el próximo intento las vuelva a incluir
+            logger.error(f'Error registrando la raíz del lote {batch.id}: {e}')
+            BfaAnchorEntry.objects.filter(batch=batch).update(batch=None, leaf_index=None, proof='', error=str(e))
+            batch.delete()
+            raise
+
+        for entry in entries:
+            fil = File.objects.filter(uuid=entry.file_uuid).first()
+            if fil:
+                fil.set_feature('bfa.merkle.proof', encodeJSON(cls._proof_info(entry, batch)))
+        return batch
+
+    @classmethod
+    def release_stuck_batches(cls)->int:
+        ''' Descarta los lotes pendientes sin respuesta de registro más viejos que 'ucasal.bfa.anchor_stuck_seconds' '''
+        limit = timezone.now() - timedelta(seconds=UcasalConfig.bfa_anchor_stuck_seconds())
+        released = 0
+        with transaction.atomic():
+            stuck = (
+                BfaAnchorBatch.objects.select_for_update(skip_locked=True)
+                .filter(status=BfaAnchorBatch.STATUS_PENDING, register_response='', created_at__lt=limit)
+            )
+            for batch in stuck:
+                cls.logger.warning(f'El lote de anclaje {batch.id} no llegó a registrarse en BFA: se liberan sus {batch.leaf_count} hashes')
+                BfaAnchorEntry.objects.filter(batch=batch).update(
+                    batch=None, leaf_index=None, proof='', error=f'Lote {batch.id} abandonado sin registrar'
+                )
+                batch.delete()
+                released += 1
+        return released
+
+    @classmethod
+    def apply_result(cls, batch_id:int, body:dict)->dict:
+        '''
+        Aplica el resultado de BFA de la raíz a los documentos del lote que todavía no lo tienen.
+        Cada documento se aplica y se marca en su propia transacción; el lote queda resuelto cuando están todos.
+        Devuelve {uuid: 'ok' | error}
+        '''
+        result = body.get('status')
+        if result not in ['success', 'failure']:
+            raise AthentoseError(f"'status' debe ser 'success' o 'failure' en lugar de {result}")
+
+        batch = BfaAnchorBatch.objects.filter(id=batch_id).first()
+        if not batch:
+            raise FileNotFoundError(f"El lote de anclaje '{batch_id}' no existe")
+        if batch.resolved_at is not None:
+            raise AthentoseError(f"El lote de anclaje '{batch_id}' ya tiene resultado '{batch.status}'")
+        if batch.status not in (BfaAnchorBatch.STATUS_PENDING, result):
+            raise AthentoseError(f"El lote de anclaje '{batch_id}' ya recibió el resultado '{batch.status}' y ahora '{result}'")
+
+        if batch.status == BfaAnchorBatch.STATUS_PENDING:
+            batch.status = result
+            batch.bfa_result = encodeJSON(body)
+            batch.save(update_fields=['status', 'bfa_result'])
+        body = decodeJSON(batch.bfa_result)
+
+        outcomes = {}
+        for entry in batch.entries.filter(applied_at__isnull=True).order_by('leaf_index'):
+            try:
+                with transaction.atomic():
+                    fil = File.objects.get(uuid=entry.file_uuid)
+                    apply = cls._result_handlers().get(entry.doctype)
+                    if apply is None:
+                        raise AthentoseError(f"No hay un manejador de resultados BFA para el doctype '{entry.doctype}'")
+                    apply(fil, dict(body, merkle=cls._proof_info(entry, batch)))
+                    entry.applied_at = timezone.now()
+                    entry.error = ''
+                    entry.save(update_fields=['applied_at', 'error'])
+                outcomes[entry.file_uuid] = 'ok'
+            except Exception as e:
+                cls.logger.error(f'Error aplicando el resultado BFA del lote {batch.id} al documento {entry.file_uuid}: {e}')
+                entry.error = str(e)
+                entry.save(update_fields=['error'])
+                outcomes[entry.file_uuid] = str(e)
+
+        if not batch.entries.filter(applied_at__isnull=True).exists():
+            batch.resolved_at = timezone.now()
+            batch.save(update_fields=['resolved_at'])
+        return outcomes
+
+    @classmethod
+    def verify(cls, document_hash:str, proof:list, root:str)->bool:
+        return MerkleTree.verify(document_hash, proof, root)
+
+    @classmethod
+    def verify_document(cls, fil:File)->dict:
+        ''' Verifica localmente que el hash actual del documento esté incluido en la raíz anclada '''
+        entry = (
+            BfaAnchorEntry.objects.filter(file_uuid=str(fil.uuid), batch__isnull=False)
+            .select_related('batch').order_by('-created_at').first()
+        )
+        if not entry:
+            return {'uuid': str(fil.uuid), 'anchored': False, 'valid': False}
+        document_hash = get_pdf_hash(fil)
+        return {
+            'uuid': str(fil.uuid),
+            'anchored': True,
+            'hash': document_hash,
+            'hash_matches_entry': document_hash == entry.file_hash,
+            'valid': cls.verify(document_hash, decodeJSON(entry.proof), entry.batch.root),
+            'root': entry.batch.root,
+            'batch_status': entry.batch.status,
+        }
+
+    @staticmethod
+    def _proof_info(entry:BfaAnchorEntry, batch:BfaAnchorBatch)->dict:
+        return {
+            'batch_id': batch.id,
+            'root': batch.root,
+            'leaf_index': entry.leaf_index,
+            'file_hash': entry.file_hash,
+            'proof': decodeJSON(entry.proof) if entry.proof else [],
+        }
+
+    @classmethod
+    def _result_handlers(cls)->dict:
+        # Import diferido: los endpoints importan este módulo
+        from ucasal2.endpoints.actas import apply_bfa_result as apply_acta
+        from ucasal2.endpoints.designaciones import apply_bfa_result as apply_designacion
+        return {
+            'acta': apply_acta,
+            'designaciones': apply_designacion,
+            'analitico': cls._apply_titulo_child_result,
+            'titulo': cls._apply_titulo_child_result,
+        }
+
+    @staticmethod
+    def _apply_titulo_child_result(fil:File, body:dict):
+        ''' Analítico y diploma: el resultado se guarda en el hijo y en el título padre '''
+        result = body['status']
+        fil.set_feature('bfa.result', encodeJSON(body))
+        fil.set_feature('registro_blockchain', result)
+        DocumentHashIndex.set_bfa_status(fil.uuid, result)
+        for relation in DocumentRelation.objects.filter(child=fil):
+            relation.parent.set_feature('registro_blockchain', result)
+            if result == 'failure':
+                # Un reintento de la firma del título tiene que volver a registrar los hashes
+                SigningJournal.discard_stages(relation.parent.uuid, SigningJournal.FLOW_TITULO, SigningJournal.STAGE_REGISTER)
@@ -0,0 +1,163 @@
+import time
+import threading
+from collections import deque
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.utils import UcasalConfig
+from ucasal2.model.ucasal.exceptions import UcasalCircuitOpenError
+
+
+class CircuitBreaker:
+    """Circuit breaker de un endpoint de UCASAL (por proceso).
+
+    - closed: las llamadas pasan; se evalúan la tasa de errores y de llamadas lentas en una ventana móvil
+    - open: las llamadas fallan rápido con UcasalCircuitOpenError durante 'open_seconds'
+    - half_open: se dejan pasar hasta 'half_open_max_calls' llamadas de prueba; si todas salen bien se cierra,
+      si alguna falla se vuelve a abrir
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    DEFAULTS = {
+        'window_seconds': 60,
+        'min_calls': 10,
+        'error_rate_threshold': 0.5,
+        'slow_call_seconds': 10,
+        'slow_call_rate_threshold': 0.8,
+        'open_seconds': 30,
+        'half_open_max_calls': 1,
+    }
+
+    logger = SpLogger("athentose", "CircuitBreaker")
+
+    def __init__(self, name:str, **settings):
+        self.name = name
+        self.settings = dict(self.DEFAULTS, **settings)
+        self._lock = threading.Lock()
+        self._events = deque()  # (timestamp, ok, duration)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._half_open_successes = 0
+        self._rejected = 0
+
+    def before_call(self):
+        with self._lock:
+            if self._state == self.OPEN:
+                remaining = self._opened_at + self.settings['open_seconds'] - time.time()
+                if remaining > 0:
+                    self._rejected += 1
+                    raise UcasalCircuitOpenError(self.name, remaining)
+                self._transition(self.HALF_OPEN)
+
+            if self._state == self.HALF_OPEN:
+                if self._half_open_calls >= self.settings['half_open_max_calls']:
+                    self._rejected += 1
+                    raise UcasalCircuitOpenError(self.name, self.settings['open_seconds'])
+                self._half_open_calls += 1
+
+    def record(self, ok:bool, duration:float):
+        now = time.time()
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                if not ok:
+                    self._transition(self.OPEN)
+                    return
+                self._half_open_successes += 1
+                if self._half_open_successes >= self.settings['half_open_max_calls']:
+                    self._transition(self.CLOSED)
+                return
+
+            self._events.append((now, ok, duration))
+            self._trim(now)
+            if self._state == self.CLOSED and self._should_open():
+                self._transition(self.OPEN)
+
+    def snapshot(self)->dict:
+        with self._lock:
+            self._trim(time.time())
+            calls, error_rate, slow_rate = self._rates()
+            return {
+                'endpoint': self.name,
+                'state': self._state,
+                'calls_in_window': calls,
+                'error_rate': round(error_rate, 4),
+                'slow_call_rate': round(slow_rate, 4),
+                'rejected_calls': self._rejected,
+                'opened_at': self._opened_at or None,
+                'settings': dict(self.settings),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._transition(self.CLOSED)
+
+    def _should_open(self)->bool:
+        calls, error_rate, slow_rate = self._rates()
+        if calls < self.settings['min_calls']:
+            return False
+        return error_rate >= self.settings['error_rate_threshold'] or slow_rate >= self.settings['slow_call_rate_threshold']
+
+    def _rates(self)->tuple:
+        calls = len(self._events)
+        if not calls:
+            return 0, 0.0, 0.0
+        errors = sum(1 for _, ok, _ in self._events if not ok)
+        slow = sum(1 for _, _, duration in self._events if duration >= self.settings['slow_call_seconds'])
+        return calls, errors / calls, slow / calls
+
+    def _trim(self, now:float):
+        limit = now - self.settings['window_seconds']
+        while self._events and self._events[0][0] < limit:
+            self._events.popleft()
+
+    def _transition(self, state:str):
+        if state != self._state:
+            self.logger.warning(f"Circuit breaker '{self.name}': {self._state} -> {state}")
+        self._state = state
+        self._half_open_calls = 0
+        self._half_open_successes = 0
+        if state == self.OPEN:
+            self._opened_at = time.time()
+        if state == self.CLOSED:
+            self._events.clear()
+            self._opened_at = 0.0
+
+
+class UcasalCircuitBreakers:
+    ''' Un CircuitBreaker por endpoint de UcasalConfig ('gettoken', 'qr', 'acortar_url', 'stamps', ...) '''
+    _breakers = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, endpoint_name:str)->CircuitBreaker:
+        breaker = cls._breakers.get(endpoint_name)
+        if breaker is None:
+            with cls._lock:
+                breaker = cls._breakers.get(endpoint_name)
+                if breaker is None:
+                    settings = {
+                        name: UcasalConfig.circuit_breaker_setting(endpoint_name, name, default)
+                        for name, default in CircuitBreaker.DEFAULTS.items()
+                    }
+                    breaker = cls._breakers[endpoint_name] = CircuitBreaker(endpoint_name, **settings)
+        return breaker
+
+    @classmethod
+    def is_enabled(cls)->bool:
+        return UcasalConfig.circuit_breaker_enabled()
+
+    @staticmethod
+    def is_failure(status_code:int=None)->bool:
+        ''' status_code=None indica un error de conexión o timeout. Los 4xx (salvo 429) son errores del llamador '''
+        return status_code is None or status_code >= 500 or status_code == 429
+
+    @classmethod
+    def states(cls)->list:
+        return [breaker.snapshot() for breaker in list(cls._breakers.values())]
+
+    @classmethod
+    def reset(cls, endpoint_name:str=None):
+        for name, breaker in list(cls._breakers.items()):
+            if endpoint_name is None or name == endpoint_name:
+                breaker.reset()
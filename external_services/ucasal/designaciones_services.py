@@ -1,12 +1,14 @@
 from file.models import File
-import requests
 from core.exceptions import AthentoseError
 from custom.sp_libs.python.sp_logger.sp_logger import SpLogger
 from ucasal2.utils import UcasalConfig
 from ucasal2.model.ucasal.exceptions import UcasalServiceError
+from ucasal2.external_services.ucasal.http_transport import UcasalHttpTransport
+from ucasal2.external_services.ucasal.metrics import UcasalMetrics
 
 class DesignacionesServices:
-    @classmethod    
+    @classmethod
+    @UcasalMetrics.timed('designaciones_notify_blockchain_success')
     def notify_blockchain_success(cls, uuid: str, state: int, auth_token: str) -> str:
         logger = SpLogger.getLogger("athentose")
         logger.entry()        
@@ -22,7 +24,7 @@ class DesignacionesServices:
             }
 
             logger.debug(f"[Designaciones] PATCH {endpoint} con payload={data}")
-            resp = requests.patch(url=endpoint, json=data, headers=headers)
+            resp = UcasalHttpTransport.patch('change_designaciones', url=endpoint, json=data, headers=headers)
             resp.raise_for_status()
             return resp
         except Exception as e:
@@ -40,6 +42,7 @@ class DesignacionesServices:
     
 
     @classmethod
+    @UcasalMetrics.timed('designaciones_change_state')
     def change_state_integration(cls, uuid: str, state: int, auth_token: str):
         """
         Notifica al backend UCASAL el cambio de estado de una Designación.
@@ -60,7 +63,7 @@ class DesignacionesServices:
             }
 
             logger.debug(f"[Designaciones] PATCH {endpoint} con payload={data}")
-            resp = requests.patch(url=endpoint, json=data, headers=headers)
+            resp = UcasalHttpTransport.patch('change_designaciones', url=endpoint, json=data, headers=headers)
 
             logger.debug(f"[Designaciones] Respuesta UCASAL ({resp.status_code}): {resp.text}")
             resp.raise_for_status()
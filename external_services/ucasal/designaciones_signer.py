@@ -0,0 +1,416 @@
+import locale
+import threading
+import uuid as uuid_lib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.db import transaction
+from file.models import File
+from core.exceptions import AthentoseError
+from custom.sp_libs.python.logging import SpLogger
+from custom.sp_libs.python.sp_pdf_otp_simple_signer.sp_pdf_otp_simple_signer import SpPdfSimpleSigner, QRInfo, OTPInfo
+from ucasal2.utils import (
+    UcasalConfig,
+    DesignacionesStates,
+    get_mail_for_otp,
+    get_arg_time,
+    get_pdf_hash,
+    save_signed_pdf,
+    qr_image_path,
+    db_connection_closing,
+)
+from ucasal2.model.signature_overlay import SignatureOverlay
+from ucasal2.external_services.ucasal.ucasal_services import UcasalServices
+from ucasal2.external_services.ucasal.qr_cache import UcasalQrCache
+from ucasal2.external_services.ucasal.bfa_anchoring import BfaAnchoring
+from ucasal2.external_services.ucasal.designaciones_services import DesignacionesServices
+from ucasal2.external_services.ucasal.outbox import UcasalOutbox
+from ucasal2.external_services.ucasal.signing_journal import SigningJournal
+
+
+class DesignacionesSigner:
+    """Firma de designaciones por el Vicerrector Administrativo (VR).
+
+    - signature_data / sign_pdf / save_signed / mark_registered: pasos de la firma de una designación, compartidos
+      por la operación FirmaDesignacionesVR y la firma en lote
+    - start_batch: valida un OTP y obtiene un token una sola vez, y firma en segundo plano un conjunto de
+      designaciones. Los QR y las firmas corren en un pool acotado ('ucasal.designaciones.batch.workers'); guardar
+      el binario, registrar en BFA (en lotes de 'ucasal.designaciones.batch.register_chunk') y pasar cada documento
+      a 'Pendiente de Blockchain' se hace en el thread del lote, de a un documento por vez
+    - batch_progress: avance y resultado por documento, guardado en el cache de Django
+    El avance y los locks por designación (que evitan que dos lotes superpuestos firmen el mismo documento) viven en
+    el cache de Django: con varios workers de Gunicorn el backend configurado tiene que ser compartido (redis,
+    memcached, db); con un cache local al proceso el avance sólo se ve desde el worker que arrancó el lote
+    """
+    logger = SpLogger("athentose", "DesignacionesSigner")
+
+    VR_GROUP = 'Vicerrector Administrativo'
+    QR_POSITION = {'x': 845, 'y': 11, 'width': 70, 'height': 70}
+
+    PROGRESS_PREFIX = 'ucasal2.designaciones.lote'
+    PROGRESS_TTL_SECONDS = 24 * 3600
+    LOCK_PREFIX = 'ucasal2.designaciones.lote.lock'
+    # Si el proceso muere sin liberar los locks, vencen solos. Se toman por LOCK_TTL_SECONDS más
+    # LOCK_SECONDS_PER_DOCUMENT por documento del lote, y se renuevan cuando empieza la firma de cada documento
+    LOCK_TTL_SECONDS = 2 * 3600
+    LOCK_SECONDS_PER_DOCUMENT = 60
+
+    STATUS_RUNNING = 'running'
+    STATUS_FINISHED = 'finished'
+    STATUS_FAILED = 'failed'
+
+    # Resultado por documento
+    RESULT_PENDING_BLOCKCHAIN = 'pendiente_blockchain'
+    RESULT_SKIPPED = 'skipped'
+    RESULT_ERROR = 'error'
+
+    # ------------------------------------------------------------- una designación
+
+    @classmethod
+    def signature_data(cls, nombre_vr:str, mail_vr:str)->dict:
+        ''' Texto junto al QR, OTPInfo y fecha de la firma; es el mismo para todas las designaciones de una firma '''
+        mail_vr_ofuscado = get_mail_for_otp(mail_vr)
+        fecha_firma_texto = get_arg_time()
+        try:
+            locale.setlocale(locale.LC_TIME, 'es_AR.UTF-8')
+        except Exception:
+            pass
+        now = datetime.now()
+        return {
+            'nombre_vr': nombre_vr,
+            'mail_vr_ofuscado': mail_vr_ofuscado,
+            'fecha_firma_texto': fecha_firma_texto,
+            'fecha_firma': {'day': now.strftime("%d"), 'month': now.strftime("%B"), 'year': now.strftime("%Y")},
+            'qr_text': (
+                "Firmado con OTP por:\r\n"
+                f"{nombre_vr}\r\n"
+                f"{mail_vr_ofuscado}\r\n"
+                f"{fecha_firma_texto}"
+            ),
+            'otp_info': OTPInfo(
+                mail="\n" + mail_vr_ofuscado,
+                ip="N/A",
+                latitude=0.0,
+                longitude=0.0,
+                accuracy="N/A",
+                user_agent="Athentose/Signer"
+            ),
+        }
+
+    @classmethod
+    def overlay(cls, signature:dict):
+        ''' Capa de firma sin el QR (cambia por designación), o None si el motor no es 'overlay' '''
+        if not SignatureOverlay.enabled():
+            return None
+        return SignatureOverlay(image_text=signature['qr_text'], otp_info=signature['otp_info'], **cls.QR_POSITION)
+
+    @classmethod
+    def journal(cls, fil:File)->SigningJournal:
+        return SigningJournal(fil.uuid, SigningJournal.FLOW_DESIGNACIONES)
+
+    @classmethod
+    def already_signed(cls, fil:File, journal:SigningJournal)->bool:
+        ''' True si ya está firmada, aunque un intento anterior se haya cortado antes de guardar la feature '''
+        if fil.gfv('firmada_con_otp') == "1":
+            return True
+        if journal.signed_hash(fil):
+            fil.set_feature('firmada_con_otp', "1")
+            return True
+        return False
+
+    @classmethod
+    def validation_qr(cls, fil:File, auth_token:str, journal:SigningJournal)->bytes:
+        ''' QR de la URL de validación; la URL corta de un intento anterior se reutiliza '''
+        url_to_shorten = UcasalConfig.designaciones_validation_url_template().replace('{{uuid}}', str(fil.uuid))
+        short_url = journal.short_url(lambda: UcasalQrCache.get_short_url(auth_token=auth_token, url=url_to_shorten))
+        return journal.record_qr(short_url, UcasalQrCache.get_qr_image(url=short_url))
+
+    @classmethod
+    def sign_pdf(cls, fil:File, qr_stream:bytes, signature:dict, overlay:SignatureOverlay=None):
+        ''' Firma el PDF de la designación sin guardarlo. Devuelve el io.BytesIO firmado. No usa el ORM '''
+        if overlay is not None:
+            return overlay.sign(fil.path(), qr_image=qr_stream)
+        if SignatureOverlay.enabled():
+            return SignatureOverlay(
+                image_text=signature['qr_text'], otp_info=signature['otp_info'], qr_image=qr_stream, **cls.QR_POSITION
+            ).sign(fil.path())
+
+        # QRInfo usando image_path + image_text; la imagen del QR se pasa desde memoria
+        with qr_image_path(qr_stream) as qr_image_tmp_path:
+            qr_info = QRInfo(image_path=qr_image_tmp_path, image_text=signature['qr_text'], **cls.QR_POSITION)
+            return SpPdfSimpleSigner().sign(fil.path(), qr_info, signature['otp_info'])
+
+    @classmethod
+    def save_signed(cls, fil:File, signed_result, signature:dict)->str:
+        ''' Actualiza el binario y las features de la firma. Devuelve el SHA-256 del PDF guardado '''
+        with transaction.atomic():
+            pdf_hash = save_signed_pdf(fil, signed_result, f"{fil.filename}.pdf")
+            fil.set_feature('firmada_con_otp', "1")
+            cls.journal(fil).record_sign({fil.uuid: pdf_hash})
+
+        # No se guarda el QR en Base64 en la base de datos para evitar error de indice (8191 bytes)
+        fil.set_feature('bodyFinal', {
+            'fecha_firma': signature['fecha_firma'],
+            'qr_data': {},
+            'qr_text': {
+                'firmado_por': 'Firmado con OTP por:',
+                'nombre_vr': signature['nombre_vr'],
+                'mail_vr': signature['mail_vr_ofuscado'],
+                'fecha_firma': signature['fecha_firma_texto'],
+            }
+        })
+        fil.set_metadata('metadata.designaciones_usuario_firmante', signature['nombre_vr'], overwrite=True)
+        return pdf_hash
+
+    @classmethod
+    def check_not_registered(cls, fil:File):
+        registrada_en_blockchain = fil.gfv('registro_blockchain')
+        if registrada_en_blockchain == 'pending':
+            raise AthentoseError('La designación ya había sido enviada a blockchain y su resultado aún está pendiente')
+        if registrada_en_blockchain == 'success':
+            raise AthentoseError('La designación ya está registrada en blockchain')
+
+    @classmethod
+    def mark_registered(cls, fil:File, ok_response_text:str):
+        ''' Después de enviar el hash a BFA: estado 4 a UCASAL (por el outbox) y paso a Pendiente de Blockchain '''
+        with transaction.atomic():
+            fil.set_feature('ucasal2.svc.ok_response', ok_response_text)
+            fil.set_feature('registro_blockchain', 'pending')
+            UcasalOutbox.notify(UcasalOutbox.DESIGNACIONES_STATE, str(fil.uuid), state=4)
+            if fil.life_cycle_state.name == DesignacionesStates.pendiente_firma_otp:
+                fil.change_life_cycle_state(DesignacionesStates.pendiente_blockchain)
+
+    # ------------------------------------------------------------------------ lote
+
+    @classmethod
+    def start_batch(cls, uuids:list, usuario, otp:int)->dict:
+        '''
+        Valida que el usuario logueado sea del grupo del VR y su OTP, y arranca la firma del lote en un thread.
+        Devuelve el avance inicial (con 'job_id').
+        Los errores de validación (usuario, OTP, cantidad de documentos) se lanzan acá, antes de arrancar.
+        '''
+        uuids = list(dict.fromkeys(str(u) for u in uuids))
+        if not uuids:
+            raise AthentoseError("'uuids' no puede estar vacío")
+        max_documents = UcasalConfig.designaciones_batch_max_documents()
+        if len(uuids) > max_documents:
+            raise AthentoseError(f"Se pueden firmar hasta {max_documents} designaciones por lote, se recibieron {len(uuids)}")
+
+        if usuario is None or not getattr(usuario, 'is_authenticated', False):
+            raise AthentoseError("No hay un usuario autenticado para firmar las designaciones")
+        if not usuario.groups.filter(name=cls.VR_GROUP).exists():
+            raise AthentoseError(f"El usuario logueado no pertenece al grupo '{cls.VR_GROUP}'")
+        if not usuario.email:
+            raise AthentoseError("El mail del Vicerrector Administrativo no se pudo obtener")
+        nombre_vr = f"{usuario.first_name or ''} {usuario.last_name or ''}".strip()
+
+        UcasalServices.validate_otp(user=usuario.email, otp=otp)
+        auth_token = UcasalServices.get_auth_token(user=UcasalConfig.token_svc_user(), password=UcasalConfig.token_svc_password())
+
+        job_id = uuid_lib.uuid4().hex
+        progress = {
+            'job_id': job_id,
+            'status': cls.STATUS_RUNNING,
+            'total': len(uuids),
+            'done': 0,
+            'ok': 0,
+            'skipped': 0,
+            'errors': 0,
+            'started_at': datetime.now().isoformat(),
+            'finished_at': None,
+            'results': {},
+        }
+        cls._save_progress(progress)
+
+        def run():
+            try:
+                cls.sign_batch(uuids, nombre_vr, usuario.email, auth_token, progress)
+                progress['status'] = cls.STATUS_FINISHED
+            except Exception as e:
+                cls.logger.error(f'Error en el lote de firma de designaciones {job_id}: {e}')
+                progress['status'] = cls.STATUS_FAILED
+                progress['error'] = str(e)
+            finally:
+                cls._release_locks(uuids, job_id)
+            progress['finished_at'] = datetime.now().isoformat()
+            cls._save_progress(progress)
+
+        threading.Thread(target=db_connection_closing(run), name=f'designaciones-lote-{job_id[:8]}', daemon=True).start()
+        return dict(progress, results={})
+
+    @classmethod
+    def batch_progress(cls, job_id:str)->dict:
+        from django.core.cache import cache
+        return cache.get(f'{cls.PROGRESS_PREFIX}.{job_id}')
+
+    @classmethod
+    def sign_batch(cls, uuids:list, nombre_vr:str, mail_vr:str, auth_token:str, progress:dict):
+        ''' Firma, guarda y registra en BFA las designaciones. Actualiza 'progress' a medida que avanza '''
+        logger = cls.logger
+        signature = cls.signature_data(nombre_vr, mail_vr)
+        overlay = cls.overlay(signature)
+        files = {str(f.uuid): f for f in File.objects.filter(uuid__in=uuids)}
+
+        to_sign = []
+        lock_ttl = cls.LOCK_TTL_SECONDS + cls.LOCK_SECONDS_PER_DOCUMENT * len(uuids)
+        for uuid in uuids:
+            fil = files.get(uuid)
+            try:
+                if fil is None:
+                    raise AthentoseError(f"La designación '{uuid}' no existe")
+                if fil.doctype.name != 'designaciones':
+                    raise AthentoseError(f"El documento '{uuid}' es de tipo '{fil.doctype.label}' en lugar de 'designaciones'")
+                if fil.life_cycle_state.name != DesignacionesStates.pendiente_firma_otp:
+                    cls._result(progress, uuid, cls.RESULT_SKIPPED, error=f"Estado '{fil.life_cycle_state.name}'")
+                    continue
+                try:
+                    cls.check_not_registered(fil)
+                except AthentoseError as e:
+                    # Ya enviada o registrada en BFA (p.ej. por una corrida anterior del lote): no es un error
+                    cls._result(progress, uuid, cls.RESULT_SKIPPED, error=str(e))
+                    continue
+                if not cls._acquire_lock(uuid, progress['job_id'], lock_ttl):
+                    cls._result(progress, uuid, cls.RESULT_SKIPPED, error="Otro lote está firmando la designación")
+                    continue
+                to_sign.append(fil)
+            except AthentoseError as e:
+                cls._result(progress, uuid, cls.RESULT_ERROR, error=str(e))
+        cls._save_progress(progress)
+
+        workers = max(1, UcasalConfig.designaciones_batch_workers())
+        chunk_size = max(1, UcasalConfig.designaciones_batch_register_chunk())
+        prepare = db_connection_closing(lambda fil: cls._prepare(fil, auth_token, signature, overlay))
+        # Cada documento firmado queda en memoria hasta guardarlo: se acota cuántos hay en vuelo
+        window = workers * 2
+        pending_registration = []
+        running = {}
+        queue = list(to_sign)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='designaciones-lote') as executor:
+            while queue or running:
+                while queue and len(running) < window:
+                    fil = queue.pop(0)
+                    if not cls._refresh_lock(str(fil.uuid), progress['job_id']):
+                        cls._result(progress, str(fil.uuid), cls.RESULT_SKIPPED, error="Otro lote está firmando la designación")
+                        continue
+                    running[executor.submit(prepare, fil)] = fil
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    fil = running.pop(future)
+                    uuid = str(fil.uuid)
+                    try:
+                        signed_result = future.result()
+                        if signed_result is None:
+                            # Ya estaba firmada: se registra el hash actual
+                            pdf_hash = get_pdf_hash(fil)
+                        else:
+                            pdf_hash = cls.save_signed(fil, signed_result, signature)
+                        pending_registration.append((fil, pdf_hash))
+                    except Exception as e:
+                        logger.error(f'Error firmando la designación {uuid}: {e}')
+                        cls._result(progress, uuid, cls.RESULT_ERROR, error=str(e))
+                        cls._save_progress(progress)
+
+                if len(pending_registration) >= chunk_size or (not queue and not running and pending_registration):
+                    cls._register(pending_registration, auth_token, progress)
+                    pending_registration = []
+                    cls._save_progress(progress)
+
+        logger.debug(
+            f"Lote de designaciones: ok={progress['ok']} omitidas={progress['skipped']} errores={progress['errors']}"
+        )
+        return progress
+
+    @classmethod
+    def _prepare(cls, fil:File, auth_token:str, signature:dict, overlay:SignatureOverlay):
+        ''' Corre en el pool: QR y firma. Devuelve el PDF firmado, o None si ya estaba firmado '''
+        journal = cls.journal(fil)
+        if cls.already_signed(fil, journal):
+            return None
+        qr_stream = cls.validation_qr(fil, auth_token, journal)
+        return cls.sign_pdf(fil, qr_stream, signature, overlay)
+
+    @classmethod
+    def _register(cls, pending:list, auth_token:str, progress:dict):
+        # Las registradas en un intento anterior que se cortó antes de cambiar de estado sólo se completan
+        to_register = []
+        for fil, pdf_hash in pending:
+            ok_response_text = cls.journal(fil).registered(pdf_hash)
+            if ok_response_text is None:
+                to_register.append((fil, pdf_hash))
+                continue
+            try:
+                cls.mark_registered(fil, ok_response_text)
+                cls._result(progress, str(fil.uuid), cls.RESULT_PENDING_BLOCKCHAIN, hash=pdf_hash)
+            except Exception as e:
+                cls._result(progress, str(fil.uuid), cls.RESULT_ERROR, hash=pdf_hash, error=str(e))
+        pending = to_register
+        if not pending:
+            return
+
+        entries = [
+            {
+                'hash': pdf_hash,
+                'file_uuid': str(fil.uuid),
+                'doctype': 'designaciones',
+                'callback_url': DesignacionesServices.set_callback_url(uuid=str(fil.uuid)),
+            }
+            for fil, pdf_hash in pending
+        ]
+        try:
+            results = BfaAnchoring.register_batch(auth_token=auth_token, entries=entries)
+        except Exception as e:
+            for fil, _ in pending:
+                cls._result(progress, str(fil.uuid), cls.RESULT_ERROR, error=f'Error registrando en blockchain: {e}')
+            return
+
+        for (fil, pdf_hash), result in zip(pending, results):
+            uuid = str(fil.uuid)
+            if not result['ok']:
+                cls._result(progress, uuid, cls.RESULT_ERROR, hash=pdf_hash, error=f"Error registrando en blockchain: {result['error']}")
+                continue
+            cls.journal(fil).record_register(pdf_hash, result['response'])
+            try:
+                cls.mark_registered(fil, result['response'])
+                cls._result(progress, uuid, cls.RESULT_PENDING_BLOCKCHAIN, hash=pdf_hash)
+            except Exception as e:
+                cls._result(progress, uuid, cls.RESULT_ERROR, hash=pdf_hash, error=str(e))
+
+    @classmethod
+    def _result(cls, progress:dict, uuid:str, result:str, hash:str=None, error:str=None):
+        progress['results'][uuid] = {'result': result, 'hash': hash, 'error': error}
+        progress['done'] += 1
+        key = {cls.RESULT_PENDING_BLOCKCHAIN: 'ok', cls.RESULT_SKIPPED: 'skipped'}.get(result, 'errors')
+        progress[key] += 1
+
+    @classmethod
+    def _acquire_lock(cls, uuid:str, job_id:str, ttl:int)->bool:
+        from django.core.cache import cache
+        return cache.add(f'{cls.LOCK_PREFIX}.{uuid}', job_id, ttl)
+
+    @classmethod
+    def _refresh_lock(cls, uuid:str, job_id:str)->bool:
+        ''' Renueva el lock del lote antes de firmar el documento; si venció lo vuelve a tomar si está libre '''
+        from django.core.cache import cache
+        key = f'{cls.LOCK_PREFIX}.{uuid}'
+        owner = cache.get(key)
+        if owner == job_id:
+            return cache.touch(key, cls.LOCK_TTL_SECONDS) or cache.add(key, job_id, cls.LOCK_TTL_SECONDS)
+        if owner is None:
+            return cache.add(key, job_id, cls.LOCK_TTL_SECONDS)
+        return False
+
+    @classmethod
+    def _release_locks(cls, uuids:list, job_id:str):
+        ''' Libera sólo los locks tomados por este lote '''
+        from django.core.cache import cache
+        try:
+            keys = [f'{cls.LOCK_PREFIX}.{uuid}' for uuid in uuids]
+            owned = [key for key, owner in cache.get_many(keys).items() if owner == job_id]
+            cache.delete_many(owned)
+        except Exception as e:
+            cls.logger.error(f'No se pudieron liberar los locks del lote de designaciones {job_id}: {e}')
+
+    @classmethod
+    def _save_progress(cls, progress:dict):
+        from django.core.cache import cache
+        cache.set(f"{cls.PROGRESS_PREFIX}.{progress['job_id']}", progress, cls.PROGRESS_TTL_SECONDS)
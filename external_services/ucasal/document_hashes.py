@@ -0,0 +1,84 @@
+from django.db import transaction, IntegrityError
+from django.db.models import Max
+from django.utils import timezone
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.models import DocumentHash
+
+
+class DocumentHashIndex:
+    """Índice hash -> documento (tabla ucasal2_document_hash).
+
+    BfaAnchoring.register / register_batch agregan una fila por cada hash que se envía a BFA, así que lo llenan
+    todos los caminos de firma (actas, designaciones y títulos), en modo directo o Merkle. Los manejadores del
+    resultado de BFA actualizan bfa_status. Para los documentos firmados antes de existir la tabla está el
+    comando 'ucasal_hash_backfill'.
+    Escribir en el índice nunca corta la firma: los errores se registran en el log.
+    """
+    logger = SpLogger("athentose", "DocumentHashIndex")
+
+    @classmethod
+    def record(cls, file_uuid:str, doctype:str, hash:str, bfa_status:str=DocumentHash.STATUS_PENDING)->DocumentHash:
+        ''' Agrega el hash del documento (o actualiza su estado si ya estaba) y devuelve la fila, o None si falló '''
+        file_uuid = str(file_uuid)
+        try:
+            # Savepoint propio: si falla no arrastra la transacción de quien llama
+            with transaction.atomic():
+                row = DocumentHash.objects.filter(file_uuid=file_uuid, sha256=hash).first()
+                if row is None:
+                    version = (DocumentHash.objects.filter(file_uuid=file_uuid).aggregate(v=Max('version'))['v'] or 0) + 1
+                    try:
+                        with transaction.atomic():
+                            return DocumentHash.objects.create(
+                                sha256=hash, file_uuid=file_uuid, doctype=doctype, version=version, bfa_status=bfa_status
+                            )
+                    except IntegrityError:
+                        # Otro proceso registró el mismo hash al mismo tiempo
+                        row = DocumentHash.objects.get(file_uuid=file_uuid, sha256=hash)
+                if row.bfa_status != bfa_status:
+                    cls._set_status(row, bfa_status)
+                return row
+        except Exception as e:
+            cls.logger.error(f'No se pudo registrar el hash {hash} del documento {file_uuid} en el índice: {e}')
+            return None
+
+    @classmethod
+    def set_bfa_status(cls, file_uuid:str, status:str, hash:str=None):
+        ''' Estado de BFA del hash indicado o, si no se indica, de la última versión registrada del documento '''
+        try:
+            with transaction.atomic():
+                rows = DocumentHash.objects.filter(file_uuid=str(file_uuid))
+                if hash:
+                    rows = rows.filter(sha256=hash)
+                row = rows.order_by('-version').first()
+                if row is None:
+                    cls.logger.warning(f'El documento {file_uuid} no tiene hashes en el índice')
+                    return
+                cls._set_status(row, status)
+        except Exception as e:
+            cls.logger.error(f'No se pudo actualizar el estado BFA del documento {file_uuid} en el índice: {e}')
+
+    @classmethod
+    def lookup(cls, hash:str)->list:
+        ''' Documentos cuyo binario firmado tiene el SHA-256 indicado, del más antiguo al más reciente '''
+        return [
+            cls.as_dict(row)
+            for row in DocumentHash.objects.filter(sha256=hash.lower()).order_by('registered_at', 'id')
+        ]
+
+    @staticmethod
+    def as_dict(row:DocumentHash)->dict:
+        return {
+            'hash': row.sha256,
+            'uuid': row.file_uuid,
+            'doctype': row.doctype,
+            'version': row.version,
+            'registered_at': row.registered_at.isoformat() if row.registered_at else None,
+            'bfa_status': row.bfa_status,
+            'bfa_resolved_at': row.bfa_resolved_at.isoformat() if row.bfa_resolved_at else None,
+        }
+
+    @staticmethod
+    def _set_status(row:DocumentHash, status:str):
+        row.bfa_status = status
+        row.bfa_resolved_at = None if status == DocumentHash.STATUS_PENDING else timezone.now()
+        row.save(update_fields=['bfa_status', 'bfa_resolved_at'])
@@ -0,0 +1,385 @@
+import re
+import json
+import math
+import time
+import zlib
+import random
+import struct
+import hashlib
+import threading
+from base64 import b64decode, urlsafe_b64encode
+from urllib.parse import urlparse, parse_qs
+from urllib.request import Request, urlopen
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from custom.sp_libs.python.logging import SpLogger
+
+
+class LatencyModel:
+    """Distribución de latencia en ms:
+    - {'distribution': 'fixed', 'value': 50}
+    - {'distribution': 'uniform', 'min': 20, 'max': 200}
+    - {'distribution': 'lognormal', 'p50': 50, 'p95': 300}
+    """
+    def __init__(self, spec:dict=None):
+        self.spec = dict(spec or {'distribution': 'fixed', 'value': 0})
+
+    def sample_seconds(self, rnd:random.Random)->float:
+        spec = self.spec
+        distribution = spec.get('distribution', 'fixed')
+        if distribution == 'fixed':
+            ms = float(spec.get('value', 0))
+        elif distribution == 'uniform':
+            ms = rnd.uniform(float(spec.get('min', 0)), float(spec.get('max', 0)))
+        elif distribution == 'lognormal':
+            p50 = max(float(spec.get('p50', 1)), 0.001)
+            p95 = max(float(spec.get('p95', p50)), p50)
+            # p95 = p50 * e^(1.645 * sigma)
+            sigma = math.log(p95 / p50) / 1.645
+            ms = rnd.lognormvariate(math.log(p50), sigma)
+        else:
+            raise ValueError(f"Distribución de latencia desconocida: '{distribution}'")
+        return max(ms, 0.0) / 1000
+
+
+class FakeUcasalServer:
+    """Servidor local que imita los endpoints de UCASAL, para pruebas de carga y benchmarks sin red.
+
+    Endpoints (relativos a la URL base, ver config_keys()):
+      POST  /gettoken                       -> token JWT con 'exp'
+      GET   /qr?b64=<url>                   -> PNG
+      POST  /acortar_url                    -> {'url_corta': ...}   (GET /s/<código> redirige a la URL original)
+      POST  /stamps, /stamps/batch          -> registra el hash y luego envía el callback de BFA a 'callbackUrl'
+      PATCH /change_acta/<uuid>, /change_equivalencia/<uuid>, /change_designaciones/<uuid>
+      GET   /otp/<usuario>/<token>          -> 200, o 401 si el token está en profile['otp']['invalid']
+      POST  /titulos/update-finalize, /titulos/update-rejected
+      GET   /_stats                         -> contadores por endpoint
+
+    El perfil define la latencia, la tasa de errores y la tasa de timeouts por endpoint:
+      {
+        "seed": 1,
+        "default":   {"latency_ms": {"distribution": "lognormal", "p50": 50, "p95": 200},
+                      "error_rate": 0.0, "error_status": 503, "timeout_rate": 0.0, "timeout_seconds": 60},
+        "endpoints": {"stamps": {"error_rate": 0.05}, "qr": {"latency_ms": {"distribution": "fixed", "value": 400}}},
+        "callbacks": {"enabled": true, "delay_ms": {"distribution": "uniform", "min": 1000, "max": 5000},
+                      "failure_rate": 0.0},
+        "otp": {"invalid": ["000000"]},
+        "token_ttl_seconds": 1800
+      }
+    Un "timeout" retiene la respuesta 'timeout_seconds' (más que el read timeout del cliente) y luego responde 504.
+    """
+    logger = SpLogger("athentose", "FakeUcasalServer")
+
+    DEFAULT_PROFILE = {
+        'default': {
+            'latency_ms': {'distribution': 'fixed', 'value': 0},
+            'error_rate': 0.0,
+            'error_status': 503,
+            'timeout_rate': 0.0,
+            'timeout_seconds': 60,
+        },
+        'endpoints': {},
+        'callbacks': {'enabled': True, 'delay_ms': {'distribution': 'fixed', 'value': 1000}, 'failure_rate': 0.0},
+        'otp': {'invalid': ['000000']},
+        'token_ttl_seconds': 1800,
+    }
+
+    ROUTES = [
+        ('POST', r'^/gettoken/?$', 'gettoken', '_gettoken'),
+        ('GET', r'^/qr/?$', 'qr', '_qr'),
+        ('POST', r'^/acortar_url/?$', 'acortar_url', '_acortar_url'),
+        ('GET', r'^/s/(?P<code>[0-9a-f]+)/?$', 'acortar_url', '_resolve_short_url'),
+        ('POST', r'^/stamps/batch/?$', 'stamps', '_stamps_batch'),
+        ('POST', r'^/stamps/?$', 'stamps', '_stamps'),
+        ('PATCH', r'^/change_acta/(?P<uuid>[^/]+)/?$', 'change_acta', '_change_state'),
+        ('PATCH', r'^/change_equivalencia/(?P<uuid>[^/]+)/?$', 'change_equivalencia', '_change_state'),
+        ('PATCH', r'^/change_designaciones/(?P<uuid>[^/]+)/?$', 'change_designaciones', '_change_state'),
+        ('GET', r'^/otp/(?P<usuario>[^/]+)/(?P<token>[^/]+)/?$', 'otp', '_otp'),
+        ('POST', r'^/titulos/update-(?P<action>finalize|rejected)/?$', 'titulos', '_titulos'),
+        ('GET', r'^/_stats/?$', None, '_stats_response'),
+    ]
+
+    def __init__(self, host:str='127.0.0.1', port:int=8099, profile:dict=None):
+        self.profile = self._merge_profile(profile or {})
+        self._random = random.Random(self.profile.get('seed'))
+        self._random_lock = threading.Lock()
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self._short_urls = {}
+        self._stamp_seq = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self)->str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def config_keys(self, bfaresponse_base_url:str=None)->dict:
+        ''' Valores de SpAthentoConfig para que UcasalConfig apunte a este servidor '''
+        base = self.base_url
+        keys = {
+            'ucasal.endpoint.gettoken.url': f'{base}/gettoken',
+            'ucasal.endpoint.qr.url': f'{base}/qr',
+            'ucasal.endpoint.acortar_url.url': f'{base}/acortar_url',
+            'ucasal.endpoint.stamps.url': f'{base}/stamps',
+            'ucasal.endpoint.stamps.batch_url': f'{base}/stamps/batch',
+            'ucasal.endpoint.change_acta.url': f'{base}/change_acta',
+            'ucasal.endpoint.change_equivalencia.url': f'{base}/change_equivalencia',
+            'ucasal.endpoint.change_designaciones.url': f'{base}/change_designaciones',
+            'ucasal.endpoint.otp.validation_url_template': f'{base}/otp/{{usuario}}/{{token}}',
+            'ucasal.endpoint.titulos.update_finalize.url': f'{base}/titulos/update-finalize',
+            'ucasal.endpoint.titulos.update_rejected.url': f'{base}/titulos/update-rejected',
+        }
+        if bfaresponse_base_url:
+            api = bfaresponse_base_url.rstrip('/')
+            keys['ucasal.designaciones.bfaresponse_endpoint'] = f'{api}/designaciones/'
+            keys['ucasal.bfa.anchor_bfaresponse_endpoint'] = f'{api}/bfa/anchors/'
+        return keys
+
+    def start(self):
+        ''' Atiende en un thread en segundo plano (para usarlo desde benchmarks) '''
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-ucasal', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self)->dict:
+        with self._stats_lock:
+            return json.loads(json.dumps(self._stats))
+
+    # ---------------------------------------------------------------- despacho
+
+    def _dispatch(self, handler:BaseHTTPRequestHandler, method:str):
+        parsed = urlparse(handler.path)
+        # El body se lee siempre: con keep-alive, un body sin leer corrompería el siguiente request
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        for route_method, pattern, endpoint_name, action in self.ROUTES:
+            match = re.match(pattern, parsed.path)
+            if route_method != method or not match:
+                continue
+            if endpoint_name and self._inject_faults(handler, endpoint_name):
+                return
+            status, content_type, payload, headers = getattr(self, action)(
+                body=body, query=parse_qs(parsed.query), headers=handler.headers, **match.groupdict()
+            )
+            if endpoint_name:
+                self._count(endpoint_name, 'ok' if status < 400 else 'rejected')
+            return self._respond(handler, status, content_type, payload, headers)
+        return self._respond(handler, 404, 'text/plain', b'Not found')
+
+    def _inject_faults(self, handler:BaseHTTPRequestHandler, endpoint_name:str)->bool:
+        ''' Aplica latencia, errores y timeouts del perfil. Devuelve True si ya se respondió '''
+        settings = self._endpoint_settings(endpoint_name)
+        self._count(endpoint_name, 'requests')
+        with self._random_lock:
+            latency = LatencyModel(settings['latency_ms']).sample_seconds(self._random)
+            roll = self._random.random()
+        time.sleep(latency)
+
+        if roll < settings['timeout_rate']:
+            self._count(endpoint_name, 'timeouts')
+            time.sleep(settings['timeout_seconds'])
+            self._respond(handler, 504, 'text/plain', b'Gateway Timeout (simulado)')
+            return True
+        if roll < settings['timeout_rate'] + settings['error_rate']:
+            self._count(endpoint_name, 'errors')
+            status = int(settings['error_status'])
+            self._respond(handler, status, 'text/plain', f'Error simulado {status}'.encode('utf-8'))
+            return True
+        return False
+
+    def _respond(self, handler:BaseHTTPRequestHandler, status:int, content_type:str, payload:bytes, headers:dict=None):
+        try:
+            handler.send_response(status)
+            handler.send_header('Content-Type', content_type)
+            handler.send_header('Content-Length', str(len(payload)))
+            for name, value in (headers or {}).items():
+                handler.send_header(name, value)
+            handler.end_headers()
+            handler.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente cortó por timeout
+            pass
+
+    # ---------------------------------------------------------------- endpoints
+
+    def _gettoken(self, body:bytes, **kwargs):
+        form = parse_qs(body.decode('utf-8'))
+        user = (form.get('usuario') or [''])[0]
+        if not user or not (form.get('clave') or [''])[0]:
+            return 401, 'text/plain', b'Usuario o clave incorrectos', None
+        now = int(time.time())
+        claims = {'sub': user, 'iat': now, 'exp': now + int(self.profile['token_ttl_seconds'])}
+        segments = [
+            self._b64url(json.dumps({'alg': 'none', 'typ': 'JWT'})),
+            self._b64url(json.dumps(claims)),
+            self._b64url(hashlib.sha256(f'{user}{now}'.encode('utf-8')).hexdigest()),
+        ]
+        return 200, 'text/plain', '.'.join(segments).encode('utf-8'), None
+
+    def _qr(self, query:dict, **kwargs):
+        try:
+            url = b64decode((query.get('b64') or [''])[0]).decode('utf-8')
+        except Exception:
+            return 400, 'text/plain', b"Parametro 'b64' invalido", None
+        return 200, 'image/png', self._png_for(url), None
+
+    def _acortar_url(self, body:bytes, **kwargs):
+        data = self._json(body)
+        if not data.get('url'):
+            return 400, 'application/json', b'{"error": "url requerida"}', None
+        code = hashlib.sha256(f"{data.get('entorno', '')}|{data['url']}".encode('utf-8')).hexdigest()[:10]
+        self._short_urls[code] = data['url']
+        return 201, 'application/json', json.dumps({'url_corta': f'{self.base_url}/s/{code}'}).encode('utf-8'), None
+
+    def _resolve_short_url(self, code:str, **kwargs):
+        url = self._short_urls.get(code)
+        if not url:
+            return 404, 'text/plain', b'Not found', None
+        return 302, 'text/plain', b'', {'Location': url}
+
+    def _stamps(self, body:bytes, **kwargs):
+        data = self._json(body)
+        if not data.get('fileHash'):
+            return 400, 'application/json', b'{"error": "fileHash requerido"}', None
+        return 200, 'application/json', json.dumps(self._stamp(data['fileHash'], data.get('callbackUrl'))).encode('utf-8'), None
+
+    def _stamps_batch(self, body:bytes, **kwargs):
+        items = self._json(body).get('items') or []
+        results = [
+            self._stamp(item['fileHash'], item.get('callbackUrl')) if item.get('fileHash') else {'error': 'fileHash requerido'}
+            for item in items
+        ]
+        return 200, 'application/json', json.dumps({'results': results}).encode('utf-8'), None
+
+    def _change_state(self, body:bytes, uuid:str, **kwargs):
+        data = self._json(body)
+        if 'estado' not in data:
+            return 400, 'application/json', b'{"error": "estado requerido"}', None
+        return 200, 'application/json', json.dumps({'uuid': uuid, 'estado': data['estado']}).encode('utf-8'), None
+
+    def _otp(self, usuario:str, token:str, **kwargs):
+        if token in [str(t) for t in self.profile['otp'].get('invalid', [])]:
+            return 401, 'text/plain', b'OTP invalido', None
+        return 200, 'application/json', json.dumps({'usuario': usuario, 'valido': True}).encode('utf-8'), None
+
+    def _titulos(self, body:bytes, action:str, **kwargs):
+        data = self._json(body)
+        if not data.get('uuid'):
+            return 400, 'application/json', b'{"error": "uuid requerido"}', None
+        return 200, 'application/json', json.dumps({'uuid': data['uuid'], 'status': data.get('status'), 'action': action}).encode('utf-8'), None
+
+    def _stats_response(self, **kwargs):
+        return 200, 'application/json', json.dumps(self.stats()).encode('utf-8'), None
+
+    # ---------------------------------------------------------------- callbacks de BFA
+
+    def _stamp(self, file_hash:str, callback_url:str)->dict:
+        with self._stats_lock:
+            self._stamp_seq += 1
+            seq = self._stamp_seq
+        stamp = {'id': seq, 'fileHash': file_hash, 'status': 'pending'}
+        callbacks = self.profile['callbacks']
+        if callback_url and callbacks.get('enabled', True):
+            with self._random_lock:
+                delay = LatencyModel(callbacks['delay_ms']).sample_seconds(self._random)
+                failed = self._random.random() < float(callbacks.get('failure_rate', 0))
+            body = {
+                'status': 'failure' if failed else 'success',
+                'fileHash': file_hash,
+                'txHash': '0x' + hashlib.sha256(f'{file_hash}{seq}'.encode('utf-8')).hexdigest(),
+                'blockNumber': 1000000 + seq,
+                'timestamp': int(time.time() + delay),
+            }
+            timer = threading.Timer(delay, self._send_callback, args=(callback_url, body))
+            timer.daemon = True
+            timer.start()
+        return stamp
+
+    def _send_callback(self, callback_url:str, body:dict):
+        request = Request(callback_url, data=json.dumps(body).encode('utf-8'), method='POST', headers={'Content-Type': 'application/json'})
+        try:
+            with urlopen(request, timeout=30) as response:
+                self._count('callbacks', 'ok' if response.status < 400 else 'rejected')
+        except Exception as e:
+            self._count('callbacks', 'errors')
+            self.logger.warning(f'Error enviando el callback de BFA a {callback_url}: {e}')
+
+    # ---------------------------------------------------------------- auxiliares
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                fake._dispatch(self, 'GET')
+
+            def do_POST(self):
+                fake._dispatch(self, 'POST')
+
+            def do_PATCH(self):
+                fake._dispatch(self, 'PATCH')
+
+            def log_message(self, format, *args):
+                fake.logger.debug(format % args)
+
+        return Handler
+
+    @classmethod
+    def _merge_profile(cls, profile:dict)->dict:
+        merged = json.loads(json.dumps(cls.DEFAULT_PROFILE))
+        for key, value in profile.items():
+            if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                merged[key].update(value)
+            else:
+                merged[key] = value
+        return merged
+
+    def _endpoint_settings(self, endpoint_name:str)->dict:
+        return dict(self.profile['default'], **self.profile['endpoints'].get(endpoint_name, {}))
+
+    def _count(self, endpoint_name:str, name:str):
+        with self._stats_lock:
+            counters = self._stats.setdefault(endpoint_name, {})
+            counters[name] = counters.get(name, 0) + 1
+
+    @staticmethod
+    def _json(body:bytes)->dict:
+        try:
+            data = json.loads(body.decode('utf-8')) if body else {}
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    @staticmethod
+    def _b64url(text:str)->str:
+        return urlsafe_b64encode(text.encode('utf-8')).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def _png_for(text:str, modules:int=29, scale:int=8)->bytes:
+        ''' PNG en blanco y negro con un patrón derivado del texto (del tamaño de un QR real) '''
+        bits = ''.join(f'{b:08b}' for b in hashlib.sha512(text.encode('utf-8')).digest())
+        size = modules * scale
+        rows = []
+        for y in range(size):
+            row = bytearray([0])  # filtro 'None'
+            for x in range(size):
+                index = (y // scale) * modules + (x // scale)
+                row.append(0 if bits[index % len(bits)] == '1' else 255)
+            rows.append(bytes(row))
+
+        def chunk(kind:bytes, data:bytes)->bytes:
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+        header = struct.pack('>IIBBBBB', size, size, 8, 0, 0, 0, 0)
+        return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(b''.join(rows), 9)) + chunk(b'IEND', b'')
@@ -0,0 +1,140 @@
+import os
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.utils import UcasalConfig
+from ucasal2.external_services.ucasal.circuit_breaker import UcasalCircuitBreakers
+from ucasal2.external_services.ucasal.metrics import UcasalMetrics
+
+
+class JitteredRetry(Retry):
+    """Retry de urllib3 con backoff exponencial más un jitter aleatorio de hasta 'jitter' segundos"""
+
+    def __init__(self, *args, jitter:float=0.0, **kwargs):
+        self.jitter = jitter
+        super().__init__(*args, **kwargs)
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.jitter = self.jitter
+        return retry
+
+    def get_backoff_time(self)->float:
+        backoff = super().get_backoff_time()
+        return backoff + random.uniform(0, self.jitter) if backoff > 0 else backoff
+
+
+class UcasalHttpTransport:
+    """Transporte HTTP compartido por todos los clientes de UCASAL.
+
+    - Una requests.Session con pool de conexiones keep-alive por proceso (se recrea tras un fork)
+    - Timeouts (connect, read) por endpoint, configurados en 'ucasal.http.<endpoint>.*'
+    - Reintentos acotados con backoff exponencial y jitter, sólo para verbos idempotentes y nunca para los
+      endpoints de NON_RETRYABLE_ENDPOINTS (usan una sesión aparte, sin reintentos)
+    - Un circuit breaker por endpoint (UcasalCircuitBreakers) que falla rápido si el servicio está degradado
+    - Métricas por endpoint (UcasalMetrics): duración, status e in-flight
+    """
+    logger = SpLogger("athentose", "UcasalHttpTransport")
+
+    IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+    RETRY_STATUS_CODES = frozenset([429, 502, 503, 504])
+    # El OTP es de un solo uso: si el primer intento llegó al servicio, un reintento lo rechazaría como inválido
+    NON_RETRYABLE_ENDPOINTS = frozenset(['otp'])
+
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+    @classmethod
+    def session(cls, retries:bool=True)->requests.Session:
+        pid = os.getpid()
+        key = (pid, retries)
+        session = cls._sessions.get(key)
+        if session is None:
+            with cls._sessions_lock:
+                session = cls._sessions.get(key)
+                if session is None:
+                    # Las sesiones heredadas de otro proceso no se reutilizan
+                    for stale in [k for k in cls._sessions if k[0] != pid]:
+                        del cls._sessions[stale]
+                    session = cls._sessions[key] = cls._build_session(retries)
+        return session
+
+    @classmethod
+    def retry_policy(cls)->JitteredRetry:
+        return JitteredRetry(
+            total=UcasalConfig.http_max_retries(),
+            backoff_factor=UcasalConfig.http_backoff_factor(),
+            jitter=UcasalConfig.http_backoff_jitter(),
+            allowed_methods=cls.IDEMPOTENT_METHODS,
+            status_forcelist=cls.RETRY_STATUS_CODES,
+            raise_on_status=False,
+        )
+
+    @classmethod
+    def backoff_seconds(cls, attempt:int)->float:
+        ''' Espera antes del reintento número 'attempt' (1..n), con la misma política que JitteredRetry '''
+        backoff = UcasalConfig.http_backoff_factor() * (2 ** (attempt - 1))
+        return backoff + random.uniform(0, UcasalConfig.http_backoff_jitter())
+
+    @classmethod
+    def is_retryable(cls, method:str, status_code:int=None, endpoint_name:str=None)->bool:
+        ''' status_code=None indica un error de conexión o timeout '''
+        if method.upper() not in cls.IDEMPOTENT_METHODS or endpoint_name in cls.NON_RETRYABLE_ENDPOINTS:
+            return False
+        return status_code is None or status_code in cls.RETRY_STATUS_CODES
+
+    @classmethod
+    def _build_session(cls, retries:bool=True)->requests.Session:
+        adapter = HTTPAdapter(
+            pool_connections=UcasalConfig.http_pool_connections(),
+            pool_maxsize=UcasalConfig.http_pool_maxsize(),
+            max_retries=cls.retry_policy() if retries else 0,
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        cls.logger.debug(f'Sesión HTTP {"con" if retries else "sin"} reintentos creada para el proceso {os.getpid()}')
+        return session
+
+    @classmethod
+    def request(cls, method:str, endpoint_name:str, url:str, **kwargs)->requests.Response:
+        with UcasalMetrics.track(endpoint_name, method) as call:
+            response = cls._request(method, endpoint_name, url, **kwargs)
+            call.status(response.status_code)
+            return response
+
+    @classmethod
+    def _request(cls, method:str, endpoint_name:str, url:str, **kwargs)->requests.Response:
+        kwargs.setdefault('timeout', UcasalConfig.http_timeout(endpoint_name))
+        session = cls.session(retries=endpoint_name not in cls.NON_RETRYABLE_ENDPOINTS)
+        breaker = UcasalCircuitBreakers.get(endpoint_name) if UcasalCircuitBreakers.is_enabled() else None
+        if breaker is None:
+            return session.request(method=method, url=url, **kwargs)
+
+        # Con el breaker abierto se lanza UcasalCircuitOpenError sin llamar al servicio
+        breaker.before_call()
+        start = time.monotonic()
+        ok = False
+        try:
+            response = session.request(method=method, url=url, **kwargs)
+            ok = not UcasalCircuitBreakers.is_failure(response.status_code)
+            return response
+        finally:
+            # También ante BaseException (KeyboardInterrupt, timeouts de gevent): libera la llamada de prueba de half_open
+            breaker.record(ok=ok, duration=time.monotonic() - start)
+
+    @classmethod
+    def get(cls, endpoint_name:str, url:str, **kwargs)->requests.Response:
+        return cls.request('GET', endpoint_name, url, **kwargs)
+
+    @classmethod
+    def post(cls, endpoint_name:str, url:str, **kwargs)->requests.Response:
+        return cls.request('POST', endpoint_name, url, **kwargs)
+
+    @classmethod
+    def patch(cls, endpoint_name:str, url:str, **kwargs)->requests.Response:
+        return cls.request('PATCH', endpoint_name, url, **kwargs)
@@ -0,0 +1,36 @@
+import io
+from ucasal2.utils import UcasalConfig
+
+
+class LocalQrRenderer:
+    """Genera en proceso el PNG del QR que devuelve el servicio 'ucasal.endpoint.qr.url'.
+
+    Usa la librería 'qrcode' (con Pillow). El nivel de corrección de errores, el tamaño de módulo y
+    el borde se configuran en 'ucasal.qr.local.*' para igualar la imagen del servicio remoto.
+    """
+
+    ERROR_CORRECTION_LEVELS = ('L', 'M', 'Q', 'H')
+
+    @classmethod
+    def render(cls, url:str)->bytes:
+        import qrcode
+        from qrcode.image.pil import PilImage
+
+        level = str(UcasalConfig.qr_local_error_correction()).upper()
+        if level not in cls.ERROR_CORRECTION_LEVELS:
+            raise ValueError(f"'ucasal.qr.local.error_correction' debe ser uno de {cls.ERROR_CORRECTION_LEVELS} en lugar de '{level}'")
+
+        qr = qrcode.QRCode(
+            version=None,
+            error_correction=getattr(qrcode.constants, f'ERROR_CORRECT_{level}'),
+            box_size=UcasalConfig.qr_local_box_size(),
+            border=UcasalConfig.qr_local_border(),
+        )
+        qr.add_data(url)
+        qr.make(fit=True)
+
+        # Imagen de 1 bit por pixel: el PNG resultante es mucho más chico que uno RGB
+        image = qr.make_image(image_factory=PilImage)
+        stream = io.BytesIO()
+        image.save(stream, format='PNG', optimize=True)
+        return stream.getvalue()
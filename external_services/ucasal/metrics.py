@@ -0,0 +1,306 @@
+import os
+import time
+import socket
+import inspect
+import threading
+from functools import wraps
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.utils import UcasalConfig
+
+
+class _NoopCall:
+    ''' Se devuelve con las métricas deshabilitadas: no mide nada '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def status(self, status_code):
+        pass
+
+
+class _TrackedCall:
+    def __init__(self, endpoint:str, method:str):
+        self.labels = (('endpoint', endpoint), ('method', method))
+        self._status = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        UcasalMetrics._add_gauge('ucasal_http_requests_in_flight', self.labels[:1], 1)
+        return self
+
+    def status(self, status_code):
+        self._status = str(status_code)
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        UcasalMetrics._add_gauge('ucasal_http_requests_in_flight', self.labels[:1], -1)
+        status = self._status if exc_type is None else UcasalMetrics.error_label(exc_type)
+        UcasalMetrics._observe('ucasal_http_request_duration_seconds', self.labels, duration)
+        UcasalMetrics._inc('ucasal_http_requests_total', self.labels + (('status', status or 'unknown'),))
+        UcasalMetrics._maybe_flush()
+        return False
+
+
+class UcasalMetrics:
+    """Métricas de las llamadas a UCASAL, exportables en formato de texto de Prometheus.
+
+    - ucasal_http_request_duration_seconds{endpoint,method}: histograma por llamada HTTP (incluye los reintentos de urllib3)
+    - ucasal_http_requests_total{endpoint,method,status}: status es el código HTTP o timeout / connection_error /
+      circuit_open / error
+    - ucasal_http_requests_in_flight{endpoint}: llamadas en curso
+    - ucasal_operation_duration_seconds{operation} y ucasal_operations_total{operation,outcome}: métodos de
+      UcasalServices / DesignacionesServices (incluye aciertos de cache, p.ej. del token)
+
+    Con 'ucasal.metrics.enabled' en False, track() devuelve un objeto vacío y timed() llama directo a la
+    función; el valor de la configuración se relee como mucho cada CONFIG_TTL_SECONDS.
+    Cada proceso acumula sus métricas y cada 'ucasal.metrics.flush_seconds' deja una copia en el cache de
+    Django, para que export(aggregate=True) sume las de todos los workers.
+    """
+    logger = SpLogger("athentose", "UcasalMetrics")
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    CONFIG_TTL_SECONDS = 30
+    CACHE_PREFIX = 'ucasal2.metrics'
+    # Las copias de procesos que dejaron de publicar (reiniciados) vencen solas
+    CACHE_TTL_SECONDS = 300
+
+    METRICS = {
+        'ucasal_http_request_duration_seconds': ('histogram', 'Duración de las llamadas HTTP a UCASAL'),
+        'ucasal_http_requests_total': ('counter', 'Llamadas HTTP a UCASAL por endpoint, método y status'),
+        'ucasal_http_requests_in_flight': ('gauge', 'Llamadas HTTP a UCASAL en curso'),
+        'ucasal_operation_duration_seconds': ('histogram', 'Duración de las operaciones de los servicios de UCASAL'),
+        'ucasal_operations_total': ('counter', 'Operaciones de los servicios de UCASAL por resultado'),
+    }
+
+    _NOOP = _NoopCall()
+    _lock = threading.Lock()
+    _counters = {}
+    _gauges = {}
+    _histograms = {}
+    _enabled = None
+    _enabled_checked_at = 0.0
+    _flush_seconds = 15
+    _flushed_at = 0.0
+
+    @classmethod
+    def is_enabled(cls)->bool:
+        now = time.monotonic()
+        if cls._enabled is None or now - cls._enabled_checked_at > cls.CONFIG_TTL_SECONDS:
+            cls._enabled = bool(UcasalConfig.metrics_enabled())
+            cls._flush_seconds = UcasalConfig.metrics_flush_seconds()
+            cls._enabled_checked_at = now
+        return cls._enabled
+
+    @classmethod
+    def track(cls, endpoint:str, method:str):
+        ''' Context manager para una llamada HTTP: with UcasalMetrics.track('qr', 'GET') as call: ...; call.status(200) '''
+        if not cls.is_enabled():
+            return cls._NOOP
+        return _TrackedCall(endpoint, method.upper())
+
+    @classmethod
+    def timed(cls, operation:str):
+        ''' Decorador para métodos de servicio (sincrónicos o async); va debajo de @classmethod '''
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def f_async(*args, **kargs):
+                    if not cls.is_enabled():
+                        return await func(*args, **kargs)
+                    start = time.perf_counter()
+                    outcome = 'ok'
+                    try:
+                        return await func(*args, **kargs)
+                    except BaseException as e:
+                        outcome = cls.error_label(type(e))
+                        raise
+                    finally:
+                        cls._record_operation(operation, outcome, time.perf_counter() - start)
+                return f_async
+
+            @wraps(func)
+            def f(*args, **kargs):
+                if not cls.is_enabled():
+                    return func(*args, **kargs)
+                start = time.perf_counter()
+                outcome = 'ok'
+                try:
+                    return func(*args, **kargs)
+                except BaseException as e:
+                    outcome = cls.error_label(type(e))
+                    raise
+                finally:
+                    cls._record_operation(operation, outcome, time.perf_counter() - start)
+            return f
+        return decorator
+
+    @classmethod
+    def _record_operation(cls, operation:str, outcome:str, duration:float):
+        labels = (('operation', operation),)
+        cls._observe('ucasal_operation_duration_seconds', labels, duration)
+        cls._inc('ucasal_operations_total', labels + (('outcome', outcome),))
+
+    @staticmethod
+    def error_label(exc_type)->str:
+        name = exc_type.__name__
+        if name == 'UcasalCircuitOpenError':
+            return 'circuit_open'
+        if 'Timeout' in name:
+            return 'timeout'
+        if 'Connect' in name:
+            return 'connection_error'
+        if name == 'InvalidOtpError':
+            return 'invalid_otp'
+        if name == 'CancelledError':
+            return 'cancelled'
+        return 'error'
+
+    @classmethod
+    def snapshot(cls)->dict:
+        with cls._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in cls._counters.items()],
+                'gauges': [[name, list(labels), value] for (name, labels), value in cls._gauges.items()],
+                'histograms': [[name, list(labels), list(h[0]), h[1], h[2]] for (name, labels), h in cls._histograms.items()],
+            }
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._counters.clear()
+            cls._gauges.clear()
+            cls._histograms.clear()
+
+    @classmethod
+    def flush(cls):
+        ''' Publica la copia de este proceso en el cache de Django '''
+        from django.core.cache import cache
+        key = cls._process_key()
+        cache.set(key, cls.snapshot(), cls.CACHE_TTL_SECONDS)
+        index_key = f'{cls.CACHE_PREFIX}.processes'
+        keys = cache.get(index_key) or []
+        # Se quitan del índice los procesos cuya copia ya venció
+        alive = cache.get_many(keys)
+        keys = [k for k in keys if k in alive]
+        if key not in keys:
+            keys.append(key)
+        cache.set(index_key, keys, None)
+        cls._flushed_at = time.monotonic()
+
+    @classmethod
+    def export(cls, aggregate:bool=False)->str:
+        ''' Formato de texto de Prometheus. aggregate=True suma las copias de todos los procesos '''
+        snapshots = [cls.snapshot()]
+        if aggregate:
+            snapshots = cls._process_snapshots()
+        merged = cls._merge(snapshots)
+
+        lines = []
+        for name, (kind, help_text) in cls.METRICS.items():
+            series = merged.get(name)
+            if not series:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(series.items()):
+                if kind != 'histogram':
+                    lines.append(f'{name}{cls._format_labels(labels)} {cls._format_value(value)}')
+                    continue
+                buckets, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(cls.BUCKETS, buckets):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{cls._format_labels(labels + (("le", repr(bound)),))} {cumulative}')
+                lines.append(f'{name}_bucket{cls._format_labels(labels + (("le", "+Inf"),))} {count}')
+                lines.append(f'{name}_sum{cls._format_labels(labels)} {cls._format_value(total)}')
+                lines.append(f'{name}_count{cls._format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    # ---------------------------------------------------------------- registro
+
+    @classmethod
+    def _inc(cls, name:str, labels:tuple, value:float=1):
+        key = (name, labels)
+        with cls._lock:
+            cls._counters[key] = cls._counters.get(key, 0) + value
+
+    @classmethod
+    def _add_gauge(cls, name:str, labels:tuple, value:float):
+        key = (name, labels)
+        with cls._lock:
+            cls._gauges[key] = cls._gauges.get(key, 0) + value
+
+    @classmethod
+    def _observe(cls, name:str, labels:tuple, value:float):
+        key = (name, labels)
+        with cls._lock:
+            histogram = cls._histograms.get(key)
+            if histogram is None:
+                histogram = cls._histograms[key] = [[0] * len(cls.BUCKETS), 0.0, 0]
+            for i, bound in enumerate(cls.BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    @classmethod
+    def _maybe_flush(cls):
+        if time.monotonic() - cls._flushed_at < cls._flush_seconds:
+            return
+        try:
+            cls.flush()
+        except Exception as e:
+            # Las métricas nunca deben cortar una llamada a UCASAL
+            cls._flushed_at = time.monotonic()
+            cls.logger.warning(f'No se pudieron publicar las métricas en el cache: {e}')
+
+    @classmethod
+    def _process_snapshots(cls)->list:
+        from django.core.cache import cache
+        own_key = cls._process_key()
+        keys = cache.get(f'{cls.CACHE_PREFIX}.processes') or []
+        snapshots = [cls.snapshot()]
+        for key, snapshot in cache.get_many([k for k in keys if k != own_key]).items():
+            snapshots.append(snapshot)
+        return snapshots
+
+    @classmethod
+    def _merge(cls, snapshots:list)->dict:
+        merged = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot.get('counters', []) + snapshot.get('gauges', []):
+                series = merged.setdefault(name, {})
+                labels = tuple(tuple(label) for label in labels)
+                series[labels] = series.get(labels, 0) + value
+            for name, labels, buckets, total, count in snapshot.get('histograms', []):
+                series = merged.setdefault(name, {})
+                labels = tuple(tuple(label) for label in labels)
+                current = series.get(labels)
+                if current is None:
+                    series[labels] = [list(buckets), total, count]
+                else:
+                    current[0] = [a + b for a, b in zip(current[0], buckets)]
+                    current[1] += total
+                    current[2] += count
+        return merged
+
+    @classmethod
+    def _process_key(cls)->str:
+        return f'{cls.CACHE_PREFIX}.{socket.gethostname()}.{os.getpid()}'
+
+    @staticmethod
+    def _format_labels(labels:tuple)->str:
+        if not labels:
+            return ''
+        escaped = ','.join(
+            '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for k, v in labels
+        )
+        return '{' + escaped + '}'
+
+    @staticmethod
+    def _format_value(value:float)->str:
+        return repr(float(value)) if isinstance(value, float) else str(value)
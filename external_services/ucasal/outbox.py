@@ -0,0 +1,172 @@
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+from file.models import File
+from core.exceptions import AthentoseError
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.utils import UcasalConfig, encodeJSON, decodeJSON
+from ucasal2.external_services.ucasal.ucasal_services import UcasalServices
+from ucasal2.external_services.ucasal.designaciones_services import DesignacionesServices
+from ucasal2.models import UcasalOutboxMessage
+
+
+class UcasalOutbox:
+    """Outbox de notificaciones de cambio de estado a UCASAL.
+
+    notify() se llama dentro de la misma transacción que el cambio de ciclo de vida: el mensaje queda
+    guardado junto con el cambio, y el comando 'ucasal_outbox_dispatch' lo envía después, en lotes, con
+    reintentos y respetando el orden de los mensajes de cada uuid. Así el tiempo de respuesta de UCASAL
+    no forma parte del request del usuario ni del callback de BFA.
+    Con 'ucasal.outbox.enabled' en False el mensaje se envía en línea, como antes.
+    """
+    logger = SpLogger("athentose", "UcasalOutbox")
+
+    ACTA_REJECTION = 'acta.rejection'
+    ACTA_BLOCKCHAIN_SUCCESS = 'acta.blockchain_success'
+    DESIGNACIONES_STATE = 'designaciones.state'
+
+    # Tiempo que un dispatcher retiene un mensaje; si se cae, otro lo retoma al vencer
+    LEASE_SECONDS = 300
+
+    @classmethod
+    def notify(cls, kind:str, file_uuid:str, **payload):
+        if kind not in cls._handlers():
+            raise AthentoseError(f"Tipo de notificación desconocido: '{kind}'")
+        if not UcasalConfig.outbox_enabled():
+            auth_token = cls._auth_token()
+            return cls._handlers()[kind](str(file_uuid), payload, auth_token)
+        return UcasalOutboxMessage.objects.create(
+            file_uuid=str(file_uuid),
+            kind=kind,
+            payload=encodeJSON(payload),
+            next_attempt_at=timezone.now(),
+        )
+
+    @classmethod
+    def dispatch(cls, batch_size:int=100)->dict:
+        ''' Envía un lote de mensajes vencidos. Devuelve {'sent': n, 'retried': n, 'failed': n, 'skipped': n} '''
+        logger = cls.logger
+        summary = {'sent': 0, 'retried': 0, 'failed': 0, 'skipped': 0}
+        messages = cls._claim(batch_size)
+        if not messages:
+            return summary
+
+        auth_token = cls._auth_token()
+        blocked_uuids = set()
+        for message in messages:
+            # Orden por uuid: si un mensaje anterior del mismo uuid sigue sin enviarse, éste espera
+            if message.file_uuid in blocked_uuids or cls._has_older_unsent(message):
+                cls._release(message)
+                summary['skipped'] += 1
+                continue
+            try:
+                response = cls._handlers()[message.kind](message.file_uuid, decodeJSON(message.payload), auth_token)
+                message.status = UcasalOutboxMessage.STATUS_SENT
+                message.response = str(response)[:2000] if response is not None else ''
+                message.sent_at = timezone.now()
+                message.last_error = ''
+                message.attempts += 1
+                message.save(update_fields=['status', 'response', 'sent_at', 'last_error', 'attempts'])
+                summary['sent'] += 1
+            except Exception as e:
+                blocked_uuids.add(message.file_uuid)
+                if cls._fail(message, e):
+                    summary['failed'] += 1
+                else:
+                    summary['retried'] += 1
+        logger.debug(f'Outbox: {summary}')
+        return summary
+
+    @classmethod
+    def _claim(cls, batch_size:int)->list:
+        now = timezone.now()
+        with transaction.atomic():
+            messages = list(
+                UcasalOutboxMessage.objects.select_for_update(skip_locked=True)
+                .filter(status__in=[UcasalOutboxMessage.STATUS_PENDING, UcasalOutboxMessage.STATUS_SENDING], next_attempt_at__lte=now)
+                .order_by('id')[:batch_size]
+            )
+            ids = [m.id for m in messages]
+            UcasalOutboxMessage.objects.filter(id__in=ids).update(
+                status=UcasalOutboxMessage.STATUS_SENDING,
+                next_attempt_at=now + timedelta(seconds=cls.LEASE_SECONDS),
+            )
+        return messages
+
+    @classmethod
+    def _release(cls, message:UcasalOutboxMessage):
+        UcasalOutboxMessage.objects.filter(id=message.id).update(status=UcasalOutboxMessage.STATUS_PENDING, next_attempt_at=timezone.now())
+
+    @classmethod
+    def _has_older_unsent(cls, message:UcasalOutboxMessage)->bool:
+        return UcasalOutboxMessage.objects.filter(
+            file_uuid=message.file_uuid,
+            id__lt=message.id,
+            status__in=[UcasalOutboxMessage.STATUS_PENDING, UcasalOutboxMessage.STATUS_SENDING],
+        ).exists()
+
+    @classmethod
+    def _fail(cls, message:UcasalOutboxMessage, error:Exception)->bool:
+        ''' Agenda el reintento con backoff exponencial. Devuelve True si se agotaron los intentos '''
+        message.attempts += 1
+        message.last_error = str(error)[:2000]
+        exhausted = message.attempts >= UcasalConfig.outbox_max_attempts()
+        if exhausted:
+            message.status = UcasalOutboxMessage.STATUS_FAILED
+            cls.logger.error(f'Outbox: se agotaron los intentos del mensaje {message.id} ({message.kind}) para {message.file_uuid}: {error}')
+        else:
+            delay = min(UcasalConfig.outbox_retry_base_seconds() * (2 ** (message.attempts - 1)), UcasalConfig.outbox_retry_max_seconds())
+            message.status = UcasalOutboxMessage.STATUS_PENDING
+            message.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+            cls.logger.warning(f'Outbox: error enviando el mensaje {message.id} ({message.kind}) para {message.file_uuid}, reintento en {delay}s: {error}')
+        message.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+        if exhausted:
+            cls._notify_failure(message)
+        return exhausted
+
+    @classmethod
+    def _notify_failure(cls, message:UcasalOutboxMessage):
+        try:
+            from file.foperations import op_send_by_email
+            fil = File.objects.filter(uuid=message.file_uuid).first()
+            if fil:
+                fil.set_feature('error_servicio_externo', True)
+                op_send_by_email.run(
+                    message.file_uuid,
+                    send_to_groups='SISTEMAS',
+                    notifications_template='ucasal2_error_in_ucasal_service_call_notification',
+                    error=f'{message.kind}: {message.last_error}',
+                    url=fil.get_url_file_view(),
+                )
+        except Exception as e:
+            cls.logger.error(f'Outbox: no se pudo notificar el fallo del mensaje {message.id}: {e}')
+
+    @staticmethod
+    def _auth_token()->str:
+        return UcasalServices.get_auth_token(user=UcasalConfig.token_svc_user(), password=UcasalConfig.token_svc_password())
+
+    @classmethod
+    def _handlers(cls)->dict:
+        return {
+            cls.ACTA_REJECTION: cls._send_acta_rejection,
+            cls.ACTA_BLOCKCHAIN_SUCCESS: cls._send_acta_blockchain_success,
+            cls.DESIGNACIONES_STATE: cls._send_designaciones_state,
+        }
+
+    @staticmethod
+    def _send_acta_rejection(file_uuid:str, payload:dict, auth_token:str):
+        return UcasalServices.notify_rejection(auth_token=auth_token, uuid=file_uuid, previous_uuid=payload.get('previous_uuid', ''), reason=payload.get('reason', '-'))
+
+    @staticmethod
+    def _send_acta_blockchain_success(file_uuid:str, payload:dict, auth_token:str):
+        return UcasalServices.notify_blockchain_success(auth_token=auth_token, uuid=file_uuid)
+
+    @staticmethod
+    def _send_designaciones_state(file_uuid:str, payload:dict, auth_token:str):
+        state = payload['state']
+        response = DesignacionesServices.change_state_integration(uuid=file_uuid, state=state, auth_token=auth_token)
+        fil = File.objects.filter(uuid=file_uuid).first()
+        if fil:
+            fil.set_feature(f'Response estado {state}', response.text)
+            fil.set_feature(f'Status Code {state}', response.status_code)
+        return response.text
@@ -0,0 +1,196 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.utils import UcasalConfig
+from ucasal2.external_services.ucasal.ucasal_services import UcasalServices
+from ucasal2.external_services.ucasal.singleflight import UcasalSingleflight
+
+
+class UcasalQrCache:
+    """Cache de URLs cortas e imágenes QR, direccionado por contenido.
+
+    URL de validación -> URL corta -> PNG. La URL de validación de un uuid no cambia, por lo que
+    los re-intentos de firma (Fallo en Blockchain, re-ejecución de operaciones, hijos de un título)
+    no vuelven a llamar a los servicios de UCASAL.
+    - En memoria: LRU acotado por tamaño en bytes ('ucasal.qr_cache.memory_max_bytes')
+    - En disco: '<ucasal.qr_cache.dir>/<sha256[:2]>/<sha256>.<url|png>', acotado por 'ucasal.qr_cache.disk_max_bytes'
+    """
+    logger = SpLogger("athentose", "UcasalQrCache")
+
+    # Cada cuántas escrituras en disco se verifica el tamaño total del directorio
+    DISK_PRUNE_EVERY = 100
+
+    _memory = OrderedDict()
+    _memory_bytes = 0
+    _lock = threading.Lock()
+    _disk_writes = 0
+    _stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'disk_evictions': 0}
+
+    @classmethod
+    def get_validation_qr(cls, auth_token:str, validation_url:str)->tuple:
+        ''' Devuelve (short_url, qr_png_bytes) para la URL de validación de un documento '''
+        short_url = cls.get_short_url(auth_token=auth_token, url=validation_url)
+        return short_url, cls.get_qr_image(url=short_url)
+
+    @classmethod
+    def get_short_url(cls, auth_token:str, url:str)->str:
+        # El entorno forma parte de la clave: la misma URL genera URLs cortas distintas por entorno
+        key = cls._key('url', f'{UcasalConfig.shorten_url_svc_env()}|{url}')
+        cached = cls._get(key)
+        if cached is None:
+            cached = cls._fetch(key, lambda: UcasalServices.get_short_url(auth_token=auth_token, url=url).encode('utf-8'))
+        return cached.decode('utf-8')
+
+    @classmethod
+    def get_qr_image(cls, url:str)->bytes:
+        key = cls._key('png', url)
+        cached = cls._get(key)
+        if cached is not None:
+            return cached
+        return cls._fetch(key, lambda: UcasalServices.get_qr_image(url=url))
+
+    @classmethod
+    def stats(cls)->dict:
+        with cls._lock:
+            stats = dict(cls._stats)
+            stats['memory_entries'] = len(cls._memory)
+            stats['memory_bytes'] = cls._memory_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    @classmethod
+    def clear_memory(cls):
+        with cls._lock:
+            cls._memory.clear()
+            cls._memory_bytes = 0
+
+    @classmethod
+    def _fetch(cls, key:tuple, fetch)->bytes:
+        ''' Obtiene y guarda un valor ausente; otro proceso que lo esté obteniendo lo deja en disco ('recheck') '''
+        def fetch_and_put():
+            value = fetch()
+            cls._put(key, value)
+            return value
+        kind, digest = key
+        return UcasalSingleflight.do(f'qr_cache|{kind}|{digest}', fetch_and_put, recheck=lambda: cls._read_disk(key))
+
+    @classmethod
+    def _get(cls, key:tuple):
+        with cls._lock:
+            value = cls._memory.get(key)
+            if value is not None:
+                cls._memory.move_to_end(key)
+                cls._stats['memory_hits'] += 1
+                return value
+
+        value = cls._read_disk(key)
+        if value is not None:
+            cls._count('disk_hits')
+            cls._put_memory(key, value)
+            return value
+
+        cls._count('misses')
+        return None
+
+    @classmethod
+    def _put(cls, key:tuple, value:bytes):
+        cls._put_memory(key, value)
+        try:
+            cls._write_disk(key, value)
+        except Exception as e:
+            # El cache en disco es una optimización: un error de escritura no debe cortar la firma
+            cls.logger.warning(f'No se pudo escribir en el cache de QR en disco: {e}')
+
+    @classmethod
+    def _put_memory(cls, key:tuple, value:bytes):
+        max_bytes = UcasalConfig.qr_cache_memory_max_bytes()
+        if len(value) > max_bytes:
+            return
+        with cls._lock:
+            previous = cls._memory.pop(key, None)
+            if previous is not None:
+                cls._memory_bytes -= len(previous)
+            cls._memory[key] = value
+            cls._memory_bytes += len(value)
+            while cls._memory_bytes > max_bytes:
+                _, evicted = cls._memory.popitem(last=False)
+                cls._memory_bytes -= len(evicted)
+                cls._stats['evictions'] += 1
+
+    @classmethod
+    def _read_disk(cls, key:tuple):
+        path = cls._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            cls.logger.warning(f'No se pudo leer el cache de QR en disco ({path}): {e}')
+            return None
+        # Se actualiza mtime para que la poda en disco también sea LRU
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    @classmethod
+    def _write_disk(cls, key:tuple, value:bytes):
+        path = cls._path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        with NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as tmp:
+            tmp.write(value)
+        os.replace(tmp.name, path)
+
+        with cls._lock:
+            cls._disk_writes += 1
+            prune = cls._disk_writes % cls.DISK_PRUNE_EVERY == 0
+        if prune:
+            cls._prune_disk()
+
+    @classmethod
+    def _prune_disk(cls):
+        root = UcasalConfig.qr_cache_dir()
+        max_bytes = UcasalConfig.qr_cache_disk_max_bytes()
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        if total <= max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            cls._count('disk_evictions')
+            if total <= max_bytes:
+                break
+
+    @classmethod
+    def _path(cls, key:tuple)->str:
+        kind, digest = key
+        return os.path.join(UcasalConfig.qr_cache_dir(), digest[:2], f'{digest}.{kind}')
+
+    @staticmethod
+    def _key(kind:str, content:str)->tuple:
+        return (kind, hashlib.sha256(content.encode('utf-8')).hexdigest())
+
+    @classmethod
+    def _count(cls, name:str):
+        with cls._lock:
+            cls._stats[name] += 1
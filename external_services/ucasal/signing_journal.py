@@ -0,0 +1,138 @@
+import hashlib
+from django.db import transaction
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.utils import UcasalConfig, encodeJSON, decodeJSON, get_pdf_hash
+from ucasal2.models import SigningJournalEntry
+
+
+class SigningJournal:
+    """Diario de las etapas completadas de la firma de un documento (tabla ucasal2_signing_journal).
+
+    Si registerotp, FirmaDesignacionesVR o FirmaTituloOTP se cortan a mitad de camino (p.ej. después de firmar
+    y antes de registrar en BFA), el reintento toma del diario lo que ya se hizo en lugar de repetirlo:
+    - STAGE_QR: {'short_url', 'qr_sha256'}; no se vuelve a pedir la URL corta a UCASAL
+    - STAGE_SIGN: {'hashes': {uuid: SHA-256}} del binario firmado y guardado; no se vuelve a firmar (ni a
+      estampar un segundo QR) aunque no haya llegado a guardarse la feature de firmado
+    - STAGE_REGISTER: {'hashes', 'response'} de BFA; no se vuelve a registrar el hash, sólo se completan
+      features y estado
+    Las etapas STAGE_SIGN y STAGE_REGISTER sólo valen para el binario actual: si el SHA-256 cambió se ignoran.
+    Un resultado 'failure' de BFA descarta STAGE_REGISTER, así el reintento vuelve a registrar.
+    Escribir en el diario nunca corta la firma: los errores se registran en el log y el reintento repite la etapa.
+    """
+    logger = SpLogger("athentose", "SigningJournal")
+
+    FLOW_ACTA = 'acta'
+    FLOW_DESIGNACIONES = 'designaciones'
+    FLOW_TITULO = 'titulo'
+
+    STAGE_QR = 'qr'
+    STAGE_SIGN = 'sign'
+    STAGE_REGISTER = 'register_bfa'
+
+    def __init__(self, file_uuid:str, flow:str):
+        self.file_uuid = str(file_uuid)
+        self.flow = flow
+        self._outputs = None
+
+    @classmethod
+    def enabled(cls)->bool:
+        return UcasalConfig.signing_journal_enabled()
+
+    @classmethod
+    def discard_stages(cls, file_uuid:str, flow:str, *stages:str):
+        cls(file_uuid, flow).discard(*stages)
+
+    def output(self, stage:str)->dict:
+        ''' Salida de la etapa si está completa en el diario, o None '''
+        return self._load().get(stage)
+
+    def record(self, stage:str, **output):
+        if not self.enabled():
+            return
+        try:
+            # Savepoint propio: si falla no arrastra la transacción de quien llama
+            with transaction.atomic():
+                SigningJournalEntry.objects.update_or_create(
+                    file_uuid=self.file_uuid, flow=self.flow, stage=stage, defaults={'output': encodeJSON(output)}
+                )
+            self._load()[stage] = output
+        except Exception as e:
+            self.logger.error(f"No se pudo anotar la etapa '{stage}' de la firma '{self.flow}' del documento {self.file_uuid}: {e}")
+
+    def discard(self, *stages:str):
+        ''' Descarta las etapas indicadas o, si no se indica ninguna, el diario completo del documento '''
+        try:
+            with transaction.atomic():
+                rows = SigningJournalEntry.objects.filter(file_uuid=self.file_uuid, flow=self.flow)
+                if stages:
+                    rows = rows.filter(stage__in=stages)
+                rows.delete()
+        except Exception as e:
+            self.logger.error(f"No se pudo descartar el diario de la firma '{self.flow}' del documento {self.file_uuid}: {e}")
+        if self._outputs is not None:
+            for stage in (stages or list(self._outputs)):
+                self._outputs.pop(stage, None)
+
+    # ------------------------------------------------------------------------ etapas
+
+    def short_url(self, fetch)->str:
+        ''' URL corta anotada o, si no hay, la que devuelve fetch() '''
+        output = self.output(self.STAGE_QR)
+        if output:
+            return output['short_url']
+        return fetch()
+
+    def record_qr(self, short_url:str, qr_image:bytes)->bytes:
+        ''' Anota la URL corta y el digest del QR. Devuelve el QR para usarlo en línea '''
+        qr_sha256 = hashlib.sha256(qr_image).hexdigest()
+        output = self.output(self.STAGE_QR)
+        if output and output['short_url'] == short_url and output['qr_sha256'] != qr_sha256:
+            # El QR se vuelve a generar desde la URL corta: puede variar el PNG pero no lo que codifica
+            self.logger.debug(f'El QR del documento {self.file_uuid} cambió respecto del intento anterior')
+        if output != {'short_url': short_url, 'qr_sha256': qr_sha256}:
+            self.record(self.STAGE_QR, short_url=short_url, qr_sha256=qr_sha256)
+        return qr_image
+
+    def record_sign(self, hashes:dict):
+        ''' {uuid: SHA-256} de los binarios firmados y guardados; se llama dentro de la misma transacción '''
+        self.record(self.STAGE_SIGN, hashes={str(uuid): pdf_hash for uuid, pdf_hash in hashes.items()})
+
+    def signed_hashes(self, files:list)->dict:
+        '''
+        {uuid: SHA-256} si todos los documentos ya se firmaron en un intento anterior y su binario actual es el
+        firmado, o None. Si algún binario cambió desde entonces el diario ya no vale y se descarta entero
+        '''
+        output = self.output(self.STAGE_SIGN)
+        if not output:
+            return None
+        hashes = output['hashes']
+        if any(hashes.get(str(fil.uuid)) != get_pdf_hash(fil) for fil in files):
+            self.logger.debug(f"El binario del documento {self.file_uuid} cambió desde la firma anotada: se descarta el diario")
+            self.discard()
+            return None
+        return {fil.uuid: hashes[str(fil.uuid)] for fil in files}
+
+    def signed_hash(self, fil)->str:
+        hashes = self.signed_hashes([fil])
+        return hashes[fil.uuid] if hashes else None
+
+    def record_register(self, hashes, response):
+        self.record(self.STAGE_REGISTER, hashes=hashes, response=response)
+
+    def registered(self, hashes):
+        ''' Respuesta de BFA anotada si esos mismos hashes ya se registraron, o None '''
+        output = self.output(self.STAGE_REGISTER)
+        if output and output['hashes'] == hashes:
+            return output['response']
+        return None
+
+    def _load(self)->dict:
+        if self._outputs is None:
+            self._outputs = {}
+            if self.enabled():
+                try:
+                    for row in SigningJournalEntry.objects.filter(file_uuid=self.file_uuid, flow=self.flow):
+                        self._outputs[row.stage] = decodeJSON(row.output)
+                except Exception as e:
+                    self.logger.error(f"No se pudo leer el diario de la firma '{self.flow}' del documento {self.file_uuid}: {e}")
+        return self._outputs
@@ -0,0 +1,148 @@
+import os
+import time
+import hashlib
+import threading
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.utils import UcasalConfig
+
+
+class _Call:
+    ''' Llamada en curso para una clave: el líder la ejecuta y los seguidores esperan su resultado '''
+    def __init__(self):
+        self.owner = threading.get_ident()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class UcasalSingleflight:
+    """Agrupa llamadas idénticas y concurrentes a los servicios de UCASAL.
+
+    - En el proceso: el primer llamador de una clave (líder) ejecuta la función; los que llegan mientras
+      tanto esperan y reciben el mismo resultado (o la misma excepción)
+    - Entre procesos ('ucasal.singleflight.cross_process'): el líder además toma un lock de archivo en
+      '<ucasal.singleflight.lock_dir>/<sha256[:2]>.lock'. Si tuvo que esperarlo, antes de ejecutar consulta
+      'recheck' (p.ej. el cache en disco) para reutilizar lo que obtuvo el otro proceso. Sin 'recheck' el
+      lock entre procesos no aporta nada y no se toma.
+    Los locks de archivo se reparten en 256 franjas para no crear un archivo por clave.
+    """
+    logger = SpLogger("athentose", "UcasalSingleflight")
+
+    WAIT_STEP_SECONDS = 0.05
+
+    _calls = {}
+    _lock = threading.Lock()
+    _stats = {'leaders': 0, 'shared': 0, 'timeouts': 0, 'cross_process_waits': 0, 'cross_process_hits': 0}
+
+    @classmethod
+    def do(cls, key:str, fn, recheck=None):
+        if not UcasalConfig.singleflight_enabled():
+            return fn()
+
+        with cls._lock:
+            call = cls._calls.get(key)
+            if call is None:
+                call = cls._calls[key] = _Call()
+                role = 'leader'
+            elif call.owner == threading.get_ident():
+                # Llamada reentrante desde el propio líder: esperar sería un deadlock
+                role = 'reentrant'
+            else:
+                role = 'follower'
+
+        if role == 'reentrant':
+            return fn()
+        if role == 'follower':
+            return cls._wait(call, fn)
+
+        cls._count('leaders')
+        try:
+            call.result = cls._run(key, fn, recheck)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with cls._lock:
+                if cls._calls.get(key) is call:
+                    del cls._calls[key]
+            call.done.set()
+
+    @classmethod
+    def stats(cls)->dict:
+        with cls._lock:
+            stats = dict(cls._stats)
+            stats['in_flight'] = len(cls._calls)
+        return stats
+
+    @classmethod
+    def _wait(cls, call:_Call, fn):
+        if not call.done.wait(UcasalConfig.singleflight_wait_timeout_seconds()):
+            # El líder no terminó a tiempo: se ejecuta la llamada sin esperarlo más
+            cls._count('timeouts')
+            return fn()
+        cls._count('shared')
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    @classmethod
+    def _run(cls, key:str, fn, recheck):
+        if recheck is None or not UcasalConfig.singleflight_cross_process():
+            return fn()
+        try:
+            import fcntl
+        except ImportError:
+            return fn()
+
+        path = cls._lock_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            lock_file = open(path, 'a+b')
+        except OSError as e:
+            cls.logger.warning(f'No se pudo abrir el lock de singleflight ({path}): {e}')
+            return fn()
+
+        with lock_file:
+            acquired, waited = cls._acquire(fcntl, lock_file)
+            try:
+                if waited:
+                    value = recheck()
+                    if value is not None:
+                        cls._count('cross_process_hits')
+                        return value
+                return fn()
+            finally:
+                if acquired:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    @classmethod
+    def _acquire(cls, fcntl, lock_file)->tuple:
+        ''' Toma el lock de archivo. Devuelve (obtenido, esperó a otro proceso) '''
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True, False
+        except BlockingIOError:
+            pass
+        cls._count('cross_process_waits')
+        deadline = time.time() + UcasalConfig.singleflight_wait_timeout_seconds()
+        while time.time() < deadline:
+            time.sleep(cls.WAIT_STEP_SECONDS)
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True, True
+            except BlockingIOError:
+                continue
+        # El otro proceso no terminó a tiempo: se sigue sin el lock
+        cls._count('timeouts')
+        return False, True
+
+    @staticmethod
+    def _lock_path(key:str)->str:
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(UcasalConfig.singleflight_lock_dir(), f'{digest[:2]}.lock')
+
+    @classmethod
+    def _count(cls, name:str):
+        with cls._lock:
+            cls._stats[name] += 1
@@ -0,0 +1,330 @@
+import base64
+import locale
+import os
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.db import transaction
+from django.contrib.auth import get_user_model
+from file.models import File
+from core.exceptions import AthentoseError
+from custom.sp_libs.python.logging import SpLogger, NullSpFeatureLogger
+from custom.sp_libs.python.sp_pdf_otp_simple_signer.sp_pdf_otp_simple_signer import SpPdfSimpleSigner, QRInfo, OTPInfo
+from ucasal2.utils import (
+    UcasalConfig,
+    TituloStates,
+    get_mail_for_otp,
+    get_arg_time,
+    get_pdf_hash,
+    save_signed_pdf,
+    qr_image_path,
+    db_connection_closing,
+)
+from ucasal2.model.stage_pipeline import StagePipeline
+from ucasal2.model.signature_overlay import SignatureOverlay
+from ucasal2.external_services.ucasal.ucasal_services import UcasalServices
+from ucasal2.external_services.ucasal.qr_cache import UcasalQrCache
+from ucasal2.external_services.ucasal.bfa_anchoring import BfaAnchoring
+from ucasal2.external_services.ucasal.designaciones_services import DesignacionesServices
+from ucasal2.external_services.ucasal.http_transport import UcasalHttpTransport
+from ucasal2.external_services.ucasal.signing_journal import SigningJournal
+
+
+class TitulosSigner:
+    """Firma de títulos (analítico y diploma) por Secretaría General.
+
+    - sign_titulo: firma los dos hijos de un título, los registra en BFA y lo pasa de estado. Lo usan la
+      operación FirmaTituloOTP y la firma masiva
+    - sign_bulk: firma muchos títulos con un mismo OTP ya validado, de a 'workers' títulos en paralelo, y
+      avisa cada resultado a on_result (el comando 'ucasal_titulos_firma_lote' lo usa para sus checkpoints)
+    Cada etapa completada se anota en el SigningJournal del título: un reintento no vuelve a pedir la URL corta,
+    no vuelve a firmar hijos ya firmados (se registran los hashes de los binarios actuales) y no vuelve a
+    registrar en BFA hashes ya registrados.
+    """
+    logger = SpLogger("athentose", "TitulosSigner")
+
+    SG_GROUP = 'SECRETARIA GRAL'
+    # Posición del QR en analítico y diploma
+    QR_POSITION = {"x": 20, "y": 11, "width": 70, "height": 70}
+
+    RESULT_OK = 'ok'
+    RESULT_SKIPPED = 'skipped'
+    RESULT_ERROR = 'error'
+
+    @classmethod
+    def sg_user(cls, mail:str):
+        ''' Usuario de Secretaría General con ese mail; AthentoseError si no existe o no pertenece al grupo '''
+        usuario = get_user_model().objects.filter(groups__name=cls.SG_GROUP, email__iexact=mail).first()
+        if usuario is None:
+            raise AthentoseError(f"El mail '{mail}' no corresponde a un usuario del grupo '{cls.SG_GROUP}'")
+        return usuario
+
+    @classmethod
+    def auth_token(cls)->str:
+        ''' Token de los servicios UCASAL; sale del cache de tokens, así que pedirlo por título no cuesta una llamada '''
+        return UcasalServices.get_auth_token(user=UcasalConfig.token_svc_user(), password=UcasalConfig.token_svc_password())
+
+    @classmethod
+    def signature_data(cls, nombre_sg:str, mail_sg:str)->dict:
+        ''' Texto junto al QR, OTPInfo y fecha de la firma; es el mismo para todos los títulos de una firma '''
+        mail_sg_ofuscado = get_mail_for_otp(mail_sg)
+        fecha_firma_texto = get_arg_time()
+        try:
+            locale.setlocale(locale.LC_TIME, "es_AR.UTF-8")
+        except Exception:
+            pass
+        now = datetime.now()
+        return {
+            "nombre": nombre_sg,
+            "mail_ofuscado": mail_sg_ofuscado,
+            "fecha_firma_texto": fecha_firma_texto,
+            "fecha_firma": {"day": now.strftime("%d"), "month": now.strftime("%B"), "year": now.strftime("%Y")},
+            "qr_text": (
+                "Firmado con OTP por:\r\n"
+                f"{nombre_sg}\r\n"
+                f"{mail_sg_ofuscado}\r\n"
+                f"{fecha_firma_texto}"
+            ),
+            "otp_info": OTPInfo(
+                mail="\n" + mail_sg_ofuscado,
+                ip="N/A",
+                latitude=0.0,
+                longitude=0.0,
+                accuracy="N/A",
+                user_agent="Athentose/Signer",
+            ),
+        }
+
+    @classmethod
+    def find_children(cls, fil_padre:File)->tuple:
+        ''' (analítico, diploma) del título; AthentoseError si falta alguno '''
+        hijo_analitico = None
+        hijo_diploma = None
+        for hijo in fil_padre.get_children():
+            if hijo.doctype.name == "analitico":
+                hijo_analitico = hijo
+            elif hijo.doctype.name == "titulo":
+                hijo_diploma = hijo
+        if not hijo_analitico or not hijo_diploma:
+            raise AthentoseError(
+                "No se encontraron ambos documentos (Analítico y Diploma) relacionados al título para firmar."
+            )
+        return hijo_analitico, hijo_diploma
+
+    @classmethod
+    def check_not_registered(cls, fil_padre:File):
+        registrada_en_blockchain = fil_padre.gfv("registro_blockchain")
+        if registrada_en_blockchain == "pending":
+            raise AthentoseError("El título ya había sido enviado a blockchain y su resultado aún está pendiente.")
+        if registrada_en_blockchain == "success":
+            raise AthentoseError("El título ya está registrado en blockchain.")
+
+    @classmethod
+    def sign_titulo(cls, fil_padre:File, auth_token:str, signature:dict, flogger=None)->dict:
+        '''
+        Firma analítico y diploma con el mismo QR/OTP, registra los dos hashes en BFA y deja el título firmado.
+        Devuelve {'hash_analitico', 'hash_diploma', 'short_url', 'resumed'}
+        '''
+        flogger = flogger or NullSpFeatureLogger()
+        uuid_padre = str(fil_padre.uuid)
+        cls.check_not_registered(fil_padre)
+        hijo_analitico, hijo_diploma = cls.find_children(fil_padre)
+        hijos = (hijo_analitico, hijo_diploma)
+        journal = SigningJournal(uuid_padre, SigningJournal.FLOW_TITULO)
+
+        # 1) URL de validación del título (la de un intento anterior se reutiliza) y QR
+        url_to_shorten = UcasalConfig.designaciones_validation_url_template().replace("{{uuid}}", uuid_padre)
+        flogger.entry(f"Obteniendo short_url y QR para: {url_to_shorten}")
+        short_url = journal.short_url(lambda: UcasalQrCache.get_short_url(auth_token=auth_token, url=url_to_shorten))
+        qr_stream = journal.record_qr(short_url, UcasalQrCache.get_qr_image(url=short_url))
+
+        # 2) Firmar los PDFs que no hayan quedado firmados en una corrida anterior. Se decide por hijo: volver a
+        #    firmar uno ya firmado le estamparía un segundo QR
+        hashes = journal.signed_hashes(hijos)
+        if hashes is not None:
+            for hijo in hijos:
+                if hijo.gfv("firmada_con_otp") != "1":
+                    hijo.set_feature("firmada_con_otp", "1")
+            pendientes = []
+        else:
+            firmados = [hijo for hijo in hijos if hijo.gfv("firmada_con_otp") == "1"]
+            pendientes = [hijo for hijo in hijos if hijo not in firmados]
+            hashes = {hijo.uuid: get_pdf_hash(hijo) for hijo in firmados}
+        resumed = len(pendientes) < len(hijos)
+        if resumed:
+            flogger.entry(f"Ya estaban firmados: {[str(hijo.uuid) for hijo in hijos if hijo not in pendientes]}. Se registran sus binarios actuales")
+        if pendientes:
+            hashes = cls.sign_children(pendientes, qr_stream, signature, flogger, journal, signed_hashes=hashes)
+
+        # 3) Registrar hashes de analítico y diploma en blockchain
+        hash_analitico = hashes[hijo_analitico.uuid]
+        hash_diploma = hashes[hijo_diploma.uuid]
+        # TODO: ajusta si tienes una plantilla específica de callback para títulos
+        callback_url = DesignacionesServices.set_callback_url(uuid=uuid_padre)   # placeholder genérico
+
+        # Un intento anterior pudo registrar los hashes y cortarse antes de cambiar el estado: sólo se completa
+        hashes_registro = {str(hijo_analitico.uuid): hash_analitico, str(hijo_diploma.uuid): hash_diploma}
+        respuestas = journal.registered(hashes_registro)
+        if respuestas is None:
+            # Ambos hashes se registran en una sola llamada (o en paralelo si el servicio no admite lotes)
+            resultado_analitico, resultado_diploma = resultados_bfa = BfaAnchoring.register_batch(
+                auth_token=auth_token,
+                entries=[
+                    {"hash": hash_analitico, "file_uuid": str(hijo_analitico.uuid), "doctype": "analitico", "callback_url": callback_url},
+                    {"hash": hash_diploma, "file_uuid": str(hijo_diploma.uuid), "doctype": "titulo", "callback_url": callback_url},
+                ],
+            )
+            if resultado_analitico["ok"]:
+                hijo_analitico.set_feature("ucasal.svc.ok_response_analitico", resultado_analitico["response"])
+            if resultado_diploma["ok"]:
+                hijo_diploma.set_feature("ucasal.svc.ok_response_diploma", resultado_diploma["response"])
+
+            errores_bfa = [r for r in resultados_bfa if not r["ok"]]
+            if errores_bfa:
+                detalle = "; ".join(f"{r['file_uuid']}: {r['error']}" for r in errores_bfa)
+                flogger.entry(f"Error registrando hashes en blockchain: {detalle}")
+                raise AthentoseError(f"Error registrando hashes en blockchain: {detalle}")
+            journal.record_register(hashes_registro, [r["response"] for r in resultados_bfa])
+        else:
+            flogger.entry("Los hashes ya se habían registrado en blockchain en un intento anterior")
+
+        # 4) Ambos documentos firmados: features y cambio de estado del título juntos, así un corte acá se
+        #    retoma desde el registro ya anotado en lugar de quedar 'pending' en el estado anterior
+        with transaction.atomic():
+            fil_padre.set_feature("registro_blockchain", "pending")
+            fil_padre.set_feature("titulos.documentos_firmados", [str(hijo.uuid) for hijo in hijos])
+            fil_padre.set_feature("hash_diploma", hash_diploma)
+            fil_padre.set_feature("hash_analitico", hash_analitico)
+            cls._change_state(fil_padre, TituloStates.pendiente_firma_otp)
+            cls._change_state(fil_padre, TituloStates.pendiente_blockchain)
+            cls._change_state(fil_padre, TituloStates.firmado)
+        flogger.entry("Ambos documentos firmados. Estado cambiado a 'Firmado'")
+
+        try:
+            response = UcasalHttpTransport.post(
+                "titulos",
+                UcasalConfig.titulos_update_finalize_url(),
+                json={"status": "5", "uuid": uuid_padre},
+                verify=False,
+            )
+            flogger.entry(f"Actualizacion estado firmada UCASAL - Status: {response.status_code}, Response: {response.text[:200]}")
+        except Exception as notif_err:
+            flogger.entry(f"Error al Actualizacion estado firmada a UCASAL: {str(notif_err)}")
+
+        fil_padre.set_feature("bodyFinalTitulo", {
+            "fecha_firma": signature["fecha_firma"],
+            "qr_data": {"short_url": short_url, "qr_base64": base64.b64encode(qr_stream).decode("utf-8")},
+            "qr_text": {
+                "firmado_por": "Firmado con OTP por:",
+                "nombre": signature["nombre"],
+                "mail": signature["mail_ofuscado"],
+                "fecha_firma": signature["fecha_firma_texto"],
+            },
+        })
+        return {"hash_analitico": hash_analitico, "hash_diploma": hash_diploma, "short_url": short_url, "resumed": resumed}
+
+    @classmethod
+    def sign_children(cls, hijos:tuple, qr_stream:bytes, signature:dict, flogger=None, journal:SigningJournal=None,
+                      signed_hashes:dict=None)->dict:
+        '''
+        Firma los hijos en paralelo y, recién cuando terminaron todos, los guarda juntos en una transacción,
+        así nunca queda un título firmado a medias. signed_hashes: {uuid: SHA-256} de los hijos que ya estaban
+        firmados, para anotarlos en el diario junto con los nuevos. Devuelve {uuid del hijo: SHA-256} de todos
+        '''
+        flogger = flogger or NullSpFeatureLogger()
+        for hijo in hijos:
+            if not os.path.getsize(hijo.path()):
+                flogger.entry(f"El documento {hijo.uuid} no tiene binario para firmar")
+                raise AthentoseError(f"El documento {hijo.uuid} no tiene binario para firmar")
+
+        # Con el motor 'overlay' la capa de firma (mismo QR, texto y OTP para todos) se arma una sola vez
+        overlay = None
+        if SignatureOverlay.enabled():
+            overlay = SignatureOverlay(
+                image_text=signature["qr_text"], otp_info=signature["otp_info"], qr_image=qr_stream, **cls.QR_POSITION
+            )
+
+        pipeline = StagePipeline("titulos.firma_otp", max_workers=len(hijos))
+        for hijo in hijos:
+            pipeline.stage(
+                f"sign_{hijo.uuid}",
+                lambda deps, hijo=hijo: cls._sign_hijo(hijo, qr_stream, signature, overlay),
+                budget_seconds=UcasalConfig.pipeline_stage_budget_seconds("titulos.firma_otp", "sign", 60),
+            )
+        pipeline.stage(
+            "persist",
+            lambda deps: cls._persist_firmas([(hijo, deps[f"sign_{hijo.uuid}"]) for hijo in hijos], journal, signed_hashes),
+            depends_on=tuple(f"sign_{hijo.uuid}" for hijo in hijos),
+            main_thread=True,
+        )
+        flogger.entry("Firmando analítico y diploma...")
+        hashes = pipeline.run()["persist"]
+        flogger.entry(f"Tiempos de firma: {pipeline.timings()}")
+        return hashes
+
+    @classmethod
+    def sign_bulk(cls, titulos:list, signature:dict, workers:int=4, on_result=None)->dict:
+        '''
+        Firma los títulos de a 'workers' en paralelo. El token se pide por título para que se renueve si vence
+        en medio de una corrida larga.
+        on_result(uuid, resultado) se llama desde el thread del llamador a medida que termina cada título.
+        Devuelve el resumen {'total', 'ok', 'skipped', 'errors', 'elapsed_seconds', 'titulos_per_minute'}
+        '''
+        logger = cls.logger
+        summary = {'total': len(titulos), 'ok': 0, 'skipped': 0, 'errors': 0}
+        started_at = time.perf_counter()
+
+        def process(fil_padre):
+            started = time.perf_counter()
+            try:
+                result = cls.sign_titulo(fil_padre, cls.auth_token(), signature)
+                return dict(result, result=cls.RESULT_OK, seconds=round(time.perf_counter() - started, 3))
+            except AthentoseError as e:
+                # Ya registrado o pendiente en BFA: no es un error de esta corrida
+                status = cls.RESULT_SKIPPED if fil_padre.gfv("registro_blockchain") in ("pending", "success") else cls.RESULT_ERROR
+                return {'result': status, 'error': str(e), 'seconds': round(time.perf_counter() - started, 3)}
+            except Exception as e:
+                logger.error(f'Error firmando el título {fil_padre.uuid}: {e}')
+                return {'result': cls.RESULT_ERROR, 'error': str(e), 'seconds': round(time.perf_counter() - started, 3)}
+
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='titulos-masiva') as executor:
+            futures = {executor.submit(db_connection_closing(process), fil): fil for fil in titulos}
+            for future in as_completed(futures):
+                result = future.result()
+                summary[{cls.RESULT_OK: 'ok', cls.RESULT_SKIPPED: 'skipped'}.get(result['result'], 'errors')] += 1
+                if on_result:
+                    on_result(str(futures[future].uuid), result)
+
+        elapsed = time.perf_counter() - started_at
+        summary['elapsed_seconds'] = round(elapsed, 3)
+        summary['titulos_per_minute'] = round(summary['ok'] * 60 / elapsed, 2) if elapsed > 0 else None
+        logger.debug(f'Firma masiva de títulos: {summary}')
+        return summary
+
+    @classmethod
+    def _sign_hijo(cls, hijo:File, qr_stream:bytes, signature:dict, overlay:SignatureOverlay=None):
+        ''' Firma el PDF de un hijo del título con su propia copia en memoria del QR. Devuelve el io.BytesIO firmado sin guardarlo '''
+        if overlay is not None:
+            return overlay.sign(hijo.path())
+
+        with qr_image_path(qr_stream) as qr_image_tmp_path:
+            qr_info = QRInfo(image_path=qr_image_tmp_path, image_text=signature["qr_text"], **cls.QR_POSITION)
+            # Un signer por firma: corren al mismo tiempo
+            return SpPdfSimpleSigner().sign(hijo.path(), qr_info, signature["otp_info"])
+
+    @staticmethod
+    def _persist_firmas(firmas:list, journal:SigningJournal=None, signed_hashes:dict=None)->dict:
+        ''' Guarda todos los PDFs firmados en una sola transacción. Devuelve {uuid del hijo: SHA-256}, con signed_hashes '''
+        hashes = dict(signed_hashes or {})
+        with transaction.atomic():
+            for hijo, signed_result in firmas:
+                hashes[hijo.uuid] = save_signed_pdf(hijo, signed_result, f"{hijo.filename}.pdf")
+                hijo.set_feature("firmada_con_otp", "1")
+            if journal is not None:
+                journal.record_sign(hashes)
+        return hashes
+
+    @staticmethod
+    def _change_state(fil_padre:File, state:str):
+        fil_padre.change_life_cycle_state(state)
+        fil_padre.set_metadata("estado", state, overwrite=True)
@@ -0,0 +1,138 @@
+import json
+import time
+import threading
+import hashlib
+from base64 import urlsafe_b64decode
+from django.core.cache import cache
+from django.db import connection
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.utils import UcasalConfig
+from ucasal2.external_services.ucasal.singleflight import UcasalSingleflight
+
+
+class UcasalTokenCache:
+    """Cache del token de autenticación de UCASAL.
+
+    El token se guarda en el cache de Django, por lo que se comparte entre los workers
+    de Gunicorn siempre que el backend configurado sea compartido (redis, memcached, db).
+    - Se conserva hasta poco antes de su vencimiento ('exp' del JWT o TTL configurado)
+    - Dentro del margen de refresco se devuelve el token vigente y se renueva en segundo plano
+    - Con el cache vacío, sólo un llamador obtiene el token; el resto espera su resultado
+    """
+    logger = SpLogger("athentose", "UcasalTokenCache")
+
+    KEY_PREFIX = 'ucasal2.auth_token'
+    LOCK_TIMEOUT_SECONDS = 30
+    WAIT_STEP_SECONDS = 0.1
+
+    _stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'waits': 0}
+    _stats_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, user:str, password:str, fetch)->str:
+        key = cls._key(user)
+        entry = cache.get(key)
+        now = time.time()
+        if cls._is_valid(entry, now):
+            cls._count('hits')
+            if entry['refresh_at'] <= now:
+                cls._refresh_in_background(key, user, password, fetch)
+            return entry['token']
+
+        cls._count('misses')
+        # Los hilos del mismo proceso esperan al líder en memoria; entre procesos coordina el lock del cache
+        return UcasalSingleflight.do(key, lambda: cls._fetch_exclusive(key, user, password, fetch))
+
+    @classmethod
+    def invalidate(cls, user:str):
+        cache.delete(cls._key(user))
+
+    @classmethod
+    def stats(cls)->dict:
+        with cls._stats_lock:
+            stats = dict(cls._stats)
+        total = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / total, 4) if total else 0.0
+        return stats
+
+    @classmethod
+    def _fetch_exclusive(cls, key:str, user:str, password:str, fetch)->str:
+        lock_key = f'{key}.lock'
+        deadline = time.time() + cls.LOCK_TIMEOUT_SECONDS
+        while True:
+            if cache.add(lock_key, '1', cls.LOCK_TIMEOUT_SECONDS):
+                try:
+                    # Otro worker pudo haberlo obtenido mientras esperábamos el lock
+                    entry = cache.get(key)
+                    if cls._is_valid(entry, time.time()):
+                        return entry['token']
+                    return cls._store(key, fetch(user, password))
+                finally:
+                    cache.delete(lock_key)
+
+            cls._count('waits')
+            time.sleep(cls.WAIT_STEP_SECONDS)
+            entry = cache.get(key)
+            if cls._is_valid(entry, time.time()):
+                return entry['token']
+            if time.time() >= deadline:
+                cls.logger.warning('Timeout esperando el token obtenido por otro proceso. Se obtiene uno nuevo.')
+                return cls._store(key, fetch(user, password))
+
+    @classmethod
+    def _refresh_in_background(cls, key:str, user:str, password:str, fetch):
+        lock_key = f'{key}.lock'
+        if not cache.add(lock_key, '1', cls.LOCK_TIMEOUT_SECONDS):
+            return  # Ya hay un refresco en curso
+
+        def refresh():
+            try:
+                cls._store(key, fetch(user, password))
+                cls._count('refreshes')
+            except Exception as e:
+                cls.logger.error(f'Error refrescando el token de UCASAL en segundo plano: {e}')
+            finally:
+                cache.delete(lock_key)
+                connection.close()
+
+        threading.Thread(target=refresh, name='ucasal2-token-refresh', daemon=True).start()
+
+    @classmethod
+    def _store(cls, key:str, token:str)->str:
+        now = time.time()
+        expires_at = cls._token_expiration(token, now)
+        margin = min(UcasalConfig.token_cache_refresh_margin_seconds(), (expires_at - now) / 2)
+        entry = {
+            'token': token,
+            'expires_at': expires_at,
+            'refresh_at': expires_at - margin,
+        }
+        timeout = int(expires_at - now)
+        if timeout > 0:
+            cache.set(key, entry, timeout)
+        return token
+
+    @staticmethod
+    def _token_expiration(token:str, now:float)->float:
+        ttl = UcasalConfig.token_cache_ttl_seconds()
+        # Si el token es un JWT se respeta su 'exp', sin superar el TTL configurado
+        try:
+            payload = token.split('.')[1]
+            claims = json.loads(urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+            return min(float(claims['exp']), now + ttl)
+        except Exception:
+            return now + ttl
+
+    @staticmethod
+    def _is_valid(entry, now:float)->bool:
+        return bool(entry) and entry.get('expires_at', 0) > now
+
+    @classmethod
+    def _key(cls, user:str)->str:
+        digest = hashlib.sha256(f'{UcasalConfig.token_svc_url()}|{user}'.encode('utf-8')).hexdigest()
+        return f'{cls.KEY_PREFIX}.{digest}'
+
+    @classmethod
+    def _count(cls, name:str):
+        with cls._stats_lock:
+            cls._stats[name] += 1
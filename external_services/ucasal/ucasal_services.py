@@ -1,94 +1,267 @@
 from file.models import File
 import io
+import asyncio
 import requests
 from core.exceptions import AthentoseError
 from custom.sp_libs.python.logging import SpLogger
 from base64 import b64encode
-from custom.ucasal2.utils import UcasalConfig
-from custom.ucasal2.model.exceptions.invalid_otp_error import InvalidOtpError
+from json import dumps as encodeJSON
+from ucasal2.utils import UcasalConfig, db_connection_closing
+from concurrent.futures import ThreadPoolExecutor
+from ucasal2.model.exceptions.invalid_otp_error import InvalidOtpError
+from ucasal2.external_services.ucasal.token_cache import UcasalTokenCache
+from ucasal2.external_services.ucasal.http_transport import UcasalHttpTransport
+from ucasal2.external_services.ucasal.local_qr_renderer import LocalQrRenderer
+from ucasal2.external_services.ucasal.singleflight import UcasalSingleflight
+from ucasal2.external_services.ucasal.metrics import UcasalMetrics
 class UcasalServices:
+    '''
+    Cliente sincrónico de los servicios de UCASAL.
+    Cada servicio se divide en '_<servicio>_request' (arma el request) y '_<servicio>_result' (interpreta la respuesta),
+    que se comparten con el cliente asincrónico (AsyncUcasalServices).
+    '''
     logger = SpLogger("athentose", "UcasalServices")
 
-    #TODO: setear "VERIFY_CERTIFICATE = True" cuando quede productivo 
+    #TODO: setear "VERIFY_CERTIFICATE = True" cuando quede productivo
     VERIFY_CERTIFICATE = False
-    
+
     @classmethod
+    @UcasalMetrics.timed('get_auth_token')
     def get_auth_token(cls, user:str, password:str)->str:
+        # El token se comparte entre llamadas (y workers) hasta poco antes de su vencimiento
+        return UcasalTokenCache.get(user=user, password=password, fetch=cls._fetch_auth_token)
+
+    @classmethod
+    def invalidate_auth_token(cls, user:str):
+        UcasalTokenCache.invalidate(user=user)
+
+    @classmethod
+    def auth_token_cache_stats(cls)->dict:
+        return UcasalTokenCache.stats()
+
+    @classmethod
+    def _fetch_auth_token(cls, user:str, password:str)->str:
         logger = cls.logger
         logger.entry()
+        response = cls._send(cls._auth_token_request(user, password))
+        return logger.exit(cls._auth_token_result(response))
+
+    @classmethod
+    def _auth_token_request(cls, user:str, password:str)->dict:
         endpoint = UcasalConfig.token_svc_url()
         data = f'usuario={user}&clave={password}'
-        
-        headers ={'Content-Type': 'application/x-www-form-urlencoded'}  
-        logger.debug("Llamando a requests.post con estos parámetros: %s" % str({'url':endpoint, 'data': data, 'headers':headers}))
-
-        response = requests.post(url=endpoint, data=data, headers=headers)
+        headers ={'Content-Type': 'application/x-www-form-urlencoded'}
+        return {'method': 'POST', 'endpoint_name': 'gettoken', 'url': endpoint, 'data': data, 'headers': headers}
 
+    @classmethod
+    def _auth_token_result(cls, response)->str:
         if response.status_code == requests.codes.ok:
-            return logger.exit(response.text.strip())
+            return response.text.strip()
         else:
             body_text = response.text[:500] if response.text else 'N/A'
-            error_msg = "Error obteniendo token - Status: " + str(response.status_code) + ", Reason: " + str(response.reason) + ", Body: " + body_text
-            logger.error(error_msg)
-            raise AthentoseError(error_msg)  
-            
+            error_msg = "Error obteniendo token - Status: " + str(response.status_code) + ", Reason: " + _reason(response) + ", Body: " + body_text
+            cls.logger.error(error_msg)
+            raise AthentoseError(error_msg)
+
     @classmethod
+    @UcasalMetrics.timed('get_qr_image')
     def get_qr_image(cls, url:str)->io.BytesIO:
         logger = cls.logger
         logger.entry(f"Generando QR para URL: {url}")
+        engine = UcasalConfig.qr_engine()
+        return logger.exit(UcasalSingleflight.do(f'qr|{engine}|{url}', lambda: cls._get_qr_image(url, engine)))
+
+    @classmethod
+    def _get_qr_image(cls, url:str, engine:str)->bytes:
+        if engine == 'local':
+            qr_bytes = cls._render_local_qr_image(url)
+            if qr_bytes is not None:
+                return qr_bytes
+        return cls.get_remote_qr_image(url)
+
+    @classmethod
+    def get_remote_qr_image(cls, url:str)->bytes:
+        def fetch():
+            response = cls._send(cls._qr_image_request(url))
+            return cls._qr_image_result(response)
+        return UcasalSingleflight.do(f'qr|remote|{url}', fetch)
+
+    @classmethod
+    def _render_local_qr_image(cls, url:str)->bytes:
+        ''' Devuelve None si no se pudo generar localmente, para usar el servicio remoto como respaldo '''
+        try:
+            return LocalQrRenderer.render(url)
+        except Exception as e:
+            cls.logger.warning(f'No se pudo generar el QR localmente, se usa el servicio remoto: {e}')
+            return None
+
+    @classmethod
+    def _qr_image_request(cls, url:str)->dict:
         endpoint = f"{UcasalConfig.qr_svc_url()}?b64={b64encode(url.encode('utf-8')).decode('utf-8')}"
-        headers = {}
-        logger.debug("Llamando a requests.get con estos parámetros: %s" % str({'url':endpoint, 'headers':headers}))
-        response = requests.get(url=endpoint)
+        return {'method': 'GET', 'endpoint_name': 'qr', 'url': endpoint}
 
+    @classmethod
+    def _qr_image_result(cls, response)->bytes:
         if response.status_code == requests.codes.ok:
-            return logger.exit(response.content)
+            return response.content
         else:
-            raise logger.exit(AthentoseError('Error inesperado obteniendo imagen QR: ' + response.reason), exc_info=True)   
-    
+            raise cls.logger.exit(AthentoseError('Error inesperado obteniendo imagen QR: ' + _reason(response)), exc_info=True)
+
     @classmethod
+    @UcasalMetrics.timed('get_short_url')
     def get_short_url(cls, auth_token:str, url:str)->str:
-        #TODO: consultar servicio de UCASAL
         logger = cls.logger
         logger.entry()
+        # La URL corta depende sólo de la URL y del entorno, no del token
+        def fetch():
+            response = cls._send(cls._short_url_request(auth_token, url))
+            return cls._short_url_result(response)
+        return logger.exit(UcasalSingleflight.do(f'acortar_url|{UcasalConfig.shorten_url_svc_env()}|{url}', fetch))
+
+    @classmethod
+    def _short_url_request(cls, auth_token:str, url:str)->dict:
         endpoint = UcasalConfig.shorten_url_svc_url()
         headers = {'Authorization': f'Bearer {auth_token}'}
+        env = UcasalConfig.shorten_url_svc_env()
         json = {
           'url': url,
-          'entorno': UcasalConfig.shorten_url_svc_env() if UcasalConfig.shorten_url_svc_env() else 'produccion'
+          'entorno': env if env else 'produccion'
         }
+        return {'method': 'POST', 'endpoint_name': 'acortar_url', 'url': endpoint, 'headers': headers, 'json': json, 'verify': cls.VERIFY_CERTIFICATE}
 
-        logger.debug("Llamando a requests.post con estos parámetros: %s" % str({'url':endpoint, 'json': json, 'headers':headers}))
-        response = requests.post(url=endpoint, headers=headers, json=json, verify=cls.VERIFY_CERTIFICATE)
-
+    @classmethod
+    def _short_url_result(cls, response)->str:
+        logger = cls.logger
         logger.debug(f'response.status_code: {response.status_code}')
         logger.debug(f'response.text: {response.text}')
 
         if response.status_code in [200, 201]:
             try:
-                return logger.exit(response.json()['url_corta'])
+                return response.json()['url_corta']
             except Exception as json_err:
                 error_msg = "Error parseando respuesta JSON de short_url: " + str(json_err) + " - Response: " + response.text[:500]
                 logger.error(error_msg)
                 raise AthentoseError(error_msg)
         else:
-            error_msg = "Error obteniendo url corta - Status: " + str(response.status_code) + ", Reason: " + str(response.reason) + ", Body: " + (response.text[:500] if response.text else 'N/A')
+            error_msg = "Error obteniendo url corta - Status: " + str(response.status_code) + ", Reason: " + _reason(response) + ", Body: " + (response.text[:500] if response.text else 'N/A')
             logger.error(error_msg)
-            raise AthentoseError(error_msg)   
+            raise AthentoseError(error_msg)
 
 
     @classmethod
+    @UcasalMetrics.timed('register_in_blockchain')
     def register_in_blockchain(cls, auth_token:str, hash:str, file_uuid:str, callback_url:str)->str:
-        #import logging
-        #nlogger = logging.getLogger("athentose")
-
-        #nlogger.debug("nlogger - Enter register_in_blockchain")
-
-
         logger = cls.logger
         logger.entry()
         #TODO: validar parámetros
-                
+        response = cls._send(cls._register_in_blockchain_request(auth_token, hash, file_uuid, callback_url))
+        return logger.exit(cls._register_in_blockchain_result(response))
+
+    @classmethod
+    @UcasalMetrics.timed('register_in_blockchain_batch')
+    def register_in_blockchain_batch(cls, auth_token:str, entries:list)->list:
+        '''
+        Registra varios hashes en blockchain.
+        entries: [{'hash': ..., 'file_uuid': ..., 'callback_url': ...}, ...]
+        Devuelve, en el mismo orden, [{'hash', 'file_uuid', 'callback_url', 'ok', 'response', 'error'}, ...]
+        Usa 'ucasal.endpoint.stamps.batch_url' si está configurado y el servicio lo admite; si no, registra
+        cada entrada con register_in_blockchain en forma concurrente.
+        '''
+        logger = cls.logger
+        logger.entry(f"Registrando {len(entries)} hashes en blockchain")
+        if not entries:
+            return logger.exit([])
+
+        batch_url = UcasalConfig.stamps_batch_svc_url()
+        if batch_url and cls._batch_supported:
+            results = cls._register_in_blockchain_batch_call(batch_url, auth_token, entries)
+            if results is not None:
+                return logger.exit(results)
+
+        return logger.exit(cls._register_in_blockchain_concurrently(auth_token, entries))
+
+    # Se desactiva (por proceso) la primera vez que el servicio responde que no admite lotes
+    _batch_supported = True
+    BATCH_UNSUPPORTED_STATUS_CODES = (404, 405, 501)
+
+    @classmethod
+    def _register_in_blockchain_batch_call(cls, batch_url:str, auth_token:str, entries:list):
+        ''' Devuelve None si el servicio no admite lotes '''
+        headers = {'Authorization': f'Bearer {auth_token}'}
+        data = {'items': [
+            {'fileHash': e['hash'], 'fileUuid': e['file_uuid'], 'callbackUrl': e['callback_url']}
+            for e in entries
+        ]}
+        try:
+            response = cls._send({'method': 'POST', 'endpoint_name': 'stamps', 'url': batch_url, 'json': data, 'headers': headers})
+        except Exception as e:
+            return [cls._batch_result(entry, ok=False, error=str(e)) for entry in entries]
+
+        if response.status_code in cls.BATCH_UNSUPPORTED_STATUS_CODES:
+            cls.logger.warning(f'El servicio de sellado no admite lotes (HTTP {response.status_code}). Se registra cada hash por separado.')
+            cls._batch_supported = False
+            return None
+
+        if response.status_code != requests.codes.ok:
+            error = f'Error inesperado registrando el lote en UCASAL/BFA: HTTP {response.status_code} {_reason(response)}'
+            return [cls._batch_result(entry, ok=False, error=error) for entry in entries]
+
+        try:
+            body = response.json()
+            items = body['results'] if isinstance(body, dict) else body
+            if len(items) != len(entries):
+                raise AthentoseError(f'se esperaban {len(entries)} resultados y se recibieron {len(items)}')
+        except Exception as e:
+            error = f'Respuesta inválida del servicio de sellado por lotes: {e}'
+            return [cls._batch_result(entry, ok=False, error=error) for entry in entries]
+
+        return [
+            cls._batch_result(entry, ok=False, error=str(item['error'])) if isinstance(item, dict) and item.get('error')
+            else cls._batch_result(entry, ok=True, response=encodeJSON(item))
+            for entry, item in zip(entries, items)
+        ]
+
+    @classmethod
+    def _register_in_blockchain_concurrently(cls, auth_token:str, entries:list)->list:
+        max_workers = max(1, min(UcasalConfig.stamps_batch_concurrency(), len(entries)))
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(cls._register_in_blockchain_async(auth_token, entries, max_workers))
+
+        # Llamado desde el thread de un event loop: no se puede bloquear con asyncio.run, se usa un pool de threads
+        @db_connection_closing
+        def register(entry):
+            try:
+                response = cls.register_in_blockchain(auth_token=auth_token, hash=entry['hash'], file_uuid=entry['file_uuid'], callback_url=entry['callback_url'])
+                return cls._batch_result(entry, ok=True, response=response)
+            except Exception as e:
+                return cls._batch_result(entry, ok=False, error=str(e))
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ucasal2-stamps') as executor:
+            return list(executor.map(register, entries))
+
+    @staticmethod
+    async def _register_in_blockchain_async(auth_token:str, entries:list, concurrency:int)->list:
+        from ucasal2.external_services.ucasal.async_ucasal_services import AsyncUcasalServices
+        try:
+            return await AsyncUcasalServices.register_in_blockchain_many(auth_token, entries, concurrency)
+        finally:
+            await AsyncUcasalServices.aclose()
+
+    @staticmethod
+    def _batch_result(entry:dict, ok:bool, response:str=None, error:str=None)->dict:
+        return {
+            'hash': entry['hash'],
+            'file_uuid': entry['file_uuid'],
+            'callback_url': entry['callback_url'],
+            'ok': ok,
+            'response': response,
+            'error': error,
+        }
+
+    @classmethod
+    def _register_in_blockchain_request(cls, auth_token:str, hash:str, file_uuid:str, callback_url:str)->dict:
         endpoint = UcasalConfig.stamps_svc_url()
         headers = {'Authorization': f'Bearer {auth_token}'}
         #TODO: y el file_uuid, no se envía?
@@ -96,70 +269,94 @@ class UcasalServices:
             'fileHash': hash,
             'callbackUrl': callback_url
         }
+        return {'method': 'POST', 'endpoint_name': 'stamps', 'url': endpoint, 'json': data, 'headers': headers}
 
-
-        request_info = str({'url':endpoint, 'json':data, 'headers':headers})
-        
-        logger.debug(f"Llamando a requests.post con estos parametros: {request_info}")
-        logger.debug(f"Llamando a requests.post con estos parámetros: {request_info}")
-
-        response = requests.post(url=endpoint, json=data, headers=headers)
-
+    @classmethod
+    def _register_in_blockchain_result(cls, response)->str:
         rta = str(response.text)
-        logger.debug(f"Respuesta del servicio: {rta}")
+        cls.logger.debug(f"Respuesta del servicio: {rta}")
 
         if response.status_code == requests.codes.ok:
-            return logger.exit(response.text)
+            return response.text
             #TODO: Manejar response?
         else:
-            raise logger.exit(AthentoseError('Error inesperado registrando el hash en UCASAL/BFA: ' + response.reason), exc_info=True) 
+            raise cls.logger.exit(AthentoseError('Error inesperado registrando el hash en UCASAL/BFA: ' + _reason(response)), exc_info=True)
 
     @classmethod
+    @UcasalMetrics.timed('notify_rejection')
     def notify_rejection(cls, auth_token:str, uuid:str, previous_uuid:str, reason:str)->str:
         logger = cls.logger
         logger.entry()
+        response = cls._send(cls._notify_rejection_request(auth_token, uuid, previous_uuid, reason))
+        return logger.exit(cls._notify_rejection_result(response))
+
+    @classmethod
+    def _notify_rejection_request(cls, auth_token:str, uuid:str, previous_uuid:str, reason:str)->dict:
         endpoint = f'{UcasalConfig.change_acta_svc_url()}/{uuid}'
         headers = {'Authorization': f'Bearer {auth_token}'}
         data = {'estado': 1, 'motivo': reason, 'previous_uuid': previous_uuid}
-        
-        logger.debug("Llamando a requests.patch con estos parámetros: %s" % str({'url':endpoint, 'headers':headers,  'json':data}))
-        response = requests.patch(url=endpoint, headers=headers, json=data)
+        return {'method': 'PATCH', 'endpoint_name': 'change_acta', 'url': endpoint, 'headers': headers, 'json': data}
 
+    @classmethod
+    def _notify_rejection_result(cls, response)->str:
         if response.status_code == requests.codes.ok:
-            return logger.exit(response.text)
+            return response.text
         else:
-            raise logger.exit(AthentoseError('Error inesperado notificando rechazo del acta: ' + response.reason), exc_info=True)   
+            raise cls.logger.exit(AthentoseError('Error inesperado notificando rechazo del acta: ' + _reason(response)), exc_info=True)
 
     @classmethod
+    @UcasalMetrics.timed('notify_blockchain_success')
     def notify_blockchain_success(cls, auth_token:str, uuid:str)->str:
         logger = cls.logger
         logger.entry()
+        response = cls._send(cls._notify_blockchain_success_request(auth_token, uuid))
+        return logger.exit(cls._notify_blockchain_success_result(response))
+
+    @classmethod
+    def _notify_blockchain_success_request(cls, auth_token:str, uuid:str)->dict:
         endpoint = f'{UcasalConfig.change_acta_svc_url()}/{uuid}'
         headers = {'Authorization': f'Bearer {auth_token}'}
         data = {'estado': 5}
-        
-        logger.debug("Llamando a requests.patch con estos parámetros: %s" % str({'url':endpoint, 'headers':headers,  'json':data}))
-        response = requests.patch(url=endpoint, headers=headers, json={'estado': 5})
+        return {'method': 'PATCH', 'endpoint_name': 'change_acta', 'url': endpoint, 'headers': headers, 'json': data}
 
+    @classmethod
+    def _notify_blockchain_success_result(cls, response)->str:
         if response.status_code == requests.codes.ok:
-            return logger.exit(response.text)
+            return response.text
         else:
-            raise logger.exit(AthentoseError('Error inesperado notificando éxito registrando el acta en blockchain: ' + response.reason), exc_info=True)   
-    
+            raise cls.logger.exit(AthentoseError('Error inesperado notificando éxito registrando el acta en blockchain: ' + _reason(response)), exc_info=True)
+
     @classmethod
+    @UcasalMetrics.timed('validate_otp')
     def validate_otp(cls, user:str, otp:int):
         logger = cls.logger
         logger.entry()
+        response = cls._send(cls._validate_otp_request(user, otp))
+        return logger.exit(cls._validate_otp_result(response)) #OK
+
+    @classmethod
+    def _validate_otp_request(cls, user:str, otp:int)->dict:
         endpoint = UcasalConfig.otp_validation_url_template().format(usuario=user, token=otp)
-        headers = {}
-        
-        logger.debug("Llamando a requests.get con estos parámetros: %s" % str({'url':endpoint, 'headers':headers}))
-        response = requests.get(url=endpoint, headers=headers)
+        return {'method': 'GET', 'endpoint_name': 'otp', 'url': endpoint, 'headers': {}}
 
+    @classmethod
+    def _validate_otp_result(cls, response):
         if response.status_code == requests.codes.ok:
-            return logger.exit() #OK
+            return None
         if response.status_code == requests.codes.unauthorized:
-            raise logger.exit(InvalidOtpError('El código OTP es inválido o ha expirado. Por favor, genere uno nuevo.'))
+            raise cls.logger.exit(InvalidOtpError('El código OTP es inválido o ha expirado. Por favor, genere uno nuevo.'))
         else:
-            raise logger.exit(AthentoseError(f'Error inesperado validadando el código OTP: HTTP code: {response.status_code}. HTTP body {response.text}'), exc_info=True)   
-        
+            raise cls.logger.exit(AthentoseError(f'Error inesperado validadando el código OTP: HTTP code: {response.status_code}. HTTP body {response.text}'), exc_info=True)
+
+    @classmethod
+    def _send(cls, request:dict):
+        request = dict(request)
+        method = request.pop('method')
+        endpoint_name = request.pop('endpoint_name')
+        cls.logger.debug(f"Llamando a UcasalHttpTransport.{method.lower()} ({endpoint_name}) con estos parámetros: {request}")
+        return UcasalHttpTransport.request(method, endpoint_name, **request)
+
+
+def _reason(response)->str:
+    ''' 'reason' en requests, 'reason_phrase' en httpx '''
+    return str(getattr(response, 'reason', None) or getattr(response, 'reason_phrase', ''))
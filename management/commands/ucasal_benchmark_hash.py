@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+
+def _read_all_sha256(path:str)->str:
+    ''' Implementación anterior de get_pdf_hash: lee el archivo entero en memoria '''
+    import hashlib
+    with open(path, mode='rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _proc_status_kb(field:str):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _measure(method, path:str, iterations:int, queue):
+    ''' Corre en un proceso hijo para medir el pico de RSS de cada método por separado '''
+    import time
+    try:
+        # Reinicia el pico de RSS (VmHWM) heredado del proceso padre
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+    baseline = _proc_status_kb('VmRSS')
+    timings = []
+    digest = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        digest = method(path)
+        timings.append(time.perf_counter() - start)
+    peak = _proc_status_kb('VmHWM')
+    queue.put({
+        'digest': digest,
+        'timings': timings,
+        'peak_rss_delta_kb': (peak - baseline) if peak is not None and baseline is not None else None,
+    })
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara el cálculo del SHA-256 de PDFs: lectura completa (implementación anterior), bloques con readinto "
+        "(get_pdf_hash) y mmap. Informa throughput y pico de RSS por tamaño de archivo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes_mb', type=str, default='1,10,50,100', help="Tamaños de archivo a probar, en MB, separados por coma")
+        parser.add_argument('--iterations', type=int, default=5, help="Hashes por método y tamaño")
+        parser.add_argument('--chunk_kb', type=int, default=1024, help="Tamaño del bloque de lectura del método 'chunked'")
+        parser.add_argument('--dir', type=str, default=None, help="Directorio para los archivos de prueba (por defecto, el temporal)")
+
+    def handle(self, *args, **options):
+        import os
+        import statistics
+        import multiprocessing
+        from functools import partial
+        from tempfile import NamedTemporaryFile
+        from ucasal2.utils import sha256_file
+
+        methods = [
+            ('read_all', _read_all_sha256),
+            ('chunked', partial(sha256_file, chunk_size=options['chunk_kb'] * 1024)),
+            ('mmap', partial(sha256_file, use_mmap=True)),
+        ]
+        # fork: el hijo hereda los módulos cargados; el pico de RSS se reinicia en _measure
+        context = multiprocessing.get_context('fork')
+
+        for size_mb in [int(s) for s in options['sizes_mb'].split(',') if s.strip()]:
+            with NamedTemporaryFile(dir=options['dir'], suffix='.pdf', delete=False) as tmp:
+                for _ in range(size_mb):
+                    tmp.write(os.urandom(1024 * 1024))
+            try:
+                digests = set()
+                for name, method in methods:
+                    queue = context.Queue()
+                    process = context.Process(target=_measure, args=(method, tmp.name, options['iterations'], queue))
+                    process.start()
+                    result = queue.get()
+                    process.join()
+
+                    digests.add(result['digest'])
+                    mean = statistics.mean(result['timings'])
+                    rss = result['peak_rss_delta_kb']
+                    rss_text = f"+{rss / 1024:.1f} MB" if rss is not None else "N/A"
+                    self.stdout.write(
+                        f"[{size_mb:>4} MB] {name:<8} | media={mean * 1000:8.2f}ms | "
+                        f"throughput={size_mb / mean:8.1f} MB/s | pico RSS={rss_text}"
+                    )
+                if len(digests) != 1:
+                    self.stderr.write(self.style.ERROR(f"Los métodos no coinciden para {size_mb} MB: {digests}"))
+            finally:
+                os.remove(tmp.name)
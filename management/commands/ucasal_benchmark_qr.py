@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = (
+        "Compara la generación de QR local (en proceso) contra el servicio remoto de UCASAL: "
+        "latencia (media, p50, p95) y tamaño del PNG."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', type=str, default='https://ucasal.edu.ar/v/abcdef12', help="URL a codificar en el QR")
+        parser.add_argument('--iterations', type=int, default=50, help="Cantidad de QR a generar con cada motor")
+        parser.add_argument('--skip_remote', action='store_true', help="No llamar al servicio remoto")
+
+    def handle(self, *args, **options):
+        import time
+        import statistics
+        from ucasal2.external_services.ucasal.ucasal_services import UcasalServices
+        from ucasal2.external_services.ucasal.local_qr_renderer import LocalQrRenderer
+
+        url = options['url']
+        iterations = options['iterations']
+
+        engines = [('local', LocalQrRenderer.render)]
+        if not options['skip_remote']:
+            engines.append(('remote', UcasalServices.get_remote_qr_image))
+
+        for engine_name, render in engines:
+            timings = []
+            png = b''
+            for _ in range(iterations):
+                start = time.perf_counter()
+                png = render(url)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write(
+                f"[{engine_name}] n={iterations} | media={statistics.mean(timings):.2f}ms | "
+                f"p50={statistics.median(timings):.2f}ms | p95={p95:.2f}ms | png={len(png)} bytes"
+            )
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = (
+        "Compara la firma de PDFs con SpPdfSimpleSigner (capa rearmada en cada documento) contra SignatureOverlay "
+        "armada por documento, armada una sola vez para todos y agregada como actualización incremental. "
+        "Informa documentos firmados por segundo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pdf', type=str, default=None, help="PDF a firmar (por defecto se genera uno de --pages páginas)")
+        parser.add_argument('--pages', type=int, default=2, help="Páginas del PDF generado")
+        parser.add_argument('--documents', type=int, default=50, help="Documentos a firmar con cada método")
+        parser.add_argument('--url', type=str, default='https://ucasal.edu.ar/v/abcdef12', help="URL a codificar en el QR")
+        parser.add_argument('--skip_signer', action='store_true', help="No medir SpPdfSimpleSigner")
+
+    def handle(self, *args, **options):
+        import os
+        import time
+        import statistics
+        from custom.sp_libs.python.sp_pdf_otp_simple_signer.sp_pdf_otp_simple_signer import SpPdfSimpleSigner, QRInfo, OTPInfo
+        from ucasal2.utils import qr_image_path
+        from ucasal2.model.signature_overlay import SignatureOverlay
+        from ucasal2.external_services.ucasal.local_qr_renderer import LocalQrRenderer
+
+        qr_image = LocalQrRenderer.render(options['url'])
+        qr_text = "Firmado con OTP por:\r\nNombre Apellido\r\nnomb***@ucasal.edu.ar\r\n01/01/2025 10:00:00"
+        position = {'x': 20, 'y': 11, 'width': 70, 'height': 70}
+        otp_info = OTPInfo(mail="\nnomb***@ucasal.edu.ar", ip="N/A", latitude=0.0, longitude=0.0, accuracy="N/A", user_agent="Athentose/Signer")
+
+        pdf_path = options['pdf']
+        generated = pdf_path is None
+        if generated:
+            pdf_path = self._sample_pdf(options['pages'])
+
+        def signer(path):
+            with qr_image_path(qr_image) as qr_path:
+                qr_info = QRInfo(image_path=qr_path, image_text=qr_text, **position)
+                return SpPdfSimpleSigner().sign(path, qr_info, otp_info)
+
+        def overlay_per_document(path):
+            return SignatureOverlay(image_text=qr_text, otp_info=otp_info, qr_image=qr_image, incremental=False, **position).sign(path)
+
+        def shared(incremental):
+            shared_overlay = {}
+            def sign(path):
+                # La capa se arma en la primera llamada y se reutiliza: su costo queda incluido en la medición
+                if 'overlay' not in shared_overlay:
+                    shared_overlay['overlay'] = SignatureOverlay(
+                        image_text=qr_text, otp_info=otp_info, qr_image=qr_image, incremental=incremental, **position
+                    )
+                return shared_overlay['overlay'].sign(path)
+            return sign
+
+        methods = [
+            ('overlay_per_doc', overlay_per_document),
+            ('overlay_shared', shared(False)),
+            ('incremental', shared(True)),
+        ]
+        if not options['skip_signer']:
+            methods.insert(0, ('signer', signer))
+
+        with open(pdf_path, 'rb') as f:
+            original = f.read()
+        try:
+            for name, sign in methods:
+                timings = []
+                signed = None
+                start_all = time.perf_counter()
+                for _ in range(options['documents']):
+                    start = time.perf_counter()
+                    signed = sign(pdf_path)
+                    timings.append((time.perf_counter() - start) * 1000)
+                elapsed = time.perf_counter() - start_all
+                buffer = signed.getbuffer()
+                # Actualización incremental: el PDF original tiene que quedar intacto al principio del firmado
+                prefix = "sí" if buffer[:len(original)] == original else "no"
+                self.stdout.write(
+                    f"[{name:<15}] n={options['documents']} | docs/s={options['documents'] / elapsed:8.1f} | "
+                    f"media={statistics.mean(timings):7.2f}ms | p50={statistics.median(timings):7.2f}ms | "
+                    f"pdf={len(buffer)} bytes (+{len(buffer) - len(original)}) | original como prefijo={prefix}"
+                )
+        finally:
+            if generated:
+                os.remove(pdf_path)
+
+    @staticmethod
+    def _sample_pdf(pages:int)->str:
+        from tempfile import NamedTemporaryFile
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.pagesizes import A4
+
+        with NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+            c = canvas.Canvas(tmp, pagesize=A4)
+            for page in range(pages):
+                c.setFont('Helvetica', 11)
+                for line in range(40):
+                    c.drawString(60, 780 - line * 18, f"Página {page + 1} - línea {line + 1} del documento de prueba")
+                c.showPage()
+            c.save()
+        return tmp.name
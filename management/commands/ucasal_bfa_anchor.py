@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = (
+        "Modo de anclaje 'merkle': arma árboles de Merkle con los hashes pendientes (actas, designaciones y títulos) "
+        "cuya ventana 'ucasal.bfa.anchor_window_seconds' venció, y registra sólo la raíz de cada árbol en BFA."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Anclar los pendientes aunque no haya vencido la ventana")
+
+    def handle(self, *args, **options):
+        from ucasal2.external_services.ucasal.bfa_anchoring import BfaAnchoring
+
+        lotes = 0
+        hojas = 0
+        # Cada lote está acotado por 'ucasal.bfa.anchor_max_leaves': se repite mientras queden pendientes
+        while True:
+            batch = BfaAnchoring.anchor_pending(force=options['force'])
+            if batch is None:
+                break
+            lotes += 1
+            hojas += batch.leaf_count
+            self.stdout.write(f"[OK] lote={batch.id} raíz={batch.root} hojas={batch.leaf_count}")
+
+        self.stdout.write(self.style.SUCCESS(f"Lotes registrados={lotes} | hashes anclados={hojas}"))
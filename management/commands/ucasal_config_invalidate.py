@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = (
+        "Descarta el snapshot de UcasalConfig en todos los workers (cambia la versión en el cache de Django), "
+        "para que un cambio en la configuración 'ucasal.*' se tome sin esperar el vencimiento del snapshot."
+    )
+
+    def handle(self, *args, **options):
+        from ucasal2.utils import UcasalConfig
+
+        version = UcasalConfig.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Snapshot de configuración invalidado (versión {version})"))
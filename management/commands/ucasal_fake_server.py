@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = (
+        "Levanta un servidor local que imita todos los endpoints de UCASAL (token, QR, acortador, sellado en BFA "
+        "con callbacks, cambios de estado, OTP y títulos), con latencia, errores y timeouts configurables. "
+        "Imprime los valores de configuración para apuntar 'ucasal.endpoint.*' a él."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='127.0.0.1', help="Interfaz en la que escuchar")
+        parser.add_argument('--port', type=int, default=8099, help="Puerto en el que escuchar")
+        parser.add_argument('--profile', type=str, default=None, help="Archivo JSON con el perfil de latencias y fallas (ver FakeUcasalServer)")
+        parser.add_argument('--seed', type=int, default=None, help="Semilla para que las fallas sean reproducibles")
+        parser.add_argument('--bfaresponse_base_url', type=str, default=None,
+                            help="URL base de la API de este Athento (p.ej. http://localhost:8000/ucasal2/api) para los callbacks de BFA")
+
+    def handle(self, *args, **options):
+        import json
+        from ucasal2.external_services.ucasal.fake_server import FakeUcasalServer
+
+        profile = {}
+        if options['profile']:
+            with open(options['profile'], 'r', encoding='utf-8') as f:
+                profile = json.load(f)
+        if options['seed'] is not None:
+            profile['seed'] = options['seed']
+
+        server = FakeUcasalServer(host=options['host'], port=options['port'], profile=profile)
+        self.stdout.write(self.style.SUCCESS(f"Servidor UCASAL simulado en {server.base_url}"))
+        self.stdout.write("Configuración para apuntar a este servidor:")
+        for key, value in server.config_keys(options['bfaresponse_base_url']).items():
+            self.stdout.write(f"  {key} = {value}")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+            self.stdout.write(f"Estadísticas: {json.dumps(server.stats())}")
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+# doctype -> (feature de firma con OTP, feature con el estado del registro en BFA)
+DOCTYPE_FEATURES = {
+    'acta': ('firmada.con.OTP', 'registro.en.blockchain'),
+    'designaciones': ('firmada_con_otp', 'registro_blockchain'),
+    'analitico': ('firmada_con_otp', 'registro_blockchain'),
+    'titulo': ('firmada_con_otp', 'registro_blockchain'),
+}
+
+class Command(BaseCommand):
+    help = (
+        "Carga en el índice hash -> documento (ucasal2_document_hash) los documentos firmados con OTP y enviados "
+        "a BFA antes de que existiera la tabla. Se puede correr varias veces: los hashes ya cargados sólo "
+        "actualizan su estado de BFA."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctypes', type=str, default=','.join(DOCTYPE_FEATURES), help="Doctypes a procesar, separados por coma")
+        parser.add_argument('--limit', type=int, default=None, help="Máximo de documentos a procesar por doctype")
+        parser.add_argument('--dry_run', action='store_true', help="Sólo informa qué se cargaría")
+
+    def handle(self, *args, **options):
+        from file.models import File
+        from ucasal2.utils import get_pdf_hash
+        from ucasal2.models import DocumentHash
+        from ucasal2.external_services.ucasal.document_hashes import DocumentHashIndex
+
+        statuses = (DocumentHash.STATUS_PENDING, DocumentHash.STATUS_SUCCESS, DocumentHash.STATUS_FAILURE)
+        for doctype in [d.strip() for d in options['doctypes'].split(',') if d.strip()]:
+            if doctype not in DOCTYPE_FEATURES:
+                self.stderr.write(self.style.ERROR(f"Doctype desconocido: '{doctype}'"))
+                continue
+            signed_feature, status_feature = DOCTYPE_FEATURES[doctype]
+
+            qs = File.objects.filter(doctype__name=doctype, removed=False).order_by('pk')
+            if options['limit']:
+                qs = qs[:options['limit']]
+
+            cargados = sin_firma = sin_bfa = errores = 0
+            for fil in qs.iterator():
+                if fil.gfv(signed_feature) != "1":
+                    sin_firma += 1
+                    continue
+                bfa_status = fil.gfv(status_feature)
+                if bfa_status not in statuses:
+                    # Firmado pero nunca enviado a BFA: lo cargará el camino de firma cuando se envíe
+                    sin_bfa += 1
+                    continue
+                try:
+                    pdf_hash = get_pdf_hash(fil)
+                except Exception as e:
+                    errores += 1
+                    self.stderr.write(f"[ERROR] {fil.uuid}: {e}")
+                    continue
+                if not options['dry_run'] and DocumentHashIndex.record(str(fil.uuid), doctype, pdf_hash, bfa_status=bfa_status) is None:
+                    errores += 1
+                    continue
+                cargados += 1
+
+            self.stdout.write(self.style.SUCCESS(
+                f"{doctype}: cargados={cargados} | sin firma={sin_firma} | sin envío a BFA={sin_bfa} | errores={errores}"
+                + (" (dry run)" if options['dry_run'] else "")
+            ))
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = (
+        "Envía a UCASAL las notificaciones de cambio de estado pendientes del outbox (rechazos de actas, "
+        "registro en blockchain y estados de designaciones), con reintentos y respetando el orden por documento."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch_size', type=int, default=100, help="Cantidad de mensajes por lote")
+        parser.add_argument('--loop', action='store_true', help="Seguir despachando indefinidamente")
+        parser.add_argument('--sleep', type=float, default=5.0, help="Segundos de espera entre lotes vacíos (con --loop)")
+
+    def handle(self, *args, **options):
+        import time
+        from ucasal2.external_services.ucasal.outbox import UcasalOutbox
+
+        totals = {'sent': 0, 'retried': 0, 'failed': 0, 'skipped': 0}
+        while True:
+            summary = UcasalOutbox.dispatch(batch_size=options['batch_size'])
+            for key, value in summary.items():
+                totals[key] += value
+            if any(summary.values()):
+                self.stdout.write(
+                    f"enviados={summary['sent']} | reintentos={summary['retried']} | "
+                    f"fallidos={summary['failed']} | en espera={summary['skipped']}"
+                )
+            if summary['sent'] or summary['retried'] or summary['failed']:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Total: enviados={totals['sent']} | reintentos={totals['retried']} | "
+            f"fallidos={totals['failed']} | en espera={totals['skipped']}"
+        ))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand, CommandError
+
+OTP_ENV_VAR = 'UCASAL_TITULOS_OTP'
+
+class Command(BaseCommand):
+    help = (
+        "Firma masiva de títulos (p.ej. una promoción para la colación de grados): valida el OTP de Secretaría "
+        "General una sola vez y firma en paralelo todos los títulos 'Pendiente de Firma OTP' de la serie y/o con "
+        "los metadatos indicados. Con --checkpoint la corrida se puede retomar: los títulos ya firmados se saltean. "
+        f"El OTP se toma de la variable de entorno {OTP_ENV_VAR} o se pide por la entrada estándar, para que no "
+        "quede en el historial del shell ni en la lista de procesos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mail', type=str, required=True, help="Mail del usuario de Secretaría General que firma")
+        parser.add_argument('--serie', type=str, default=None, help="Serie de los títulos a firmar")
+        parser.add_argument('--metadata', type=str, action='append', default=[], help="Filtro 'metadato=valor' (se puede repetir)")
+        parser.add_argument('--doctype', type=str, required=True, help="Doctype del título padre (el de analítico y diploma)")
+        parser.add_argument('--limit', type=int, default=None, help="Máximo de títulos a firmar")
+        parser.add_argument('--workers', type=int, default=None, help="Títulos en paralelo (por defecto 'ucasal.titulos.batch.workers')")
+        parser.add_argument('--checkpoint', type=str, default=None, help="Archivo JSON con el resultado de cada título, para retomar la corrida")
+        parser.add_argument('--report', type=str, default=None, help="Archivo JSON donde dejar el resumen y el detalle por título")
+        parser.add_argument('--dry_run', action='store_true', help="Sólo lista los títulos que se firmarían")
+
+    def handle(self, *args, **options):
+        import threading
+        from file.models import File
+        from core.exceptions import AthentoseError
+        from ucasal2.utils import UcasalConfig, TituloStates, is_digit
+        from ucasal2.external_services.ucasal.ucasal_services import UcasalServices
+        from ucasal2.external_services.ucasal.titulos_signer import TitulosSigner
+
+        if not options['serie'] and not options['metadata']:
+            raise CommandError("Indicar --serie y/o --metadata para acotar los títulos a firmar")
+        filtros = {}
+        for filtro in options['metadata']:
+            if '=' not in filtro:
+                raise CommandError(f"--metadata debe tener la forma 'metadato=valor' en lugar de '{filtro}'")
+            name, value = filtro.split('=', 1)
+            filtros[name.strip()] = value.strip()
+
+        checkpoint = self._read_json(options['checkpoint']) if options['checkpoint'] else {}
+        firmados = {uuid for uuid, r in checkpoint.items() if r.get('result') == TitulosSigner.RESULT_OK}
+
+        qs = File.objects.filter(
+            doctype__name=options['doctype'], life_cycle_state__name=TituloStates.pendiente_firma_otp, removed=False
+        ).order_by('pk')
+        if options['serie']:
+            qs = qs.filter(serie__name=options['serie'])
+        titulos = []
+        for fil in qs.iterator():
+            if str(fil.uuid) in firmados:
+                continue
+            if any(str(fil.gmv(name) or '').strip() != value for name, value in filtros.items()):
+                continue
+            titulos.append(fil)
+            if options['limit'] and len(titulos) >= options['limit']:
+                break
+
+        self.stdout.write(f"Títulos a firmar: {len(titulos)} (ya firmados según el checkpoint: {len(firmados)})")
+        if options['dry_run']:
+            for fil in titulos:
+                self.stdout.write(f"  {fil.uuid} {fil.filename}")
+            return
+        if not titulos:
+            return
+
+        # Un solo OTP para toda la promoción
+        otp = self._read_otp()
+        if not is_digit(otp):
+            raise CommandError(f"'OTP' debe ser un número entero positivo en lugar de '{otp}'")
+        try:
+            usuario = TitulosSigner.sg_user(options['mail'])
+            UcasalServices.validate_otp(user=usuario.email, otp=int(otp))
+        except AthentoseError as e:
+            raise CommandError(str(e))
+        nombre = f"{usuario.first_name or ''} {usuario.last_name or ''}".strip()
+        signature = TitulosSigner.signature_data(nombre, usuario.email)
+
+        lock = threading.Lock()
+        def on_result(uuid, result):
+            with lock:
+                checkpoint[uuid] = result
+                if options['checkpoint']:
+                    self._write_json(options['checkpoint'], checkpoint)
+            line = f"[{result['result'].upper():<7}] {uuid} ({result['seconds']}s)"
+            self.stdout.write(line + (f": {result['error']}" if result.get('error') else ""))
+
+        workers = options['workers'] or UcasalConfig.titulos_batch_workers()
+        summary = TitulosSigner.sign_bulk(titulos, signature, workers=workers, on_result=on_result)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Firmados={summary['ok']} | salteados={summary['skipped']} | errores={summary['errors']} | "
+            f"total={summary['total']} | {summary['elapsed_seconds']}s | títulos/min={summary['titulos_per_minute']}"
+        ))
+        if options['report']:
+            self._write_json(options['report'], {'summary': summary, 'titulos': checkpoint})
+
+    @staticmethod
+    def _read_otp()->str:
+        import os
+        import sys
+        import getpass
+        otp = os.environ.get(OTP_ENV_VAR)
+        if otp:
+            return otp.strip()
+        if sys.stdin.isatty():
+            return getpass.getpass("OTP del firmante: ").strip()
+        return sys.stdin.readline().strip()
+
+    @staticmethod
+    def _read_json(path:str)->dict:
+        import os
+        import json
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_json(path:str, data:dict):
+        ''' Escribe a un temporal y lo renombra: un corte a mitad de escritura no deja el checkpoint corrupto '''
+        import os
+        import json
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
@@ -0,0 +1,45 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name='BfaAnchorBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('root', models.CharField(db_index=True, max_length=64)),
+                ('leaf_count', models.IntegerField()),
+                ('status', models.CharField(db_index=True, default='pending', max_length=16)),
+                ('register_response', models.TextField(blank=True, default='')),
+                ('bfa_result', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'ucasal2_bfa_anchor_batch',
+            },
+        ),
+        migrations.CreateModel(
+            name='BfaAnchorEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_uuid', models.CharField(db_index=True, max_length=36)),
+                ('doctype', models.CharField(max_length=64)),
+                ('file_hash', models.CharField(max_length=64)),
+                ('leaf_index', models.IntegerField(blank=True, null=True)),
+                ('proof', models.TextField(blank=True, default='')),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='entries', to='ucasal2.BfaAnchorBatch')),
+            ],
+            options={
+                'db_table': 'ucasal2_bfa_anchor_entry',
+            },
+        ),
+    ]
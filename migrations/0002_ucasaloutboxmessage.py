@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ucasal2', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UcasalOutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_uuid', models.CharField(db_index=True, max_length=36)),
+                ('kind', models.CharField(max_length=64)),
+                ('payload', models.TextField(blank=True, default='{}')),
+                ('status', models.CharField(db_index=True, default='pending', max_length=16)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(db_index=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('response', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'ucasal2_outbox_message',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ucasal2', '0002_ucasaloutboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentHash',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('file_uuid', models.CharField(db_index=True, max_length=36)),
+                ('doctype', models.CharField(max_length=64)),
+                ('version', models.IntegerField(default=1)),
+                ('registered_at', models.DateTimeField(auto_now_add=True)),
+                ('bfa_status', models.CharField(db_index=True, default='pending', max_length=16)),
+                ('bfa_resolved_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'ucasal2_document_hash',
+                'unique_together': {('sha256', 'file_uuid')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ucasal2', '0003_documenthash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SigningJournalEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_uuid', models.CharField(db_index=True, max_length=36)),
+                ('flow', models.CharField(max_length=32)),
+                ('stage', models.CharField(max_length=32)),
+                ('output', models.TextField(blank=True, default='{}')),
+                ('completed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'ucasal2_signing_journal',
+                'unique_together': {('file_uuid', 'flow', 'stage')},
+            },
+        ),
+    ]
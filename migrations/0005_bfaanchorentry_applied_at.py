@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ucasal2', '0004_signingjournalentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bfaanchorentry',
+            name='applied_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
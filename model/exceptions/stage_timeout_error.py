@@ -0,0 +1,6 @@
+class StageTimeoutError(Exception):
+  ''' Una etapa de StagePipeline superó su presupuesto de tiempo '''
+  def __init__(self, stage:str, budget_seconds:float):
+    self.stage = stage
+    self.budget_seconds = budget_seconds
+    super().__init__(f"La etapa '{stage}' superó su presupuesto de {budget_seconds:.1f}s")
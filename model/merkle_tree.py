@@ -0,0 +1,70 @@
+import hashlib
+
+
+class MerkleTree:
+    """Árbol de Merkle SHA-256 sobre hashes de documentos (hex).
+
+    - Hoja:  sha256(0x00 || hash_documento)
+    - Nodo:  sha256(0x01 || izquierdo || derecho)
+    Los prefijos distintos para hojas y nodos evitan que un nodo interno pase por una hoja.
+    Un nodo sin par se promueve sin duplicarlo al nivel superior.
+
+    La prueba de inclusión es una lista de pasos {'position': 'left'|'right', 'hash': hex}, donde
+    'position' indica de qué lado va el hermano al combinarlo con el hash acumulado.
+    """
+
+    LEAF_PREFIX = b'\x00'
+    NODE_PREFIX = b'\x01'
+
+    def __init__(self, document_hashes:list):
+        if not document_hashes:
+            raise ValueError('No se puede construir un árbol de Merkle sin hojas')
+        self.document_hashes = list(document_hashes)
+        self.levels = [[self.leaf_hash(h) for h in self.document_hashes]]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            parents = [
+                self.node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                for i in range(0, len(level), 2)
+            ]
+            self.levels.append(parents)
+
+    @property
+    def root(self)->str:
+        return self.levels[-1][0].hex()
+
+    def proof(self, index:int)->list:
+        steps = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                steps.append({
+                    'position': 'left' if sibling < index else 'right',
+                    'hash': level[sibling].hex(),
+                })
+            index //= 2
+        return steps
+
+    @classmethod
+    def verify(cls, document_hash:str, proof:list, root:str)->bool:
+        try:
+            current = cls.leaf_hash(document_hash)
+            for step in proof:
+                sibling = bytes.fromhex(step['hash'])
+                if step['position'] == 'left':
+                    current = cls.node_hash(sibling, current)
+                elif step['position'] == 'right':
+                    current = cls.node_hash(current, sibling)
+                else:
+                    return False
+            return current.hex() == root.lower()
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    @classmethod
+    def leaf_hash(cls, document_hash:str)->bytes:
+        return hashlib.sha256(cls.LEAF_PREFIX + bytes.fromhex(document_hash)).digest()
+
+    @classmethod
+    def node_hash(cls, left:bytes, right:bytes)->bytes:
+        return hashlib.sha256(cls.NODE_PREFIX + left + right).digest()
@@ -0,0 +1,238 @@
+import io
+import os
+import shutil
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    StreamObject,
+    create_string_object,
+)
+
+
+class PdfIncrementalUpdate:
+    """Agrega una capa a páginas de un PDF como actualización incremental, sin reescribir el documento.
+
+    El PDF original se copia byte a byte y detrás se escribe una sección nueva con sólo lo que cambia:
+    - la capa como Form XObject (con sus recursos: fuente, imagen del QR)
+    - las páginas estampadas, con el mismo número de objeto, sus contenidos originales envueltos en q/Q y
+      un contenido nuevo que dibuja la capa
+    - el diccionario de información (/Info) con los metadatos agregados
+    - una tabla xref con esos objetos y un trailer con /Prev a la tabla original
+    No se parsean ni se vuelven a serializar los objetos del documento que no cambian: el costo depende del
+    tamaño de la capa y no del documento (salvo la copia de los bytes originales).
+
+    Sólo para PDFs sin cifrar con tabla xref clásica; supported() lo indica y el llamador decide qué hacer si no.
+    """
+
+    # El startxref está al final del archivo; se busca en este último tramo
+    TAIL_BYTES = 2048
+    COPY_CHUNK_BYTES = 1024 * 1024
+    LAYER_NAME_PREFIX = '/SpSig'
+
+    def __init__(self, input_pdf_path:str):
+        self.size = os.path.getsize(input_pdf_path)
+        self._file = open(input_pdf_path, 'rb')
+        try:
+            self.startxref = self._find_startxref()
+            # Sobre el archivo abierto: PdfReader sólo lee los objetos que se le piden
+            self.reader = PdfReader(self._file)
+        except Exception:
+            self._file.close()
+            raise
+        self._next_number = int(self.reader.trailer['/Size'])
+        self._objects = {}
+        self._info = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        self._file.close()
+
+    def supported(self)->bool:
+        if self.startxref is None or self.reader.is_encrypted:
+            return False
+        # Tablas xref en streams (o híbridas) quedan fuera: la sección nueva se escribe como tabla clásica
+        if '/XRefStm' in self.reader.trailer:
+            return False
+        self._file.seek(self.startxref)
+        return self._file.read(4) == b'xref'
+
+    def stamp(self, page_indexes:list, layers:list):
+        ''' Dibuja sobre cada página indicada las capas (PDFs de una página, en bytes), en ese orden '''
+        forms = [self._add_form(layer) for layer in layers]
+        pages = self.reader.pages
+        for index in page_indexes:
+            page = pages[index]
+            resources = self._copy_dict(page.get('/Resources'))
+            xobjects = self._copy_dict(resources.get('/XObject'))
+            names = []
+            for form in forms:
+                name = self._free_name(xobjects)
+                xobjects[NameObject(name)] = form
+                names.append(name)
+            resources[NameObject('/XObject')] = xobjects
+
+            # Los contenidos originales quedan entre q/Q para que su estado gráfico no afecte a la capa
+            draw = b'Q\nq\n' + b'\n'.join(f'{name} Do'.encode() for name in names) + b'\nQ\n'
+            contents = ArrayObject([self._add_stream(b'q\n')])
+            contents.extend(self._raw_contents(page))
+            contents.append(self._add_stream(draw))
+
+            new_page = DictionaryObject(dict.items(page))
+            new_page[NameObject('/Resources')] = resources
+            new_page[NameObject('/Contents')] = contents
+            self._objects[page.indirect_reference.idnum] = (page.indirect_reference.generation, new_page)
+
+    def update_info(self, metadata:dict):
+        ''' Agrega (o reemplaza) entradas del diccionario de información del documento '''
+        info = self.reader.trailer.get('/Info')
+        new_info = self._copy_dict(info)
+        for key, value in metadata.items():
+            new_info[NameObject(key)] = create_string_object(str(value))
+        raw = dict.get(self.reader.trailer, '/Info')
+        if isinstance(raw, IndirectObject):
+            self._objects[raw.idnum] = (raw.generation, new_info)
+            self._info = IndirectObject(raw.idnum, raw.generation, None)
+        else:
+            self._info = self._add(new_info)
+
+    def write(self, out):
+        ''' Escribe el PDF original sin cambios seguido de la sección incremental '''
+        self._file.seek(0)
+        shutil.copyfileobj(self._file, out, self.COPY_CHUNK_BYTES)
+        self._file.seek(-1, os.SEEK_END)
+        if self._file.read(1) not in (b'\n', b'\r'):
+            out.write(b'\n')
+
+        offsets = {}
+        for number in sorted(self._objects):
+            generation, obj = self._objects[number]
+            offsets[number] = (out.tell(), generation)
+            out.write(f'{number} {generation} obj\n'.encode())
+            obj.write_to_stream(out)
+            out.write(b'\nendobj\n')
+
+        xref_position = out.tell()
+        # La entrada libre del objeto 0 no cambia, pero muchos lectores esperan que la tabla empiece por ella
+        out.write(b'xref\n0 1\n0000000000 65535 f \n')
+        for first, numbers in self._subsections(sorted(offsets)):
+            out.write(f'{first} {len(numbers)}\n'.encode())
+            for number in numbers:
+                offset, generation = offsets[number]
+                out.write(f'{offset:010d} {generation:05d} n \n'.encode())
+
+        trailer = DictionaryObject({
+            NameObject('/Size'): NumberObject(self._next_number),
+            NameObject('/Root'): dict.get(self.reader.trailer, '/Root'),
+            NameObject('/Prev'): NumberObject(self.startxref),
+        })
+        info = self._info if self._info is not None else dict.get(self.reader.trailer, '/Info')
+        if info is not None:
+            trailer[NameObject('/Info')] = info
+        if '/ID' in self.reader.trailer:
+            trailer[NameObject('/ID')] = dict.get(self.reader.trailer, '/ID')
+        out.write(b'trailer\n')
+        trailer.write_to_stream(out)
+        out.write(f'\nstartxref\n{xref_position}\n%%EOF\n'.encode())
+
+    def _add_form(self, layer:bytes)->IndirectObject:
+        ''' Página de la capa como Form XObject; sus recursos se copian con números de objeto nuevos '''
+        page = PdfReader(io.BytesIO(layer)).pages[0]
+        form = DecodedStreamObject()
+        form.set_data(page.get_contents().get_data())
+        form.update({
+            NameObject('/Type'): NameObject('/XObject'),
+            NameObject('/Subtype'): NameObject('/Form'),
+            NameObject('/BBox'): ArrayObject([FloatObject(v) for v in page.mediabox]),
+            NameObject('/Resources'): self._import(dict.get(page, '/Resources', DictionaryObject()), {}),
+        })
+        return self._add(form.flate_encode())
+
+    def _import(self, obj, numbers:dict):
+        ''' Copia un objeto de otro PDF renumerando sus referencias indirectas '''
+        if isinstance(obj, IndirectObject):
+            if obj.idnum not in numbers:
+                reference = self._reserve()
+                numbers[obj.idnum] = reference.idnum
+                self._objects[reference.idnum] = (0, self._import(obj.get_object(), numbers))
+            return IndirectObject(numbers[obj.idnum], 0, None)
+        if isinstance(obj, StreamObject):
+            data = {key: self._import(value, numbers) for key, value in dict.items(obj) if key != '/Length'}
+            # Los bytes del stream se copian tal cual, todavía codificados (imagen, fuente)
+            data['__streamdata__'] = obj._data
+            return StreamObject.initialize_from_dictionary(data)
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({key: self._import(value, numbers) for key, value in dict.items(obj)})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self._import(value, numbers) for value in obj])
+        return obj
+
+    def _raw_contents(self, page)->list:
+        raw = dict.get(page, '/Contents')
+        if raw is None:
+            return []
+        target = raw.get_object() if isinstance(raw, IndirectObject) else raw
+        if isinstance(target, ArrayObject):
+            return list(target)
+        return [raw]
+
+    def _add_stream(self, data:bytes)->IndirectObject:
+        stream = DecodedStreamObject()
+        stream.set_data(data)
+        return self._add(stream)
+
+    def _add(self, obj)->IndirectObject:
+        reference = self._reserve()
+        self._objects[reference.idnum] = (0, obj)
+        return reference
+
+    def _reserve(self)->IndirectObject:
+        reference = IndirectObject(self._next_number, 0, None)
+        self._next_number += 1
+        return reference
+
+    def _free_name(self, xobjects:DictionaryObject)->str:
+        index = 0
+        while f'{self.LAYER_NAME_PREFIX}{index}' in xobjects:
+            index += 1
+        return f'{self.LAYER_NAME_PREFIX}{index}'
+
+    def _find_startxref(self):
+        self._file.seek(max(0, self.size - self.TAIL_BYTES))
+        tail = self._file.read()
+        position = tail.rfind(b'startxref')
+        if position < 0:
+            return None
+        try:
+            return int(tail[position + len(b'startxref'):].split()[0])
+        except (IndexError, ValueError):
+            return None
+
+    @staticmethod
+    def _copy_dict(obj)->DictionaryObject:
+        ''' Copia superficial: las referencias indirectas de adentro se mantienen '''
+        obj = obj.get_object() if obj is not None else None
+        return DictionaryObject(dict.items(obj)) if isinstance(obj, DictionaryObject) else DictionaryObject()
+
+    @staticmethod
+    def _subsections(numbers:list):
+        ''' Agrupa números de objeto consecutivos: cada grupo es una subsección de la tabla xref '''
+        group = []
+        for number in numbers:
+            if group and number != group[-1] + 1:
+                yield group[0], group
+                group = []
+            group.append(number)
+        if group:
+            yield group[0], group
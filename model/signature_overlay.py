@@ -0,0 +1,123 @@
+import io
+from core.exceptions import AthentoseError
+from ucasal2.utils import UcasalConfig
+
+
+class SignatureOverlay:
+    """Capa de firma (QR + texto del firmante + datos del OTP) que se arma una vez y se estampa en muchos PDFs.
+
+    SpPdfSimpleSigner.sign rearma la capa en cada llamada. Acá la parte común (texto, fuente y, si es la misma
+    para todos, la imagen del QR) se dibuja una sola vez con reportlab y queda como un PDF de una página en
+    memoria; sign() sólo la superpone con pypdf a la página elegida de cada documento. Si el QR cambia por
+    documento (p.ej. designaciones de un mismo VR) se pasa en sign(qr_image=...) y se dibuja aparte sólo la imagen.
+
+    - La fuente es Helvetica (una de las 14 estándar de PDF): no se incrusta y la capa pesa unos pocos KB
+    - Los datos de OTPInfo se guardan en la información del documento (/OTPMail, /OTPIp, ...)
+    - Se usa con 'ucasal.signing.engine' = 'overlay'; por defecto se sigue firmando con SpPdfSimpleSigner
+    - Con 'ucasal.signing.engine' = 'incremental' la capa se agrega como actualización incremental
+      (PdfIncrementalUpdate): el PDF original queda intacto como prefijo del firmado y el costo depende del
+      tamaño de la capa y no del documento. Si el PDF no lo admite (xref en streams) se usa el modo
+      incremental de pypdf, que también conserva el prefijo pero vuelve a recorrer todos los objetos
+    - Los PDFs cifrados se rechazan con AthentoseError en cualquier modo: no se pueden estampar sin la clave
+    - Es de sólo lectura después de construida: se puede usar desde varios threads a la vez
+    """
+
+    ENGINE_SIGNER = 'signer'
+    ENGINE_OVERLAY = 'overlay'
+    ENGINE_INCREMENTAL = 'incremental'
+
+    FONT_NAME = 'Helvetica'
+    PAGES = ('first', 'last', 'all')
+
+    def __init__(self, image_text:str, otp_info, x:float, y:float, width:float, height:float,
+                 qr_image:bytes=None, font_size:float=6, pages:str='first', incremental:bool=None):
+        if pages not in self.PAGES:
+            raise ValueError(f"'pages' debe ser uno de {self.PAGES} en lugar de '{pages}'")
+        self.x, self.y, self.width, self.height = x, y, width, height
+        self.pages = pages
+        self.incremental = UcasalConfig.signing_engine() == self.ENGINE_INCREMENTAL if incremental is None else incremental
+        self.metadata = self._otp_metadata(otp_info)
+        self._layer = self._render(image_text=image_text, qr_image=qr_image, font_size=font_size)
+
+    @classmethod
+    def enabled(cls)->bool:
+        return UcasalConfig.signing_engine() in (cls.ENGINE_OVERLAY, cls.ENGINE_INCREMENTAL)
+
+    def sign(self, input_pdf_path:str, qr_image:bytes=None)->io.BytesIO:
+        ''' Superpone la capa al PDF. Devuelve el PDF firmado en un io.BytesIO, como SpPdfSimpleSigner '''
+        from pypdf import PdfReader, PdfWriter
+
+        layers = [self._layer]
+        if qr_image is not None:
+            layers.append(self._render(qr_image=qr_image))
+
+        pdf_out_stream = io.BytesIO()
+        if self.incremental:
+            from ucasal2.model.pdf_incremental_update import PdfIncrementalUpdate
+            with PdfIncrementalUpdate(input_pdf_path) as update:
+                self._check_not_encrypted(update.reader, input_pdf_path)
+                if update.supported():
+                    update.stamp(self._target_indexes(len(update.reader.pages)), layers)
+                    update.update_info(self.metadata)
+                    update.write(pdf_out_stream)
+                    pdf_out_stream.seek(0)
+                    return pdf_out_stream
+            writer = PdfWriter(PdfReader(input_pdf_path), incremental=True)
+        else:
+            reader = PdfReader(input_pdf_path)
+            self._check_not_encrypted(reader, input_pdf_path)
+            writer = PdfWriter(clone_from=reader)
+
+        pages = writer.pages
+        for index in self._target_indexes(len(pages)):
+            for layer in layers:
+                pages[index].merge_page(PdfReader(io.BytesIO(layer)).pages[0])
+        writer.add_metadata(self.metadata)
+
+        writer.write(pdf_out_stream)
+        pdf_out_stream.seek(0)
+        return pdf_out_stream
+
+    @staticmethod
+    def _check_not_encrypted(reader, input_pdf_path:str):
+        if reader.is_encrypted:
+            raise AthentoseError(f"El PDF '{input_pdf_path}' está cifrado y no se puede firmar: hay que subirlo sin contraseña ni restricciones")
+
+    def _target_indexes(self, page_count:int)->list:
+        if self.pages == 'first':
+            return [0]
+        if self.pages == 'last':
+            return [page_count - 1]
+        return list(range(page_count))
+
+    def _render(self, image_text:str=None, qr_image:bytes=None, font_size:float=6)->bytes:
+        ''' Página PDF con la imagen del QR y/o el texto; el tamaño de página no importa porque sólo se usa su contenido '''
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.utils import ImageReader
+
+        stream = io.BytesIO()
+        c = canvas.Canvas(stream, pageCompression=1)
+        if qr_image is not None:
+            c.drawImage(ImageReader(io.BytesIO(qr_image)), self.x, self.y, width=self.width, height=self.height)
+        if image_text:
+            # Texto a la derecha del QR, alineado con su borde superior
+            text = c.beginText(self.x + self.width + 4, self.y + self.height - font_size)
+            text.setFont(self.FONT_NAME, font_size)
+            text.setLeading(font_size * 1.2)
+            for line in image_text.replace('\r\n', '\n').split('\n'):
+                text.textLine(line)
+            c.drawText(text)
+        c.showPage()
+        c.save()
+        return stream.getvalue()
+
+    @staticmethod
+    def _otp_metadata(otp_info)->dict:
+        fields = ('mail', 'ip', 'latitude', 'longitude', 'accuracy', 'user_agent')
+        metadata = {}
+        for field in fields:
+            value = getattr(otp_info, field, None)
+            if value is not None:
+                name = ''.join(part.capitalize() for part in field.split('_'))
+                metadata[f'/OTP{name}'] = str(value).strip()
+        return metadata
@@ -0,0 +1,158 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from custom.sp_libs.python.logging import SpLogger
+from ucasal2.utils import db_connection_closing
+from ucasal2.model.exceptions.stage_timeout_error import StageTimeoutError
+
+
+class _Stage:
+    def __init__(self, name:str, fn, depends_on:tuple, budget_seconds:float, main_thread:bool):
+        self.name = name
+        self.fn = fn
+        self.depends_on = tuple(depends_on)
+        self.budget_seconds = budget_seconds
+        self.main_thread = main_thread
+        self.started_at = None
+        self.finished_at = None
+
+
+class StagePipeline:
+    """Ejecuta etapas con dependencias, superponiendo las que son independientes.
+
+    - Cada etapa recibe un dict {dependencia: resultado} con los resultados de las etapas de las que depende
+    - Las etapas de red corren en un pool de threads; las que usan el ORM del request (actualizar binario,
+      cambiar estado) se marcan con main_thread=True y corren en el thread del llamador
+    - budget_seconds: si una etapa del pool lo supera se deja de esperarla y se lanza StageTimeoutError;
+      una etapa del thread principal no se puede interrumpir, sólo se registra el exceso
+    - Ante el primer error se cancelan las etapas no iniciadas y se relanza la excepción original. Las etapas del
+      pool que ya habían empezado no se pueden interrumpir: siguen en segundo plano y se registra en el log
+      cuándo terminan y con qué resultado
+    - timings(): inicio y duración de cada etapa en ms, relativos al inicio del pipeline
+    """
+    logger = SpLogger("athentose", "StagePipeline")
+
+    def __init__(self, name:str, max_workers:int=4):
+        self.name = name
+        self.max_workers = max_workers
+        self._stages = {}
+        self._results = {}
+        self._started_at = None
+
+    def stage(self, name:str, fn, depends_on:tuple=(), budget_seconds:float=None, main_thread:bool=False):
+        if name in self._stages:
+            raise ValueError(f"La etapa '{name}' ya existe en el pipeline '{self.name}'")
+        self._stages[name] = _Stage(name, fn, depends_on, budget_seconds, main_thread)
+        return self
+
+    def run(self)->dict:
+        ''' Ejecuta todas las etapas y devuelve {etapa: resultado} '''
+        self._check_dependencies()
+        self._started_at = time.perf_counter()
+        pending = list(self._stages.values())
+        running = {}
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f'pipeline-{self.name}')
+        try:
+            while pending or running:
+                for stage in [s for s in pending if not s.main_thread and self._is_ready(s)]:
+                    pending.remove(stage)
+                    stage.started_at = time.perf_counter()
+                    running[executor.submit(db_connection_closing(stage.fn), self._inputs(stage))] = stage
+
+                main_stage = next((s for s in pending if s.main_thread and self._is_ready(s)), None)
+                if main_stage is not None:
+                    pending.remove(main_stage)
+                    self._run_in_main_thread(main_stage)
+                    continue
+
+                if not running:
+                    # _check_dependencies evita los ciclos, así que no debería ocurrir
+                    raise RuntimeError(f"Pipeline '{self.name}': no hay etapas listas para ejecutar")
+
+                done, _ = wait(list(running), timeout=self._next_deadline(running.values()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    stage.finished_at = time.perf_counter()
+                    self._results[stage.name] = future.result()
+                self._check_budgets(running.values())
+        finally:
+            for future, stage in running.items():
+                future.add_done_callback(lambda future, stage=stage: self._log_abandoned(stage, future))
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.logger.debug(f"Pipeline '{self.name}': {self.timings()}")
+        return dict(self._results)
+
+    def timings(self)->dict:
+        timings = {}
+        for stage in self._stages.values():
+            if stage.started_at is None:
+                continue
+            finished_at = stage.finished_at or time.perf_counter()
+            timings[stage.name] = {
+                'start_ms': round((stage.started_at - self._started_at) * 1000, 1),
+                'duration_ms': round((finished_at - stage.started_at) * 1000, 1),
+                'budget_ms': round(stage.budget_seconds * 1000, 1) if stage.budget_seconds else None,
+                'finished': stage.finished_at is not None,
+            }
+        return timings
+
+    def server_timing(self)->str:
+        ''' Valor para el header HTTP 'Server-Timing' (visible en las herramientas de desarrollo del navegador) '''
+        return ', '.join(f"{name};dur={t['duration_ms']}" for name, t in self.timings().items())
+
+    def _run_in_main_thread(self, stage:_Stage):
+        stage.started_at = time.perf_counter()
+        try:
+            self._results[stage.name] = stage.fn(self._inputs(stage))
+        finally:
+            stage.finished_at = time.perf_counter()
+        elapsed = stage.finished_at - stage.started_at
+        if stage.budget_seconds and elapsed > stage.budget_seconds:
+            self.logger.warning(f"Pipeline '{self.name}': la etapa '{stage.name}' tardó {elapsed:.2f}s (presupuesto {stage.budget_seconds}s)")
+
+    def _log_abandoned(self, stage:_Stage, future):
+        ''' Etapa del pool que seguía corriendo cuando el pipeline falló '''
+        if future.cancelled():
+            return
+        stage.finished_at = time.perf_counter()
+        elapsed = stage.finished_at - stage.started_at
+        error = future.exception()
+        if error is not None:
+            self.logger.warning(f"Pipeline '{self.name}': la etapa abandonada '{stage.name}' terminó con error a los {elapsed:.2f}s: {error}")
+        else:
+            self.logger.warning(f"Pipeline '{self.name}': la etapa abandonada '{stage.name}' terminó a los {elapsed:.2f}s")
+
+    def _is_ready(self, stage:_Stage)->bool:
+        return all(dependency in self._results for dependency in stage.depends_on)
+
+    def _inputs(self, stage:_Stage)->dict:
+        return {dependency: self._results[dependency] for dependency in stage.depends_on}
+
+    def _next_deadline(self, stages)->float:
+        now = time.perf_counter()
+        remaining = [s.started_at + s.budget_seconds - now for s in stages if s.budget_seconds]
+        return max(0.0, min(remaining)) if remaining else None
+
+    def _check_budgets(self, stages):
+        now = time.perf_counter()
+        for stage in stages:
+            if stage.budget_seconds and now - stage.started_at > stage.budget_seconds:
+                raise StageTimeoutError(stage.name, stage.budget_seconds)
+
+    def _check_dependencies(self):
+        for stage in self._stages.values():
+            missing = [d for d in stage.depends_on if d not in self._stages]
+            if missing:
+                raise ValueError(f"La etapa '{stage.name}' depende de etapas inexistentes: {missing}")
+        visiting, visited = set(), set()
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"El pipeline '{self.name}' tiene un ciclo en la etapa '{name}'")
+            visiting.add(name)
+            for dependency in self._stages[name].depends_on:
+                visit(dependency)
+            visiting.discard(name)
+            visited.add(name)
+        for name in self._stages:
+            visit(name)
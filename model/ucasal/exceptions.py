@@ -1,3 +1,15 @@
 from custom.sp_libs.python.exceptions import WebServiceError
 class UcasalServiceError(WebServiceError): pass
-    
\ No newline at end of file
+
+class UcasalCircuitOpenError(UcasalServiceError):
+    ''' El circuit breaker del endpoint está abierto: se falla rápido sin llamar al servicio '''
+    def __init__(self, endpoint_name:str, retry_after_seconds:float):
+        self.endpoint_name = endpoint_name
+        self.retry_after_seconds = retry_after_seconds
+        Exception.__init__(self, f"El servicio UCASAL '{endpoint_name}' no está disponible (circuit breaker abierto). Reintentar en {retry_after_seconds:.0f}s.")
+
+    def detailed_message(self)->str:
+        return str(self)
+
+    def to_dict(self)->dict:
+        return {'endpoint': self.endpoint_name, 'retry_after_seconds': self.retry_after_seconds, 'message': str(self)}
@@ -0,0 +1,98 @@
+from django.db import models
+
+
+class BfaAnchorBatch(models.Model):
+    ''' Raíz de Merkle registrada en BFA en lugar de cada hash por separado (modo 'merkle') '''
+    STATUS_PENDING = 'pending'
+    STATUS_SUCCESS = 'success'
+    STATUS_FAILURE = 'failure'
+
+    root = models.CharField(max_length=64, db_index=True)
+    leaf_count = models.IntegerField()
+    status = models.CharField(max_length=16, default=STATUS_PENDING, db_index=True)
+    register_response = models.TextField(blank=True, default='')
+    bfa_result = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'ucasal2'
+        db_table = 'ucasal2_bfa_anchor_batch'
+
+
+class BfaAnchorEntry(models.Model):
+    ''' Hash de un documento pendiente de incluir en un árbol de Merkle, o ya incluido con su prueba '''
+    file_uuid = models.CharField(max_length=36, db_index=True)
+    doctype = models.CharField(max_length=64)
+    file_hash = models.CharField(max_length=64)
+    batch = models.ForeignKey(BfaAnchorBatch, null=True, blank=True, on_delete=models.SET_NULL, related_name='entries')
+    leaf_index = models.IntegerField(null=True, blank=True)
+    proof = models.TextField(blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Cuándo se aplicó al documento el resultado BFA de la raíz
+    applied_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'ucasal2'
+        db_table = 'ucasal2_bfa_anchor_entry'
+
+
+class UcasalOutboxMessage(models.Model):
+    ''' Notificación de cambio de estado a UCASAL, escrita en la misma transacción que el cambio de ciclo de vida '''
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+
+    file_uuid = models.CharField(max_length=36, db_index=True)
+    kind = models.CharField(max_length=64)
+    payload = models.TextField(blank=True, default='{}')
+    status = models.CharField(max_length=16, default=STATUS_PENDING, db_index=True)
+    attempts = models.IntegerField(default=0)
+    # Próximo intento; mientras está en 'sending' es el vencimiento del lease del dispatcher
+    next_attempt_at = models.DateTimeField(db_index=True)
+    last_error = models.TextField(blank=True, default='')
+    response = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'ucasal2'
+        db_table = 'ucasal2_outbox_message'
+
+
+class DocumentHash(models.Model):
+    ''' SHA-256 de cada versión firmada de un documento, para buscar por hash qué acta, designación o título le corresponde '''
+    STATUS_PENDING = 'pending'
+    STATUS_SUCCESS = 'success'
+    STATUS_FAILURE = 'failure'
+
+    sha256 = models.CharField(max_length=64, db_index=True)
+    file_uuid = models.CharField(max_length=36, db_index=True)
+    doctype = models.CharField(max_length=64)
+    # Número de binario firmado del documento: 1 para el primero, y sube cada vez que se registra un hash distinto
+    version = models.IntegerField(default=1)
+    registered_at = models.DateTimeField(auto_now_add=True)
+    bfa_status = models.CharField(max_length=16, default=STATUS_PENDING, db_index=True)
+    bfa_resolved_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'ucasal2'
+        db_table = 'ucasal2_document_hash'
+        unique_together = (('sha256', 'file_uuid'),)
+
+
+class SigningJournalEntry(models.Model):
+    ''' Etapa completada de la firma de un documento y sus salidas, para retomar desde ahí un reintento '''
+    file_uuid = models.CharField(max_length=36, db_index=True)
+    # Camino de firma: 'acta', 'designaciones' o 'titulo'
+    flow = models.CharField(max_length=32)
+    stage = models.CharField(max_length=32)
+    output = models.TextField(blank=True, default='{}')
+    completed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = 'ucasal2'
+        db_table = 'ucasal2_signing_journal'
+        unique_together = (('file_uuid', 'flow', 'stage'),)
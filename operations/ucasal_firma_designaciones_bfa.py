@@ -7,18 +7,14 @@ from django.http import HttpResponse
 from ucasal2.utils import DesignacionesStates
 from ucasal2.external_services.ucasal.designaciones_services import DesignacionesServices
 from ucasal2.external_services.ucasal.ucasal_services import UcasalServices
-from ucasal2.utils import is_digit, is_non_empty_string, get_mail_for_otp, get_arg_time, get_pdf_hash
-from custom.sp_libs.python.sp_pdf_otp_simple_signer.sp_pdf_otp_simple_signer import SpPdfSimpleSigner, QRInfo, OTPInfo
+from ucasal2.external_services.ucasal.bfa_anchoring import BfaAnchoring
+from ucasal2.external_services.ucasal.designaciones_signer import DesignacionesSigner
+from ucasal2.utils import is_digit, is_non_empty_string, get_pdf_hash
 from ucasal2.utils import UcasalConfig
 from file.models import File
-from django.core.files import File as DjangoFile
 from core.exceptions import AthentoseError
 from django.contrib.auth.models import Group
 from django_currentuser.middleware import get_current_user
-from datetime import datetime
-import base64
-import locale
-import io
 import os
 
 class FirmaDesignacionesVR(DocumentOperation):
@@ -39,6 +35,8 @@ class FirmaDesignacionesVR(DocumentOperation):
             uuid = str(fil.uuid)
             lifecycle_state = fil.life_cycle_state.name
             flogger = SpFeatureLogger.getLogger(fil)
+            # SHA-256 del PDF firmado en esta ejecución (se calcula al guardarlo)
+            pdf_hash = None
 
             # Bloquea el boton y codigo otp mientras se procesa la operacion
             try:
@@ -91,115 +89,35 @@ class FirmaDesignacionesVR(DocumentOperation):
                 #print("Resultado validación OTP:", result)
                 #fil.set_feature('valide_otp', '1')
 
-                # 4) Obtener token + URL pública + QR 
+                # 4) Obtener token
                 auth_token = UcasalServices.get_auth_token(
                     user=UcasalConfig.token_svc_user(),
                     password=UcasalConfig.token_svc_password()
                 )
                 fil.set_feature('obtuve_auth_token', '1')
 
-                url_to_shorten = UcasalConfig.designaciones_validation_url_template().replace('{{uuid}}', uuid)
-                short_url = UcasalServices.get_short_url(auth_token=auth_token, url=url_to_shorten)
-
-                qr_stream = UcasalServices.get_qr_image(url=short_url)
-                b64_qr = base64.b64encode(qr_stream).decode('utf-8')
-
-                # 5) Datos de la firma 
-                mail_vr_ofuscado = get_mail_for_otp(mail_vr)
-                fecha_firma_texto = get_arg_time()
-
-                try:
-                    locale.setlocale(locale.LC_TIME, 'es_AR.UTF-8')
-                except Exception:
-                    pass
-                now = datetime.now()
-                day = now.strftime("%d")
-                month = now.strftime("%B")
-                year = now.strftime("%Y")
-
-                firmada_con_otp = fil.gfv('firmada_con_otp')
-                if firmada_con_otp == "1":
+                # 5) Datos de la firma. Un intento anterior pudo guardar el PDF firmado y cortarse antes de marcarlo
+                journal = DesignacionesSigner.journal(fil)
+                if DesignacionesSigner.already_signed(fil, journal):
                     logger.debug({"msg": f"La Designacion {uuid} ya se encuentra firmada", "msg_type": "warning"})
                 else:
                     logger.debug('Firmando PDF existente con OTP...')
 
                     # ======== FIRMA SOBRE PDF EXISTENTE ========
 
-                    # 5.a) Leer bytes del PDF actual desde el path
-                    with open(fil.path(), "rb") as f:
-                        current_bytes = f.read()
-                    if not current_bytes:
+                    # 5.a) Verificar que el PDF actual tenga contenido
+                    if not os.path.getsize(fil.path()):
                         return AthentoseError("El documento no tiene binario para firmar")
 
-                    # 5.b) Guardar QR como PNG temporal (para QRInfo.image_path)
-                    qr_image_tmp_path = f"/var/www/athentose/media/tmp/ucasal2_qr_{fil.uuid}.png"
-                    os.makedirs(os.path.dirname(qr_image_tmp_path), exist_ok=True)
-                    with open(qr_image_tmp_path, "wb") as qr_file:
-                        qr_file.write(qr_stream)
-
-                    # 5.c) Texto junto al QR 
-                    qr_text = (                        
-                        "Firmado con OTP por:\r\n"
-                        f"{nombre_vr}\r\n"
-                        f"{mail_vr_ofuscado}\r\n"
-                        f"{fecha_firma_texto}"
-                    )
-
-                    # 5.d) QRInfo usando image_path + image_text 
-                    qr_info = QRInfo(
-                        image_path=qr_image_tmp_path,
-                        image_text=qr_text,                        
-                        #x=845, y=20, width=75, height=75  # ajustá posición/tamaño
-                        x=845, y=11, width=70, height=70  # ajustá posición/tamaño
-                    )
-
-                    # 5.e) OTPInfo — AJUSTE A DESIGNACIONES (mail + metadatos opcionales)
-                    otp_info = OTPInfo(
-                        mail="\n" + mail_vr_ofuscado,
-                        ip="N/A",
-                        latitude=0.0,
-                        longitude=0.0,
-                        accuracy="N/A",
-                        user_agent="Athentose/Signer"
-                    )
-                    
-
-                    # 5.f) Firmar y actualizar el binario
-                    signer = SpPdfSimpleSigner()
-
-                    signed_result = signer.sign(
-                        fil.path(),   
-                        qr_info,      
-                        otp_info      
-                    )
-
-                    # Signer devuelve io.BytesIO
-                    signed_pdf_bytes = signed_result.getvalue()
-
-                    document = DjangoFile(io.BytesIO(signed_pdf_bytes), f"{fil.filename}.pdf")
-                    fil.update_binary(document)
-
-                    # 5.g) Features finales 
-                    fil.set_feature('firmada_con_otp', "1")
-                    
-                    # Guardamos los datos para el PDF (con el QR)
-                    body_to_save = {
-                        'fecha_firma': {'day': day, 'month': month, 'year': year},
-                        'qr_data': {'qr_base64': b64_qr},
-                        'qr_text': {
-                            'firmado_por': 'Firmado con OTP por:',
-                            'nombre_vr': nombre_vr,
-                            'mail_vr': mail_vr_ofuscado,
-                            'fecha_firma': fecha_firma_texto
-                        }
-                    }
-
-                    # No guardamos el Base64 en la base de datos para evitar error de indice (8191 bytes)
-                    # fil.set_feature('bodyFinal', body_to_save) # Línea original comentada
-                    body_to_save['qr_data'].pop('qr_base64', None)
-                    fil.set_feature('bodyFinal', body_to_save)
-
-                    fil.set_metadata('metadata.designaciones_usuario_firmante', nombre_vr, overwrite=True)
+                    # 5.b) URL pública + QR, texto junto al QR y OTPInfo
+                    qr_stream = DesignacionesSigner.validation_qr(fil, auth_token, journal)
+                    signature = DesignacionesSigner.signature_data(nombre_vr, mail_vr)
+
+                    # 5.c) Firmar
+                    signed_result = DesignacionesSigner.sign_pdf(fil, qr_stream, signature)
+
+                    # 5.d) Actualizar el binario y features finales. El hash sale de los mismos bytes que se guardan
+                    pdf_hash = DesignacionesSigner.save_signed(fil, signed_result, signature)
 
                     logger.debug({"msg": f"La Designacion {uuid} fue firmada exitosamente sobre el PDF existente", "msg_type": "success"})                    
 
@@ -207,26 +125,24 @@ class FirmaDesignacionesVR(DocumentOperation):
             # =========================================
             # Registrar en BFA
             # =========================================
-            registrada_en_blockchain = fil.gfv('registro_blockchain')
-            if registrada_en_blockchain == 'pending':
-                raise AthentoseError('La designación ya había sido enviada a blockchain y su resultado aún está pendiente')
-            if registrada_en_blockchain == 'success':
-                raise AthentoseError('La designación ya está registrada en blockchain')
-            pdf_hash = get_pdf_hash(fil)
-            callback_url = DesignacionesServices.set_callback_url(uuid=uuid)
-            ok_response_text = UcasalServices.register_in_blockchain(
-                auth_token=auth_token,
-                hash=pdf_hash,
-                file_uuid=str(fil.uuid),
-                callback_url=callback_url
-            )
-            fil.set_feature('ucasal2.svc.ok_response', ok_response_text)
-            fil.set_feature('registro_blockchain', 'pending')
-            response = DesignacionesServices.change_state_integration(uuid=uuid, state=4, auth_token=auth_token)
-            fil.set_feature('Response estado 4', response.text)
-            fil.set_feature('Status Code 4', response.status_code)
-            if lifecycle_state == DesignacionesStates.pendiente_firma_otp:
-                fil.change_life_cycle_state(DesignacionesStates.pendiente_blockchain)
+            if pdf_hash is None:
+                pdf_hash = get_pdf_hash(fil)
+            DesignacionesSigner.check_not_registered(fil)
+            # Un intento anterior pudo registrar el hash y cortarse antes de cambiar el estado: sólo se completa
+            journal = DesignacionesSigner.journal(fil)
+            ok_response_text = journal.registered(pdf_hash)
+            if ok_response_text is None:
+                callback_url = DesignacionesServices.set_callback_url(uuid=uuid)
+                ok_response_text = BfaAnchoring.register(
+                    auth_token=auth_token,
+                    hash=pdf_hash,
+                    file_uuid=str(fil.uuid),
+                    doctype='designaciones',
+                    callback_url=callback_url
+                )
+                journal.record_register(pdf_hash, ok_response_text)
+            # Notifica a UCASAL el estado 4 (por medio del outbox) y pasa a Pendiente de Blockchain
+            DesignacionesSigner.mark_registered(fil, ok_response_text)
 
             return logger.exit({'msg': 'Designación Firmada correctamente aguardando respuesta de Blockchain', 'msg_type': 'success'})
             
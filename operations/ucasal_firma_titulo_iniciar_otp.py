@@ -5,7 +5,7 @@ from core.exceptions import AthentoseError
 from django.utils.translation import gettext as _
 from django.http import HttpResponse
 from custom.sp_libs.python.logging import SpLogger, SpFeatureLogger, NullSpFeatureLogger
-from custom.ucasal2.utils import TituloStates
+from ucasal2.utils import TituloStates
 
 class IniciaFirmaTituloOTP(DocumentOperation):
     version = "1.0"
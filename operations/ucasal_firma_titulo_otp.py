@@ -7,26 +7,14 @@ from django.http import HttpResponse
 
 from core.exceptions import AthentoseError
 from file.models import File
-from django.core.files import File as DjangoFile
 from django_currentuser.middleware import get_current_user
 
-from custom.ucasal2.utils import TituloStates
-from custom.ucasal2.external_services.ucasal.ucasal_services import UcasalServices
-from custom.ucasal2.external_services.ucasal.designaciones_services import DesignacionesServices
-from custom.ucasal2.utils import UcasalConfig
-from custom.ucasal2.utils import is_digit, get_mail_for_otp, get_arg_time, get_pdf_hash
-from custom.sp_libs.python.sp_pdf_otp_simple_signer.sp_pdf_otp_simple_signer import (
-    SpPdfSimpleSigner,
-    QRInfo,
-    OTPInfo,
-)
+from ucasal2.utils import TituloStates
+from ucasal2.external_services.ucasal.ucasal_services import UcasalServices
+from ucasal2.external_services.ucasal.titulos_signer import TitulosSigner
+from ucasal2.utils import is_digit
+from ucasal2.model.exceptions.stage_timeout_error import StageTimeoutError
 
-import base64
-import io
-import os
-from datetime import datetime
-import locale
-import requests
 from file.foperations import op_send_by_email
 
 class FirmaTituloOTP(DocumentOperation):
@@ -139,13 +127,10 @@ class FirmaTituloOTP(DocumentOperation):
             UcasalServices.validate_otp(user=mail_sg, otp=otp)
             fil_padre.set_feature("valide_otp", "1")
 
-            # 2) Token, URL de validación del título y QR
+            # 2) Token
             flogger.entry("Obteniendo auth_token...")
             try:
-                auth_token = UcasalServices.get_auth_token(
-                    user=UcasalConfig.token_svc_user(),
-                    password=UcasalConfig.token_svc_password(),
-                )
+                auth_token = TitulosSigner.auth_token()
             except Exception as token_err:
                 import traceback
                 err_msg = getattr(token_err, 'message', None) or getattr(token_err, 'args', [None])[0] or str(token_err)
@@ -154,227 +139,9 @@ class FirmaTituloOTP(DocumentOperation):
                 raise
             fil_padre.set_feature("obtuve_auth_token", "1")
 
-            url_to_shorten = UcasalConfig.designaciones_validation_url_template().replace(
-                "{{uuid}}", uuid_padre
-            )
-            flogger.entry(f"Obteniendo short_url para: {url_to_shorten}")
-            try:
-                short_url = UcasalServices.get_short_url(
-                    auth_token=auth_token, url=url_to_shorten
-                )
-            except Exception as url_err:
-                flogger.entry(f"Error al obtener short_url: {str(url_err)}")
-                raise
-
-            flogger.entry(f"Obteniendo QR para: {short_url}")
-            try:
-                qr_stream = UcasalServices.get_qr_image(url=short_url)
-            except Exception as qr_err:
-                flogger.entry(f"Error al obtener QR: {str(qr_err)}")
-                raise
-            b64_qr = base64.b64encode(qr_stream).decode("utf-8")
-
-            # 2.b) Datos textuales de la firma
-            mail_sg_ofuscado = get_mail_for_otp(mail_sg)
-            fecha_firma_texto = get_arg_time()
-
-            try:
-                locale.setlocale(locale.LC_TIME, "es_AR.UTF-8")
-            except Exception:
-                pass
-            now = datetime.now()
-            day = now.strftime("%d")
-            month = now.strftime("%B")
-            year = now.strftime("%Y")
-
-            qr_text = (
-                "Firmado con OTP por:\r\n"
-                f"{nombre_sg}\r\n"
-                f"{mail_sg_ofuscado}\r\n"
-                f"{fecha_firma_texto}"
-            )
-
-            otp_info = OTPInfo(
-                mail="\n" + mail_sg_ofuscado,
-                ip="N/A",
-                latitude=0.0,
-                longitude=0.0,
-                accuracy="N/A",
-                user_agent="Athentose/Signer",
-            )
-
-            # 3) Encontrar hijos del folder (analítico y diploma)
-            flogger.entry(f"Buscando expediente titulo y analitico")
-            hijos = fil_padre.get_children()
-            flogger.entry(f"Hijos encontrados: {len(hijos)}")
-            hijo_analitico = None
-            hijo_diploma = None
-
-            for hijo in hijos:
-                # TODO: ajusta estos criterios a tus doctypes/metadata reales
-                if hijo.doctype.name == "analitico":
-                    hijo_analitico = hijo
-                elif hijo.doctype.name == "titulo":
-                    hijo_diploma = hijo
-
-            if not hijo_analitico or not hijo_diploma:
-                flogger.entry(
-                    "No se encontraron ambos documentos (Analítico y Diploma) relacionados "
-                    "al título para firmar."
-                )
-                raise AthentoseError(
-                    _(
-                        "No se encontraron ambos documentos (Analítico y Diploma) relacionados "
-                        "al título para firmar."
-                    )
-                )
-
-            signer = SpPdfSimpleSigner()
-            documentos_firmados = []
-
-            # 4) Firmar ambos PDFs con el mismo QR/OTP
-            for hijo in (hijo_analitico, hijo_diploma):
-                with open(hijo.path(), "rb") as f:
-                    current_bytes = f.read()
-                if not current_bytes:
-                    flogger.entry(f"El documento {hijo.uuid} no tiene binario para firmar")
-                    raise AthentoseError(
-                        _("El documento %(uuid)s no tiene binario para firmar")
-                        % {"uuid": hijo.uuid}
-                    )
-
-                qr_image_tmp_path = f"/var/www/athentose/media/tmp/ucasal_titulo_qr_{hijo.uuid}.png"
-                os.makedirs(os.path.dirname(qr_image_tmp_path), exist_ok=True)
-                with open(qr_image_tmp_path, "wb") as qr_file:
-                    qr_file.write(qr_stream)
-
-                qr_info = QRInfo(
-                    image_path=qr_image_tmp_path,
-                    image_text=qr_text,
-                    x=20,
-                    y=11,
-                    width=70,
-                    height=70,
-                )
-
-                signed_result = signer.sign(
-                    hijo.path(),
-                    qr_info,
-                    otp_info,
-                )
-
-                signed_pdf_bytes = signed_result.getvalue()
-
-                document = DjangoFile(
-                    io.BytesIO(signed_pdf_bytes), f"{hijo.filename}.pdf"
-                )
-                hijo.update_binary(document)
-                hijo.set_feature("firmada_con_otp", "1")
-                documentos_firmados.append(str(hijo.uuid))
-
-                try:
-                    os.remove(qr_image_tmp_path)
-                except Exception:
-                    logger.warning(
-                        "No se pudo eliminar el archivo temporal %s", qr_image_tmp_path
-                    )
-
-            # 5) Registrar hashes de analítico y diploma en blockchain
-            registrada_en_blockchain = fil_padre.gfv("registro_blockchain")
-            if registrada_en_blockchain == "pending":
-                flogger.entry(
-                    "El título ya había sido enviado a blockchain y su resultado aún "
-                    "está pendiente."
-                )
-                raise AthentoseError(
-                    _(
-                        "El título ya había sido enviado a blockchain y su resultado aún "
-                        "está pendiente."
-                    )
-                )
-            if registrada_en_blockchain == "success":
-                flogger.entry("El título ya está registrado en blockchain.")
-                raise AthentoseError(_("El título ya está registrado en blockchain."))
-
-            hash_analitico = get_pdf_hash(hijo_analitico)
-            # TODO: ajusta si tienes una plantilla específica de callback para títulos
-            callback_url = DesignacionesServices.set_callback_url(uuid=uuid_padre)   # placeholder genérico
-
-            ok_response_analitico = UcasalServices.register_in_blockchain(
-                auth_token=auth_token,
-                hash=hash_analitico,
-                file_uuid=str(hijo_analitico.uuid),
-                callback_url=callback_url,
-            )
-            hijo_analitico.set_feature(
-                "ucasal.svc.ok_response_analitico", ok_response_analitico
-            )
-
-            hash_diploma = get_pdf_hash(hijo_diploma)
-            ok_response_diploma = UcasalServices.register_in_blockchain(
-                auth_token=auth_token,
-                hash=hash_diploma,
-                file_uuid=str(hijo_diploma.uuid),
-                callback_url=callback_url,
-            )
-            hijo_diploma.set_feature("ucasal.svc.ok_response_diploma", ok_response_diploma)
-
-            fil_padre.set_feature("registro_blockchain", "pending")
-            fil_padre.set_feature("titulos.documentos_firmados", documentos_firmados)
-
-            fil_padre.set_feature("hash_diploma", hash_diploma)
-            fil_padre.set_feature("hash_analitico", hash_diploma)
-
-
-            # Verificar que ambos documentos fueron firmados
-            if len(documentos_firmados) == 2:
-                fil_padre.change_life_cycle_state(TituloStates.pendiente_firma_otp)
-                fil_padre.set_metadata(
-                    "estado",
-                    TituloStates.pendiente_firma_otp,
-                    overwrite=True,
-                )
-                fil_padre.change_life_cycle_state(TituloStates.pendiente_blockchain)
-                fil_padre.set_metadata(
-                    "estado",
-                    TituloStates.pendiente_blockchain,
-                    overwrite=True,
-                )
-                fil_padre.change_life_cycle_state(TituloStates.firmado)
-                fil_padre.set_metadata("estado", TituloStates.firmado, overwrite=True)
-                flogger.entry("Ambos documentos firmados. Estado cambiado a 'Firmado'")
-
-            # 6) Cambiar estado del padre a pendiente_blockchain
-            if fil_padre.life_cycle_state.name == TituloStates.pendiente_firma_otp:
-                fil_padre.change_life_cycle_state(TituloStates.pendiente_blockchain)
-                fil_padre.set_metadata(
-                    "estado",
-                    TituloStates.pendiente_blockchain,
-                    overwrite=True,
-                )
-
-            try:
-                response = requests.post(
-                    "https://sistemasweb-desa.ucasal.edu.ar/v1/titulos/update-finalize",
-                    json={"status": "5", "uuid": uuid_padre},
-                    verify=False,
-                )
-                flogger.entry(f"Actualizacion estado firmada UCASAL - Status: {response.status_code}, Response: {response.text[:200]}")
-            except Exception as notif_err:
-                flogger.entry(f"Error al Actualizacion estado firmada a UCASAL: {str(notif_err)}")
-    
-
-            body_to_save = {
-                "fecha_firma": {"day": day, "month": month, "year": year},
-                "qr_data": {"short_url": short_url, "qr_base64": b64_qr},
-                "qr_text": {
-                    "firmado_por": "Firmado con OTP por:",
-                    "nombre": nombre_sg,
-                    "mail": mail_sg_ofuscado,
-                    "fecha_firma": fecha_firma_texto,
-                },
-            }
-            fil_padre.set_feature("bodyFinalTitulo", body_to_save)
+            # 3) Firmar analítico y diploma, registrarlos en blockchain y pasar el título a 'Firmado'
+            signature = TitulosSigner.signature_data(nombre_sg, mail_sg)
+            TitulosSigner.sign_titulo(fil_padre, auth_token, signature, flogger)
 
             return logger.exit(
                 {
@@ -386,7 +153,7 @@ class FirmaTituloOTP(DocumentOperation):
                 }
             )
 
-        except AthentoseError as e:
+        except (AthentoseError, StageTimeoutError) as e:
             error_msg = f"Error en la operación de firma de título OTP: {str(e)}"
             flogger.error(error_msg)
             logger.error(error_msg)
@@ -7,6 +7,8 @@ from django.http import HttpResponse
 from external_services.ucasal.ucasal_services import UcasalServices
 from utils import UcasalConfig
 from utils import ActaStates 
+from external_services.ucasal.outbox import UcasalOutbox
+from django.db import transaction
 from custom.sp_libs.python.logging import SpLogger
 uuid_previo_metadata_name =  'metadata.acta_id_acta_previa'
 class RechazaActaDeExamen(DocumentOperation):
@@ -32,18 +34,19 @@ class RechazaActaDeExamen(DocumentOperation):
             if firmada_con_opt == "1":
                 raise AthentoseError(f"El acta ya fue firmada y no puede ser rechazada.")
             motivo = '-'
-            # Notificar a UCASAL para que puedan editar el acta
-            auth_token = UcasalServices.get_auth_token(user=UcasalConfig.token_svc_user(), password = UcasalConfig.token_svc_password())
             uuid_acta_previa = str(fil.gmv(uuid_previo_metadata_name)).replace('None', '')
-            UcasalServices.notify_rejection(auth_token=auth_token, uuid=fil.uuid, previous_uuid = uuid_acta_previa, reason=motivo)
-            
-            # Cambiar estado a Rechazada (aunque la borremos luego, si hay error invocando a UCASAL, al menos que rechazada en Athento)
-            #TODO: forzar transición?
-            fil.change_life_cycle_state(ActaStates.rechazada) #, force_transition=True)
-            logger.exit(HttpResponse('Acta rechazada exitosamente'))
-            # Borrar el acta
-            fil.removed = True
-            fil.save()
+
+            with transaction.atomic():
+                # Cambiar estado a Rechazada (aunque la borremos luego, si hay error invocando a UCASAL, al menos que rechazada en Athento)
+                #TODO: forzar transición?
+                fil.change_life_cycle_state(ActaStates.rechazada) #, force_transition=True)
+
+                # Notificar a UCASAL para que puedan editar el acta (por medio del outbox)
+                UcasalOutbox.notify(UcasalOutbox.ACTA_REJECTION, fil.uuid, previous_uuid=uuid_acta_previa, reason=motivo)
+
+                # Borrar el acta
+                fil.removed = True
+                fil.save()
 
             # Mover el acta al espacio Papelera (Comentado por ahora)
             #fil.move_to_serie(name='papelera')
@@ -8,6 +8,8 @@ from ucasal2.utils import DesignacionesStates
 from ucasal2.external_services.ucasal.designaciones_services import DesignacionesServices
 from ucasal2.external_services.ucasal.ucasal_services import UcasalServices
 from ucasal2.utils import UcasalConfig
+from ucasal2.external_services.ucasal.outbox import UcasalOutbox
+from django.db import transaction
 from core.exceptions import AthentoseError
 from datetime import datetime
 import pytz
@@ -47,23 +49,17 @@ class RechazaDesignaciones (DocumentOperation):
                 if not motivo_rechazo or motivo_rechazo.strip() == "":
                     return logger.exit({"msg" : f"Debe completar el Motivo de Rechazo", "msg_type" : "warning"})
 
-                fil.change_life_cycle_state(DesignacionesStates.rechazado)
-                tz = pytz.timezone('America/Argentina/Buenos_Aires')
-                date_str = datetime.now(tz=tz).strftime('%Y-%m-%d')   
-                fil.set_metadata('metadata.designaciones_fecha_rechazo', date_str, overwrite=True)               
-                
-                serie_papelera = Serie.objects.filter(uuid='69cf403f-ff0d-4207-9d9a-a1d8a816b6c8').first()
-                fil.move_to_serie(serie_papelera)
+                with transaction.atomic():
+                    fil.change_life_cycle_state(DesignacionesStates.rechazado)
+                    tz = pytz.timezone('America/Argentina/Buenos_Aires')
+                    date_str = datetime.now(tz=tz).strftime('%Y-%m-%d')   
+                    fil.set_metadata('metadata.designaciones_fecha_rechazo', date_str, overwrite=True)               
 
-                auth_token = UcasalServices.get_auth_token(
-                    user=UcasalConfig.token_svc_user(),
-                    password=UcasalConfig.token_svc_password()
-                )    
-                #Envia a estado 1 la designación rechazada
-                response = DesignacionesServices.change_state_integration(uuid=uuid, state=1, auth_token=auth_token)
-                fil.set_feature('Response estado 1', response.text)
-                fil.set_feature('Status Code 1', response.status_code)
-                fil.change_life_cycle_state(DesignacionesStates.rechazado) 
+                    serie_papelera = Serie.objects.filter(uuid='69cf403f-ff0d-4207-9d9a-a1d8a816b6c8').first()
+                    fil.move_to_serie(serie_papelera)
+
+                    #Envia a estado 1 la designación rechazada (por medio del outbox)
+                    UcasalOutbox.notify(UcasalOutbox.DESIGNACIONES_STATE, uuid, state=1)
 
                 op_send_by_email.run(
                     uuid,
@@ -6,10 +6,11 @@ from django.utils.translation import gettext as _
 from django.http import HttpResponse
 from custom.sp_libs.python.logging import SpLogger, SpFeatureLogger
 from file.foperations import op_send_by_email
-from custom.ucasal2.utils  import TituloStates
+from ucasal2.utils  import TituloStates
+from ucasal2.utils import UcasalConfig
+from ucasal2.external_services.ucasal.http_transport import UcasalHttpTransport
 from datetime import datetime
 import pytz
-import requests
 
 class RechazaTitulo(DocumentOperation):
     version = "1.0"
@@ -62,8 +63,9 @@ class RechazaTitulo(DocumentOperation):
             fil.change_life_cycle_state("RECHAZADO")
 
             try:
-                response = requests.post(
-                    "https://sistemasweb-desa.ucasal.edu.ar/v1/titulos/update-rejected",
+                response = UcasalHttpTransport.post(
+                    "titulos",
+                    UcasalConfig.titulos_update_rejected_url(),
                     json={"status": "4", "uuid": uuid},
                     verify=False,
                 )
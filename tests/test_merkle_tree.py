@@ -0,0 +1,56 @@
+import hashlib
+from django.test import SimpleTestCase
+from ucasal2.model.merkle_tree import MerkleTree
+
+
+def _hashes(count:int)->list:
+    return [hashlib.sha256(f'documento-{i}'.encode()).hexdigest() for i in range(count)]
+
+
+class MerkleTreeTest(SimpleTestCase):
+
+    def test_every_leaf_proof_verifies_against_the_root(self):
+        # Cantidades pares, impares y potencias de dos: los nodos sin par se promueven sin duplicar
+        for count in (1, 2, 3, 4, 5, 7, 8, 9, 16, 33):
+            hashes = _hashes(count)
+            tree = MerkleTree(hashes)
+            for index, document_hash in enumerate(hashes):
+                with self.subTest(count=count, index=index):
+                    self.assertTrue(MerkleTree.verify(document_hash, tree.proof(index), tree.root))
+
+    def test_single_leaf_root_is_its_leaf_hash(self):
+        document_hash = _hashes(1)[0]
+        tree = MerkleTree([document_hash])
+        self.assertEqual(tree.root, MerkleTree.leaf_hash(document_hash).hex())
+        self.assertEqual(tree.proof(0), [])
+
+    def test_odd_count_promotes_the_last_leaf(self):
+        hashes = _hashes(3)
+        leaves = [MerkleTree.leaf_hash(h) for h in hashes]
+        expected = MerkleTree.node_hash(MerkleTree.node_hash(leaves[0], leaves[1]), leaves[2])
+        tree = MerkleTree(hashes)
+        self.assertEqual(tree.root, expected.hex())
+        self.assertEqual(tree.proof(2), [{'position': 'left', 'hash': MerkleTree.node_hash(leaves[0], leaves[1]).hex()}])
+
+    def test_root_is_deterministic_and_order_sensitive(self):
+        hashes = _hashes(5)
+        self.assertEqual(MerkleTree(hashes).root, MerkleTree(list(hashes)).root)
+        self.assertNotEqual(MerkleTree(hashes).root, MerkleTree(list(reversed(hashes))).root)
+
+    def test_proof_fails_for_another_document_or_root(self):
+        hashes = _hashes(6)
+        tree = MerkleTree(hashes)
+        other_root = MerkleTree(_hashes(7)).root
+        self.assertFalse(MerkleTree.verify(hashes[1], tree.proof(0), tree.root))
+        self.assertFalse(MerkleTree.verify(hashes[0], tree.proof(0), other_root))
+
+    def test_malformed_proof_does_not_verify(self):
+        hashes = _hashes(4)
+        tree = MerkleTree(hashes)
+        self.assertFalse(MerkleTree.verify(hashes[0], [{'position': 'up', 'hash': hashes[1]}], tree.root))
+        self.assertFalse(MerkleTree.verify(hashes[0], [{'hash': hashes[1]}], tree.root))
+        self.assertFalse(MerkleTree.verify('no-es-hex', tree.proof(0), tree.root))
+
+    def test_empty_tree_is_rejected(self):
+        with self.assertRaises(ValueError):
+            MerkleTree([])
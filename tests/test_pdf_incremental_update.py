@@ -0,0 +1,82 @@
+import io
+import os
+from tempfile import NamedTemporaryFile
+from django.test import SimpleTestCase
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, NameObject
+from ucasal2.model.pdf_incremental_update import PdfIncrementalUpdate
+
+
+def _pdf(page_count:int, content:bytes=b'', encrypt:bool=False)->bytes:
+    ''' PDF con tabla xref clásica, como los que genera pypdf '''
+    writer = PdfWriter()
+    for _ in range(page_count):
+        page = writer.add_blank_page(width=200, height=200)
+        if content:
+            stream = DecodedStreamObject()
+            stream.set_data(content)
+            page[NameObject('/Contents')] = writer._add_object(stream)
+    writer.add_metadata({'/Title': 'Original'})
+    if encrypt:
+        writer.encrypt('secreto', algorithm='RC4-128')
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+class PdfIncrementalUpdateTest(SimpleTestCase):
+
+    def setUp(self):
+        self.original = _pdf(3, b'0 0 m 100 100 l S')
+        self.layer = _pdf(1, b'0 0 1 rg 10 10 50 50 re f')
+
+    def _path(self, data:bytes)->str:
+        with NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+            f.write(data)
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def _stamp(self, page_indexes:list, metadata:dict=None)->bytes:
+        out = io.BytesIO()
+        with PdfIncrementalUpdate(self._path(self.original)) as update:
+            self.assertTrue(update.supported())
+            update.stamp(page_indexes, [self.layer])
+            update.update_info(metadata or {})
+            update.write(out)
+        return out.getvalue()
+
+    def test_original_is_exact_prefix(self):
+        signed = self._stamp([0])
+        self.assertTrue(signed.startswith(self.original))
+        self.assertGreater(len(signed), len(self.original))
+
+    def test_signed_pdf_reopens(self):
+        signed = self._stamp([0, 2], {'/OTPMail': 'vr@ucasal.edu.ar'})
+        reader = PdfReader(io.BytesIO(signed), strict=True)
+        self.assertEqual(len(reader.pages), 3)
+
+        for index in (0, 2):
+            xobjects = reader.pages[index]['/Resources']['/XObject']
+            self.assertIn('/SpSig0', xobjects)
+            self.assertEqual(xobjects['/SpSig0'].get_object()['/Subtype'], '/Form')
+        self.assertNotIn('/XObject', reader.pages[1].get('/Resources', {}))
+
+        self.assertEqual(reader.metadata['/OTPMail'], 'vr@ucasal.edu.ar')
+        self.assertEqual(reader.metadata['/Title'], 'Original')
+
+    def test_trailer_points_to_original_xref(self):
+        original_startxref = int(self.original.rsplit(b'startxref', 1)[1].split()[0])
+        signed = self._stamp([0])
+        reader = PdfReader(io.BytesIO(signed), strict=True)
+        self.assertEqual(reader.trailer['/Prev'], original_startxref)
+
+    def test_stamping_twice_uses_a_new_name(self):
+        self.original = self._stamp([0])
+        reader = PdfReader(io.BytesIO(self._stamp([0])), strict=True)
+        xobjects = reader.pages[0]['/Resources']['/XObject']
+        self.assertIn('/SpSig0', xobjects)
+        self.assertIn('/SpSig1', xobjects)
+
+    def test_encrypted_pdf_is_not_supported(self):
+        with PdfIncrementalUpdate(self._path(_pdf(1, encrypt=True))) as update:
+            self.assertFalse(update.supported())
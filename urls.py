@@ -7,10 +7,16 @@ app_name = 'ucasal2'
 #from ucasal2.endpoints import auth, docs, provider, dictionaries, invitation, upload, state, signup
 from ucasal2.endpoints import( 
   actas,
-  designaciones
+  designaciones,
+  bfa,
+  monitoring,
+  hashes
 )
 
 urlpatterns = [
     *actas.routes,
-    *designaciones.routes
+    *designaciones.routes,
+    *bfa.routes,
+    *monitoring.routes,
+    *hashes.routes
 ]
\ No newline at end of file
@@ -9,6 +9,11 @@ from custom.sp_libs.python.sp_logger.sp_logger import SpLogger
 from datetime import datetime
 import pytz
 import hashlib
+import os
+import time
+import threading
+from types import MappingProxyType
+from contextlib import contextmanager
 
 
 NOT_FOUND = HttpResponse('Provider not found.', status=404)
@@ -78,82 +83,395 @@ class TituloStates:
     firmado = 'Firmado'
     rechazado = 'RECHAZADO'
 
+class ConfigSnapshot:
+    """Snapshot inmutable de los valores de SpAthentoConfig leídos por UcasalConfig.
+
+    Cada valor se lee de la configuración la primera vez y luego se sirve desde un dict de sólo lectura
+    (MappingProxyType); una lectura nueva arma un dict nuevo y lo reemplaza, así los valores se leen sin lock
+    (sólo los contadores de stats() toman el suyo).
+    El snapshot se descarta:
+    - cuando cambia la versión 'ucasal2.config.version' del cache de Django (invalidate(), p.ej. desde
+      monitoring/config/invalidate). La versión se consulta como mucho cada VERSION_CHECK_SECONDS
+    - a los TTL_SECONDS, para tomar cambios de configuración hechos sin invalidar
+    Los secretos quedan sólo en la memoria del proceso; en el cache de Django sólo se guarda la versión.
+    """
+    TTL_SECONDS = 300
+    VERSION_CHECK_SECONDS = 5
+    VERSION_KEY = 'ucasal2.config.version'
+
+    _MISSING = object()
+    _values = MappingProxyType({})
+    _version = None
+    _loaded_at = 0.0
+    _checked_at = 0.0
+    _lock = threading.Lock()
+    _stats = {'hits': 0, 'misses': 0, 'reloads': 0}
+    _stats_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, getter, key:str, on_error=_MISSING, **kwargs):
+        ''' on_error: valor a devolver (y guardar) si la lectura falla; si no se indica, la excepción se propaga '''
+        cls._refresh_if_stale()
+        snapshot_key = (getter.__name__, key, tuple(sorted(kwargs.items())))
+        value = cls._values.get(snapshot_key, cls._MISSING)
+        if value is not cls._MISSING:
+            cls._count('hits')
+            return value
+
+        cls._count('misses')
+        try:
+            value = getter(key, **kwargs)
+        except Exception:
+            if on_error is cls._MISSING:
+                raise
+            value = on_error
+        with cls._lock:
+            values = dict(cls._values)
+            values[snapshot_key] = value
+            cls._values = MappingProxyType(values)
+        return value
+
+    @classmethod
+    def invalidate(cls):
+        ''' Descarta el snapshot en este proceso y, por medio de la versión, en el resto de los workers '''
+        from django.core.cache import cache
+        version = f'{time.time():.6f}'
+        try:
+            cache.set(cls.VERSION_KEY, version, None)
+        except Exception as e:
+            SpLogger("athentose", "ConfigSnapshot").warning(f'No se pudo publicar la versión de la configuración: {e}')
+        cls._reset(version)
+        return version
+
+    @classmethod
+    def stats(cls)->dict:
+        with cls._stats_lock:
+            stats = dict(cls._stats)
+        return dict(stats, entries=len(cls._values), version=cls._version, age_seconds=round(time.monotonic() - cls._loaded_at, 1))
+
+    @classmethod
+    def _refresh_if_stale(cls):
+        now = time.monotonic()
+        if now - cls._checked_at < cls.VERSION_CHECK_SECONDS:
+            return
+        cls._checked_at = now
+        try:
+            from django.core.cache import cache
+            version = cache.get(cls.VERSION_KEY)
+        except Exception:
+            version = cls._version
+        if version != cls._version or now - cls._loaded_at > cls.TTL_SECONDS:
+            cls._reset(version)
+
+    @classmethod
+    def _reset(cls, version):
+        with cls._lock:
+            cls._values = MappingProxyType({})
+            cls._version = version
+            cls._loaded_at = time.monotonic()
+            cls._checked_at = cls._loaded_at
+        cls._count('reloads')
+
+    @classmethod
+    def _count(cls, name:str):
+        with cls._stats_lock:
+            cls._stats[name] += 1
+
+
+def _config(getter, key:str, **kwargs):
+    return ConfigSnapshot.get(getter, key, **kwargs)
+
+def _config_or_default(getter, key:str, default, **kwargs):
+    value = ConfigSnapshot.get(getter, key, on_error=None, **kwargs)
+    return default if value is None or value == '' else value
+
 class UcasalConfig:
+    ''' Los valores se leen de SpAthentoConfig a través de ConfigSnapshot '''
+    @staticmethod
+    def invalidate():
+        return ConfigSnapshot.invalidate()
+
     @staticmethod
     def token_svc_url()->str:
-        return SAC.get_str('ucasal.endpoint.gettoken.url')     
+        return _config(SAC.get_str, 'ucasal.endpoint.gettoken.url')     
 
     @staticmethod
     def token_svc_user()->str:
-        return SAC.get_str('ucasal.endpoint.gettoken.usuario')     
+        return _config(SAC.get_str, 'ucasal.endpoint.gettoken.usuario')     
 
     @staticmethod
     def token_svc_password()->str:
-        return SAC.get_str('ucasal.endpoint.gettoken.clave', is_secret=True)     
+        return _config(SAC.get_str, 'ucasal.endpoint.gettoken.clave', is_secret=True)     
+
+    @staticmethod
+    def token_cache_ttl_seconds()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.endpoint.gettoken.cache_ttl_seconds', 1800)
+
+    @staticmethod
+    def token_cache_refresh_margin_seconds()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.endpoint.gettoken.cache_refresh_margin_seconds', 120)
     
     @staticmethod
     def otp_validity_seconds()->int:
-        return SAC.get_int('ucasal.otp_validity_seconds')         
+        return _config(SAC.get_int, 'ucasal.otp_validity_seconds')         
 
     @staticmethod
     def qr_svc_url()->str:
-        return SAC.get_str('ucasal.endpoint.qr.url')         
+        return _config(SAC.get_str, 'ucasal.endpoint.qr.url')         
 
     @staticmethod
     def qr_svc_param_verify()->bool:
-        return SAC.get_bool('ucasal.endpoint.qr.param.verify')         
+        return _config(SAC.get_bool, 'ucasal.endpoint.qr.param.verify')         
+
+    @staticmethod
+    def qr_engine()->str:
+        ''' 'remote' (servicio de UCASAL) o 'local' (generación en proceso, con el servicio remoto como respaldo) '''
+        return _config_or_default(SAC.get_str, 'ucasal.qr.engine', 'remote')
+
+    @staticmethod
+    def qr_local_error_correction()->str:
+        return _config_or_default(SAC.get_str, 'ucasal.qr.local.error_correction', 'M')
+
+    @staticmethod
+    def qr_local_box_size()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.qr.local.box_size', 10)
+
+    @staticmethod
+    def qr_local_border()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.qr.local.border', 4)
 
     @staticmethod
     def stamps_svc_url()->str:
-        return SAC.get_str('ucasal.endpoint.stamps.url')    
+        return _config(SAC.get_str, 'ucasal.endpoint.stamps.url')    
+
+    @staticmethod
+    def stamps_batch_svc_url()->str:
+        ''' Vacío si el servicio de sellado no admite registrar varios hashes en una sola llamada '''
+        return _config_or_default(SAC.get_str, 'ucasal.endpoint.stamps.batch_url', '')
+
+    @staticmethod
+    def stamps_batch_concurrency()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.endpoint.stamps.batch_concurrency', 4)
+
+    @staticmethod
+    def bfa_anchor_mode()->str:
+        ''' 'direct' (un sello por hash) o 'merkle' (un sello por raíz de Merkle de los hashes pendientes) '''
+        return _config_or_default(SAC.get_str, 'ucasal.bfa.anchor_mode', 'direct')
+
+    @staticmethod
+    def bfa_anchor_window_seconds()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.bfa.anchor_window_seconds', 300)
+
+    @staticmethod
+    def bfa_anchor_stuck_seconds()->int:
+        ''' Un lote sin respuesta de registro después de este tiempo se considera abandonado y sus hashes se liberan '''
+        return _config_or_default(SAC.get_int, 'ucasal.bfa.anchor_stuck_seconds', 900)
+
+    @staticmethod
+    def bfa_anchor_max_leaves()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.bfa.anchor_max_leaves', 10000)
+
+    @staticmethod
+    def bfa_anchor_bfaresponse_endpoint()->str:
+        return _config(SAC.get_str, 'ucasal.bfa.anchor_bfaresponse_endpoint')
+
+    @staticmethod
+    def outbox_enabled()->bool:
+        ''' False: las notificaciones de cambio de estado a UCASAL se envían en línea (comportamiento original) '''
+        return _config_or_default(SAC.get_bool, 'ucasal.outbox.enabled', True)
+
+    @staticmethod
+    def outbox_max_attempts()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.outbox.max_attempts', 10)
+
+    @staticmethod
+    def outbox_retry_base_seconds()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.outbox.retry_base_seconds', 30)
+
+    @staticmethod
+    def outbox_retry_max_seconds()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.outbox.retry_max_seconds', 3600)
+
+    @staticmethod
+    def pipeline_stage_budget_seconds(pipeline:str, stage:str, default:float)->float:
+        ''' 'ucasal.pipeline.<pipeline>.<stage>.budget_seconds' (p.ej. 'ucasal.pipeline.actas.registerotp.qr_image.budget_seconds') '''
+        return float(_config_or_default(SAC.get_str, f'ucasal.pipeline.{pipeline}.{stage}.budget_seconds', default))
+
+    @staticmethod
+    def metrics_enabled()->bool:
+        return _config_or_default(SAC.get_bool, 'ucasal.metrics.enabled', True)
+
+    @staticmethod
+    def metrics_flush_seconds()->int:
+        ''' Cada cuánto cada proceso publica sus métricas en el cache de Django para la vista agregada '''
+        return _config_or_default(SAC.get_int, 'ucasal.metrics.flush_seconds', 15)
+
+    @staticmethod
+    def singleflight_enabled()->bool:
+        return _config_or_default(SAC.get_bool, 'ucasal.singleflight.enabled', True)
+
+    @staticmethod
+    def singleflight_cross_process()->bool:
+        return _config_or_default(SAC.get_bool, 'ucasal.singleflight.cross_process', False)
+
+    @staticmethod
+    def singleflight_lock_dir()->str:
+        from django.conf import settings
+        return _config_or_default(SAC.get_str, 'ucasal.singleflight.lock_dir', os.path.join(settings.MEDIA_ROOT, 'ucasal2', 'singleflight'))
+
+    @staticmethod
+    def singleflight_wait_timeout_seconds()->float:
+        return float(_config_or_default(SAC.get_str, 'ucasal.singleflight.wait_timeout_seconds', 60))
+
+    @staticmethod
+    def signing_verify_persisted_hash()->bool:
+        ''' True: después de guardar un PDF firmado se vuelve a leer del disco y se compara el SHA-256 completo (por defecto sólo el tamaño) '''
+        return _config_or_default(SAC.get_bool, 'ucasal.signing.verify_persisted_hash', False)
+
+    @staticmethod
+    def designaciones_batch_workers()->int:
+        ''' Threads que obtienen QR y firman en paralelo en la firma en lote de designaciones '''
+        return _config_or_default(SAC.get_int, 'ucasal.designaciones.batch.workers', 4)
+
+    @staticmethod
+    def designaciones_batch_register_chunk()->int:
+        ''' Hashes por llamada a BfaAnchoring.register_batch en la firma en lote de designaciones '''
+        return _config_or_default(SAC.get_int, 'ucasal.designaciones.batch.register_chunk', 50)
+
+    @staticmethod
+    def designaciones_batch_max_documents()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.designaciones.batch.max_documents', 500)
+
+    @staticmethod
+    def signing_journal_enabled()->bool:
+        ''' True: las firmas anotan cada etapa completada (ucasal2_signing_journal) y los reintentos retoman desde ahí '''
+        return _config_or_default(SAC.get_bool, 'ucasal.signing.journal_enabled', True)
+
+    @staticmethod
+    def titulos_batch_workers()->int:
+        ''' Títulos que se firman en paralelo en la firma masiva (cada uno firma además sus dos hijos en paralelo) '''
+        return _config_or_default(SAC.get_int, 'ucasal.titulos.batch.workers', 4)
+
+    @staticmethod
+    def signing_engine()->str:
+        ''' 'signer' (SpPdfSimpleSigner, arma la capa de firma en cada documento), 'overlay' (SignatureOverlay, la arma una vez y la reutiliza) o 'incremental' (la capa de SignatureOverlay como actualización incremental del PDF) '''
+        return _config_or_default(SAC.get_str, 'ucasal.signing.engine', 'signer')
+
+    @staticmethod
+    def signing_qr_in_memory()->bool:
+        ''' True: la imagen del QR se pasa al firmador desde memoria (memfd) en lugar de un PNG temporal en disco '''
+        return _config_or_default(SAC.get_bool, 'ucasal.signing.qr_in_memory', True)
+
+    @staticmethod
+    def hash_cache_enabled()->bool:
+        ''' True: get_pdf_hash reutiliza el hash guardado en el documento mientras el binario no cambie (path, tamaño y mtime) '''
+        return _config_or_default(SAC.get_bool, 'ucasal.hash_cache.enabled', True)
 
     @staticmethod
     def change_acta_svc_url()->str:
-        return SAC.get_str('ucasal.endpoint.change_acta.url')
+        return _config(SAC.get_str, 'ucasal.endpoint.change_acta.url')
     
     @staticmethod
     def change_equivalencia_svc_url()->str:
-        return SAC.get_str('ucasal.endpoint.change_equivalencia.url')
+        return _config(SAC.get_str, 'ucasal.endpoint.change_equivalencia.url')
     
     @staticmethod
     def change_designaciones_svc_url()->str:
-        return SAC.get_str('ucasal.endpoint.change_designaciones.url')
+        return _config(SAC.get_str, 'ucasal.endpoint.change_designaciones.url')
 
     @staticmethod
     def shorten_url_svc_url()->str:
-        return SAC.get_str('ucasal.endpoint.acortar_url.url')    
+        return _config(SAC.get_str, 'ucasal.endpoint.acortar_url.url')    
 
     @staticmethod
     def shorten_url_svc_env()->str:
-        return SAC.get_str('ucasal.endpoint.acortar_url.env')
+        return _config(SAC.get_str, 'ucasal.endpoint.acortar_url.env')
+
+    @staticmethod
+    def qr_cache_memory_max_bytes()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.qr_cache.memory_max_bytes', 16 * 1024 * 1024)
+
+    @staticmethod
+    def qr_cache_disk_max_bytes()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.qr_cache.disk_max_bytes', 512 * 1024 * 1024)
+
+    @staticmethod
+    def qr_cache_dir()->str:
+        from django.conf import settings
+        return _config_or_default(SAC.get_str, 'ucasal.qr_cache.dir', os.path.join(settings.MEDIA_ROOT, 'ucasal2', 'qr_cache'))
 
     @staticmethod
     def acta_validation_url_template()->str:
-        return SAC.get_str('ucasal.acta.validation_url_template')
+        return _config(SAC.get_str, 'ucasal.acta.validation_url_template')
     
     @staticmethod
     def otp_validation_url_template()->str:
-        return SAC.get_str('ucasal.endpoint.otp.validation_url_template')
+        return _config(SAC.get_str, 'ucasal.endpoint.otp.validation_url_template')
     
     @staticmethod
     def equivalencia_validation_url_template()->str:
-        return SAC.get_str('ucasal.equivalencia.validation_url_template')
+        return _config(SAC.get_str, 'ucasal.equivalencia.validation_url_template')
     
     @staticmethod
     def equivalencia_bfaresponse_endpoint()->str:
-        return SAC.get_str('ucasal.equivalencia.bfaresponse_endpoint')
+        return _config(SAC.get_str, 'ucasal.equivalencia.bfaresponse_endpoint')
     
     @staticmethod
     def equivalencia_nro_resolucion_endpoint()->str:
-        return SAC.get_str('ucasal.equivalencia.nro_resolucion_endpoint')
+        return _config(SAC.get_str, 'ucasal.equivalencia.nro_resolucion_endpoint')
     
     @staticmethod
     def designaciones_bfaresponse_endpoint()->str:
-        return SAC.get_str('ucasal.designaciones.bfaresponse_endpoint')
+        return _config(SAC.get_str, 'ucasal.designaciones.bfaresponse_endpoint')
     
     @staticmethod
     def designaciones_validation_url_template()->str:
-        return SAC.get_str('ucasal.titulo.validation_url_template')
+        return _config(SAC.get_str, 'ucasal.titulo.validation_url_template')
+
+    @staticmethod
+    def titulos_update_finalize_url()->str:
+        return _config_or_default(SAC.get_str, 'ucasal.endpoint.titulos.update_finalize.url', 'https://sistemasweb-desa.ucasal.edu.ar/v1/titulos/update-finalize')
+
+    @staticmethod
+    def titulos_update_rejected_url()->str:
+        return _config_or_default(SAC.get_str, 'ucasal.endpoint.titulos.update_rejected.url', 'https://sistemasweb-desa.ucasal.edu.ar/v1/titulos/update-rejected')
+
+    @staticmethod
+    def http_pool_connections()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.http.pool_connections', 10)
+
+    @staticmethod
+    def http_pool_maxsize()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.http.pool_maxsize', 20)
+
+    @staticmethod
+    def http_max_retries()->int:
+        return _config_or_default(SAC.get_int, 'ucasal.http.max_retries', 3)
+
+    @staticmethod
+    def http_backoff_factor()->float:
+        return float(_config_or_default(SAC.get_str, 'ucasal.http.backoff_factor', 0.5))
+
+    @staticmethod
+    def http_backoff_jitter()->float:
+        return float(_config_or_default(SAC.get_str, 'ucasal.http.backoff_jitter', 0.5))
+
+    @staticmethod
+    def circuit_breaker_enabled()->bool:
+        return _config_or_default(SAC.get_bool, 'ucasal.circuit_breaker.enabled', True)
+
+    @staticmethod
+    def circuit_breaker_setting(endpoint_name:str, name:str, default:float)->float:
+        ''' 'ucasal.circuit_breaker.<endpoint_name>.<name>', o el valor general 'ucasal.circuit_breaker.<name>' '''
+        general = _config_or_default(SAC.get_str, f'ucasal.circuit_breaker.{name}', default)
+        return float(_config_or_default(SAC.get_str, f'ucasal.circuit_breaker.{endpoint_name}.{name}', general))
+
+    @staticmethod
+    def http_timeout(endpoint_name:str)->tuple:
+        ''' (connect, read) en segundos para el endpoint 'ucasal.http.<endpoint_name>.*' '''
+        connect = float(_config_or_default(SAC.get_str, f'ucasal.http.{endpoint_name}.connect_timeout', 5))
+        read = float(_config_or_default(SAC.get_str, f'ucasal.http.{endpoint_name}.read_timeout', 30))
+        return (connect, read)
 
 def default_permissions(func):
     @api_view(['POST', 'GET', 'DELETE', 'PUT', 'OPTIONS'])
@@ -163,6 +481,15 @@ def default_permissions(func):
         return func(*args, **kargs)
     return f
 
+def request_user(request):
+    ''' Usuario de la sesión de Django. Con default_permissions DRF no autentica, así que su request.user es anónimo '''
+    return getattr(getattr(request, '_request', request), 'user', None)
+
+def is_staff_request(request)->bool:
+    ''' True si el usuario de la sesión es staff o superusuario '''
+    user = request_user(request)
+    return bool(user and user.is_authenticated and (user.is_staff or user.is_superuser))
+
 def getJsonBody(request):
     try:
         return decodeJSON(request.data) if type(request.data) != dict else request.data
@@ -230,14 +557,143 @@ def get_arg_time():
 
     return formatted_time
 
+# Tamaño del buffer de lectura para calcular hashes de archivos
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def sha256_file(path:str, chunk_size:int=HASH_CHUNK_SIZE, use_mmap:bool=False)->str:
+    '''
+    SHA-256 de un archivo sin cargarlo entero en memoria.
+    - Por defecto lee en bloques de 'chunk_size' sobre un único buffer reutilizado (readinto)
+    - use_mmap=True: mapea el archivo y lo pasa entero a hashlib (sin copias, pero las páginas leídas cuentan en el RSS)
+    En ambos casos hashlib libera el GIL mientras procesa cada bloque, así que otros threads pueden seguir.
+    '''
+    digest = hashlib.sha256()
+    with open(path, mode='rb') as f:
+        if use_mmap:
+            import mmap
+            if os.fstat(f.fileno()).st_size == 0:
+                return digest.hexdigest()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+            return digest.hexdigest()
+
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+# Feature donde se guarda el último SHA-256 calculado del binario, con la identidad del archivo al momento del cálculo
+PDF_HASH_FEATURE = 'ucasal2.pdf.sha256'
+
+def _file_identity(path:str)->dict:
+    stat = os.stat(path)
+    return {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def _store_pdf_hash(fil, digest:str, identity:dict):
+    try:
+        fil.set_feature(PDF_HASH_FEATURE, encodeJSON(dict(identity, sha256=digest)))
+    except Exception as e:
+        # El cache es solo una optimización: si no se puede guardar, la próxima vez se recalcula
+        SpLogger("athentose", "utils.get_pdf_hash").warning(f'No se pudo guardar el hash del documento {fil.uuid}: {e}')
+
 def get_pdf_hash(fil):
+    '''
+    SHA-256 del binario actual del documento.
+    Con 'ucasal.hash_cache.enabled' se reutiliza el hash guardado en el feature PDF_HASH_FEATURE mientras el archivo
+    tenga el mismo path, tamaño y mtime; si cambió alguno, se recalcula y se actualiza el feature.
+    '''
     path = fil.file.path
-    byte_content = None
-    with open(path, mode='rb') as f:
-        byte_content = f.read()
-    hash = hashlib.sha256(byte_content).hexdigest()
-    return hash
+    if not UcasalConfig.hash_cache_enabled():
+        return sha256_file(path)
 
+    identity = _file_identity(path)
+    try:
+        cached = decodeJSON(fil.gfv(PDF_HASH_FEATURE) or 'null')
+    except (TypeError, ValueError):
+        cached = None
+    if isinstance(cached, dict) and cached.get('sha256') and all(cached.get(k) == v for k, v in identity.items()):
+        return cached['sha256']
+
+    digest = sha256_file(path)
+    # Si el archivo cambió mientras se leía, no se guarda: la identidad ya no corresponde al hash
+    if _file_identity(path) == identity:
+        _store_pdf_hash(fil, digest, identity)
+    return digest
+
+@contextmanager
+def qr_image_path(qr_bytes:bytes):
+    '''
+    Path de la imagen del QR para QRInfo.image_path (SpPdfSimpleSigner sólo recibe paths), sin escribirla a disco:
+    - Linux: archivo anónimo en memoria (memfd) accesible como /proc/self/fd/<n>; se libera al cerrar el descriptor
+    - Sin memfd, o con 'ucasal.signing.qr_in_memory' en False: archivo temporal con nombre único en MEDIA_TMP
+    En los dos casos cada llamada tiene su propio archivo y se libera al salir del bloque, aunque haya un error.
+    '''
+    if UcasalConfig.signing_qr_in_memory() and hasattr(os, 'memfd_create'):
+        fd = os.memfd_create('ucasal2_qr', os.MFD_CLOEXEC)
+        try:
+            view = memoryview(qr_bytes)
+            while view:
+                view = view[os.write(fd, view):]
+            yield f'/proc/self/fd/{fd}'
+        finally:
+            os.close(fd)
+        return
+
+    from tempfile import NamedTemporaryFile
+    from django.conf import settings
+    with NamedTemporaryFile(dir=settings.MEDIA_TMP, prefix='ucasal2_qr_', suffix='.png') as qr_file:
+        qr_file.write(qr_bytes)
+        qr_file.flush()
+        yield qr_file.name
+
+def save_signed_pdf(fil, pdf_stream, filename:str=None)->str:
+    '''
+    Guarda el PDF firmado (el io.BytesIO que devuelve SpPdfSimpleSigner) como binario de 'fil' y devuelve su SHA-256.
+    El hash se calcula sobre los mismos bytes en memoria que se entregan a update_binary, así no hace falta volver a
+    leer el archivo del disco para registrarlo en BFA. Como control se compara el tamaño del archivo guardado; con
+    'ucasal.signing.verify_persisted_hash' también su SHA-256, a costa de una segunda lectura completa del archivo.
+    '''
+    from django.core.files import File as DjangoFile
+
+    with pdf_stream.getbuffer() as view:
+        size = view.nbytes
+        digest = hashlib.sha256(view).hexdigest()
+    if not size:
+        raise AthentoseError('El PDF firmado está vacío')
+
+    filename = filename or f'{fil.filename}.pdf'
+    pdf_stream.seek(0)
+    fil.update_binary(DjangoFile(pdf_stream, filename), filename)
+
+    path = fil.file.path
+    identity = _file_identity(path)
+    persisted_size = identity['size']
+    if persisted_size != size:
+        raise AthentoseError(f'El PDF firmado guardado en {path} tiene {persisted_size} bytes, se esperaban {size}')
+    if UcasalConfig.signing_verify_persisted_hash() and sha256_file(path) != digest:
+        raise AthentoseError(f'El SHA-256 del PDF firmado guardado en {path} no coincide con el de los bytes firmados')
+    if UcasalConfig.hash_cache_enabled():
+        _store_pdf_hash(fil, digest, identity)
+    return digest
+
+
+
+def db_connection_closing(func):
+    ''' Para tareas que corren en threads secundarios: cierra la conexión a la base que Django abre en cada thread '''
+    from functools import wraps
+    from django.db import connection
+
+    @wraps(func)
+    def f(*args, **kargs):
+        try:
+            return func(*args, **kargs)
+        finally:
+            connection.close()
+    return f
 
 
 def dumper(obj):